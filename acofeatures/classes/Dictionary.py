@@ -1,11 +1,43 @@
 import os
+import copy
 import json
 import math
+import multiprocessing
+import random
 import re
+import numpy
+from collections import OrderedDict
+from SimilarityMatrix import SimilarityMatrix
 from config import dirconfig
 from config import fileconfig
 
 
+# Maximum number of rows of the memory-mapped similarity matrix kept in memory (least recently used rows
+# are removed), so searches on large dictionaries do not end up with the whole matrix in memory
+similarityStoreCacheSize = 4096
+
+# Dictionary and term-document matrix used by shard workers. They are inherited by the workers
+# when the pool is created, so they are not sent with each shard
+shardDictionary = None
+shardTermDocument = None
+
+
+def calculateSimilarityShard(shardTask):
+    """
+    Calculate similarities of a block of tokens and store them in a shard file
+    :param shardTask: List [shard: shard number, start: first token ID, end: token ID after the last one,
+                      file: shard file name]
+    :return:
+    """
+    blockSimilarities = shardDictionary.calculateBlockSimilarities(termDocument=shardTermDocument,
+                                                                   blockStart=shardTask['start'],
+                                                                   blockEnd=shardTask['end'])
+
+    with open(shardDictionary.dictionaryPath + shardTask['file'], 'w') as shardFile:
+        shardFile.write(json.dumps(blockSimilarities, separators=(',', ':')))
+        shardFile.close()
+
+
 class Dictionary:
     def __init__(self, dictionaryName, folderHierarchy=''):
         """
@@ -31,8 +63,35 @@ class Dictionary:
         # Category list
         self.categories = {}
 
-        # Similarity matrix between tokens
-        self.similarityMatrix = {}
+        # Similarity values between tokens. Each pair is stored once, under the ordered key (token1, token2)
+        self.similarityPairs = {}
+
+        # Similar tokens (non-zero similarity) for each token
+        self.similarityNeighbours = {}
+
+        # Similarity values of each token raised to the last exponent used, when rows are not cached
+        # (see getSimilarityPowers) {token: {token: value ** exponent}}
+        self.similarityPowerRows = {}
+        self.similarityPowerExponent = None
+
+        # Number of similarity rows requested by searches (lookups), and requested rows which were not in
+        # memory (misses: read from binary files, calculated or created from similarity pairs)
+        self.similarityLookups = 0
+        self.similarityMisses = 0
+
+        # Memory-mapped similarity matrix, used instead of similarityPairs when binary files exist. Rows
+        # are read when a token is used and kept in the similarity cache
+        self.similarityStore = None
+
+        # Similarity rows read from binary files or calculated on demand (when the cache is started), used
+        # instead of similarityPairs. Rows are ordered from least to most recently used
+        # {token: [similar tokens, {token: value}, [exponent, {token: value ** exponent}]]}
+        self.similarityCache = None
+        self.similarityCacheSize = 0
+        self.similarityCacheHits = 0
+        self.similarityCacheMisses = 0
+        self.similarityCacheTokenIds = {}
+        self.similarityTermDocument = None
 
         # Count of documents in index
         self.documentCount = 0
@@ -286,6 +345,92 @@ class Dictionary:
         """
         return self.getTopFeatures(topNumber=topNumber, onlyTokens=onlyTokens, method='gain_ratio')
 
+    def getRestrictedTokens(self, minDocumentFrequency=0, maxDocumentFrequency=0, stopwords=None, tokenPattern=None,
+                            topNumber=0, topMethod='information_gain'):
+        """
+        Get tokens fulfilling a set of restrictions, using the values stored in the dictionary
+        :param minDocumentFrequency: Minimum number of documents containing the token
+        :param maxDocumentFrequency: Maximum number of documents containing the token (0 for no limit). A float
+                                     value lower or equal than 1 is a proportion of the number of documents
+        :param stopwords: Set of tokens to exclude (None to keep all the tokens)
+        :param tokenPattern: Regular expression that tokens must match (None to keep all the tokens)
+        :param topNumber: Keep only the top tokens among the ones fulfilling previous restrictions (0 to keep all)
+        :param topMethod: Value to choose top tokens (information_gain, gain_ratio or document_frequency)
+        :return: List of tokens, in the same order as postings
+        """
+        if isinstance(maxDocumentFrequency, float) and maxDocumentFrequency <= 1:
+            maxDocumentFrequency *= self.documentCount
+
+        if tokenPattern is not None:
+            tokenPattern = re.compile(tokenPattern)
+
+        restrictedTokens = []
+        for token in self.postings:
+            documentFrequency = len(self.postingDocuments.get(token, {}))
+
+            if documentFrequency < minDocumentFrequency:
+                continue
+
+            if 0 < maxDocumentFrequency < documentFrequency:
+                continue
+
+            if stopwords is not None and token in stopwords:
+                continue
+
+            if tokenPattern is not None and tokenPattern.search(token) is None:
+                continue
+
+            restrictedTokens.append(token)
+
+        if 0 < topNumber < len(restrictedTokens):
+            if topMethod == 'gain_ratio':
+                tokenValues = self.tokenGainRatio
+            elif topMethod == 'document_frequency':
+                tokenValues = dict([(token, len(self.postingDocuments.get(token, {}))) for token in restrictedTokens])
+            else:
+                tokenValues = self.tokenInfoGain
+
+            # Tokens with the same value keep postings order
+            topTokens = set(sorted(restrictedTokens, key=lambda token: tokenValues.get(token, 0),
+                                   reverse=True)[0:topNumber])
+            restrictedTokens = [token for token in restrictedTokens if token in topTokens]
+
+        return restrictedTokens
+
+    def getRestrictedDictionary(self, tokens):
+        """
+        Create a dictionary containing only a subset of tokens, without modifying this dictionary
+        or the files stored in disk. Similarity values between tokens of the subset are copied,
+        the rest of values (documents, TF-IDF, information gain) are shared with this dictionary
+        :param tokens: List of tokens to keep
+        :return: Dictionary
+        """
+        tokenSet = set(tokens)
+
+        restrictedDictionary = copy.copy(self)
+        restrictedDictionary.postings = list(tokens)
+        restrictedDictionary.termCount = len(restrictedDictionary.postings)
+        restrictedDictionary.postingDocuments = dict(
+            [(token, self.postingDocuments[token]) for token in tokens if token in self.postingDocuments])
+
+        # Keep similarity values between tokens of the subset
+        restrictedDictionary.similarityPairs = {}
+        for tokenPair, similarityValue in self.similarityPairs.iteritems():
+            if tokenPair[0] in tokenSet and tokenPair[1] in tokenSet:
+                restrictedDictionary.similarityPairs[tokenPair] = similarityValue
+
+        restrictedDictionary.createSimilarityNeighbours()
+        restrictedDictionary.similarityPowerRows = {}
+
+        if self.similarityStore is not None:
+            restrictedDictionary.similarityStore = self.similarityStore.getSubMatrix(tokens=tokens)
+            restrictedDictionary.createSimilarityCache(cacheSize=self.similarityCacheSize)
+        elif self.similarityCache is not None:
+            # Rows calculated on demand only contain tokens of the subset
+            restrictedDictionary.startSimilarityCache(cacheSize=self.similarityCacheSize)
+
+        return restrictedDictionary
+
     def calculateCosineSim(self, documentList, documentsToken1, documentsToken2):
         """
         Calculate cosine similarity between
@@ -307,53 +452,415 @@ class Dictionary:
 
         return 0
 
-    def calculateAllSimilarities(self):
+    def getTermDocumentMatrix(self):
         """
-        Calculate similarities between tokens. This method stores values with no redundancy, i.e.
-        for similarities values sim(a,b) = sim(b,a) is only stored once.
+        Build sparse term-document matrix from posting documents (token counts), as arrays of non-zero
+        entries ordered by token. Token ID is the position in postings and documents receive consecutive
+        IDs. Entries are also ordered by document, to join entries of the same document
+        :return: List [tokens: token ID of each entry, documents: document ID of each entry, values: token count
+                 of each entry, token_indptr: first entry of each token, document_count: number of documents,
+                 squared_norms: squared norm of each token, document_tokens and
+                 document_values: entries ordered by document and token ID, entry_positions: position of each
+                 entry in document ordered entries, entry_document_starts and entry_document_ends: start and
+                 end of the document of each entry]
+        """
+        documentIds = {}
+        entryTokens = []
+        entryDocuments = []
+        entryValues = []
+
+        for tokenId, token in enumerate(self.postings):
+            tokenDocuments = self.postingDocuments[token]
+
+            for documentId in tokenDocuments:
+                if documentId not in documentIds:
+                    documentIds[documentId] = len(documentIds)
+
+                entryTokens.append(tokenId)
+                entryDocuments.append(documentIds[documentId])
+                entryValues.append(tokenDocuments[documentId])
+
+        tokenCount = len(self.postings)
+        entryTokens = numpy.array(entryTokens, dtype=numpy.int64)
+        entryDocuments = numpy.array(entryDocuments, dtype=numpy.int64)
+        entryValues = numpy.array(entryValues, dtype=numpy.float64)
+
+        tokenIndptr = numpy.zeros(tokenCount + 1, dtype=numpy.int64)
+        tokenIndptr[1:] = numpy.cumsum(numpy.bincount(entryTokens, minlength=tokenCount))
+
+        documentOrder = numpy.lexsort((entryTokens, entryDocuments))
+        documentIndptr = numpy.zeros(len(documentIds) + 1, dtype=numpy.int64)
+        documentIndptr[1:] = numpy.cumsum(numpy.bincount(entryDocuments, minlength=len(documentIds)))
+
+        entryPositions = numpy.zeros(len(entryTokens), dtype=numpy.int64)
+        entryPositions[documentOrder] = numpy.arange(len(entryTokens))
+
+        return {
+            'tokens': entryTokens,
+            'documents': entryDocuments,
+            'values': entryValues,
+            'token_indptr': tokenIndptr,
+            'document_count': len(documentIds),
+            'squared_norms': numpy.bincount(entryTokens, weights=entryValues ** 2, minlength=tokenCount),
+            'document_tokens': entryTokens[documentOrder],
+            'document_values': entryValues[documentOrder],
+            'entry_positions': entryPositions,
+            'entry_document_starts': documentIndptr[entryDocuments],
+            'entry_document_ends': documentIndptr[entryDocuments + 1]
+        }
+
+    def calculateBlockSimilarities(self, termDocument, blockStart, blockEnd, lowerTokens=False):
+        """
+        Calculate similarities between a block of tokens and the tokens having equal or higher token ID.
+        Dot products are obtained by joining the entries of each document, and divided by the norms
+        of both tokens to obtain cosine similarities
+        :param termDocument: Term-document matrix obtained with getTermDocumentMatrix
+        :param blockStart: First token ID of the block
+        :param blockEnd: Token ID after the last one of the block
+        :param lowerTokens: Also calculate similarities with tokens having lower token ID (complete rows)
+        :return: Inverted similarities {token: {token: value}}, only values different from zero
+        """
+        tokenCount = len(self.postings)
+        blockEntries = slice(termDocument['token_indptr'][blockStart], termDocument['token_indptr'][blockEnd])
+        entryTokens = termDocument['tokens'][blockEntries]
+
+        # Join each entry with the entries of the same document having equal or higher token ID
+        # (all the entries of the document for complete rows)
+        if lowerTokens is True:
+            pairStarts = termDocument['entry_document_starts'][blockEntries]
+        else:
+            pairStarts = termDocument['entry_positions'][blockEntries]
+        pairLengths = termDocument['entry_document_ends'][blockEntries] - pairStarts
+        pairPositions = numpy.arange(pairLengths.sum()) + numpy.repeat(
+            pairStarts - (numpy.cumsum(pairLengths) - pairLengths), pairLengths)
+
+        pairRows = numpy.repeat(entryTokens - blockStart, pairLengths)
+        pairValues = numpy.repeat(termDocument['values'][blockEntries], pairLengths) * \
+            termDocument['document_values'][pairPositions]
+
+        # Dot products between tokens of the block and all the tokens
+        dotProducts = numpy.bincount(pairRows * tokenCount + termDocument['document_tokens'][pairPositions],
+                                     weights=pairValues, minlength=(blockEnd - blockStart) * tokenCount)
+        dotProducts = dotProducts.reshape((blockEnd - blockStart, tokenCount))
+
+        blockSimilarities = {}
+        for blockRow in range(0, blockEnd - blockStart):
+            tokenFromId = blockStart + blockRow
+
+            tokenToIds = numpy.flatnonzero(dotProducts[blockRow])
+            cosineSims = dotProducts[blockRow, tokenToIds] / numpy.sqrt(
+                termDocument['squared_norms'][tokenFromId] * termDocument['squared_norms'][tokenToIds])
+
+            tokenFromSimilarities = {}
+            for tokenToId, cosineSim in zip(tokenToIds.tolist(), cosineSims.tolist()):
+                if cosineSim > 0:
+                    tokenFromSimilarities[self.postings[tokenToId]] = round(float(1) / cosineSim, 4)
+
+            if len(tokenFromSimilarities) > 0:
+                blockSimilarities[self.postings[tokenFromId]] = tokenFromSimilarities
+
+        return blockSimilarities
+
+    def calculateAllSimilarities(self, blockSize=256):
+        """
+        Calculate similarities between tokens. Cosine similarities are obtained from the sparse
+        term-document matrix (token counts of posting documents): squared norms of each token are
+        calculated once, and dot products are calculated for blocks of tokens. Each pair is
+        calculated and stored once, under the token with lower position in postings.
 
         Also, for similarities equal to zero, value is not stored. At the end of the method,
         resulting file is stored.
 
         Final storage will return the inverted similarity 1/sim(a,b)
+        :param blockSize: Number of tokens calculated at the same time. Memory of each block is
+                          proportional to blockSize * number of tokens
         :return:
         """
         print '[Calculating similarities between tokens]'
-        similarityMatrix = {}
+        similarityRows = {}
 
-        # Go token by token to calculate the similarities between the rest of tokens
-        for tokenFrom in self.postings:
-            documentFrom = self.postingDocuments[tokenFrom]
-            documentFromItems = set(documentFrom.keys())
+        termDocument = self.getTermDocumentMatrix()
 
-            # Get rest of tokens to calculate values
-            for tokenTo in self.postings:
-                if not (tokenFrom == tokenTo
-                        and tokenTo in similarityMatrix
-                        and tokenFrom in similarityMatrix[tokenTo]
-                        ):
-                    documentTo = self.postingDocuments[tokenTo]
-                    similarDocuments = documentFromItems.intersection(documentTo.keys())
+        for blockStart in range(0, len(self.postings), blockSize):
+            similarityRows.update(self.calculateBlockSimilarities(termDocument=termDocument, blockStart=blockStart,
+                                                                  blockEnd=min(blockStart + blockSize,
+                                                                               len(self.postings))))
+
+        # Store calculation results in file (shards of a previous calculation are not used anymore)
+        self.removeSimilarityFiles()
+        with open(self.dictionaryPath + fileconfig.similarityFileName, 'w') as similarityFile:
+            similarityFile.write(json.dumps(similarityRows, separators=(',', ':')))
+            similarityFile.close()
 
-                    # If there are similar documents, calculate cosine similarity
-                    if len(similarDocuments) > 0:
-                        cosineSim = self.calculateCosineSim(documentList=similarDocuments,
-                                                            documentsToken1=documentFrom,
-                                                            documentsToken2=documentTo)
+        # Store similarities in class
+        self.similarityPairs = {}
+        self.addSimilarityRows(similarityRows)
+
+    def calculateShardedSimilarities(self, numberProcesses=None, memoryLimit=1024):
+        """
+        Calculate similarities between tokens in worker processes. Tokens are divided into blocks,
+        and each block is calculated by a worker and stored in its own shard file, so similarities
+        are never kept in memory all together. Each pair is stored once, under the token with lower
+        position in postings. Shard files are listed in an index file, used by loadSimilarities
+        :param numberProcesses: Number of worker processes (None to use all the processors)
+        :param memoryLimit: Approximate memory limit in MB for the blocks calculated at the same time
+        :return:
+        """
+        global shardDictionary
+        global shardTermDocument
+
+        if numberProcesses is None:
+            numberProcesses = multiprocessing.cpu_count()
+
+        numberProcesses = max(numberProcesses, 1)
+        tokenCount = len(self.postings)
+
+        # Dot products of a block need 8 bytes per token pair, twice while they are created. Tokens with
+        # lower position have more pairs to calculate, so each process receives several blocks
+        blockSize = int(memoryLimit * 1024 * 1024 / numberProcesses / (16 * max(tokenCount, 1)))
+        blockSize = max(min(blockSize, int(math.ceil(float(tokenCount) / (numberProcesses * 4)))), 1)
+
+        print '[Calculating similarities between tokens: ' + str(numberProcesses) + ' processes, ' + \
+              str(blockSize) + ' tokens per shard]'
+
+        self.removeSimilarityFiles()
+
+        shardDictionary = self
+        shardTermDocument = self.getTermDocumentMatrix()
+
+        shardTasks = []
+        for shardNumber, blockStart in enumerate(range(0, tokenCount, blockSize)):
+            shardTasks.append({'shard': shardNumber, 'start': blockStart,
+                               'end': min(blockStart + blockSize, tokenCount),
+                               'file': fileconfig.similarityShardFilePrefix + str(shardNumber) + '.json'})
+
+        try:
+            if numberProcesses > 1:
+                # Workers inherit dictionary and term-document matrix when the pool is created
+                shardPool = multiprocessing.Pool(processes=numberProcesses)
+                try:
+                    shardPool.map(calculateSimilarityShard, shardTasks, chunksize=1)
+                    shardPool.close()
+                finally:
+                    shardPool.terminate()
+                    shardPool.join()
+            else:
+                for shardTask in shardTasks:
+                    calculateSimilarityShard(shardTask)
+        finally:
+            shardDictionary = None
+            shardTermDocument = None
+
+        # Index file is written when all the shards are stored
+        with open(self.dictionaryPath + fileconfig.similarityShardIndexFileName, 'w') as shardIndexFile:
+            shardIndexFile.write(json.dumps({'terms': tokenCount, 'shards': shardTasks}, separators=(',', ':')))
+            shardIndexFile.close()
+
+    def getMinHashSignatures(self, termDocument, numberHashes, seed=0):
+        """
+        Calculate MinHash signatures of the documents of each token. For each hash function, the
+        probability that two tokens have the same minimum value is the Jaccard similarity of their documents
+        :param termDocument: Term-document matrix obtained with getTermDocumentMatrix
+        :param numberHashes: Number of hash functions
+        :param seed: Seed to generate the hash functions
+        :return: Matrix of minimum hash values (one row for each hash function, one column for each token ID)
+        """
+        # Hash functions (a * document + b) mod p, with p a prime number higher than the number of documents
+        hashPrime = 2147483647
+        hashRandom = random.Random(seed)
 
-                        if cosineSim > 0:
-                            if tokenFrom not in similarityMatrix:
-                                similarityMatrix[tokenFrom] = {}
+        signatures = numpy.zeros((numberHashes, len(self.postings)), dtype=numpy.int64)
+        if len(self.postings) > 0:
+            for hashNumber in range(0, numberHashes):
+                hashValues = (hashRandom.randint(1, hashPrime - 1) * termDocument['documents'] +
+                              hashRandom.randint(0, hashPrime - 1)) % hashPrime
+                signatures[hashNumber] = numpy.minimum.reduceat(hashValues, termDocument['token_indptr'][:-1])
 
-                            similarityMatrix[tokenFrom][tokenTo] = round(float(1) / cosineSim, 4)
+        return signatures
 
-        # Store similarities in class
-        self.similarityMatrix = similarityMatrix
+    def getCandidatePairs(self, signatures, bandSize, maxBucketSize):
+        """
+        Get pairs of tokens likely to be similar (LSH): signatures are divided into bands of bandSize
+        hash values, and tokens having the same values in any of the bands are candidates
+        :param signatures: MinHash signatures obtained with getMinHashSignatures
+        :param bandSize: Number of hash values of each band
+        :param maxBucketSize: Maximum number of tokens with the same band values to generate pairs (larger
+                              groups are skipped, to avoid a quadratic number of pairs)
+        :return: List [from: token ID of each pair, to: token ID of each pair (higher or equal than from)]
+        """
+        tokenCount = len(self.postings)
+        pairKeys = [numpy.arange(tokenCount, dtype=numpy.int64) * (tokenCount + 1)]
+
+        for bandStart in range(0, len(signatures) - bandSize + 1, bandSize):
+            # Group tokens having the same values in the band
+            bandValues = signatures[bandStart:bandStart + bandSize]
+            tokenOrder = numpy.lexsort(bandValues[::-1])
+            orderedValues = bandValues[:, tokenOrder]
+
+            groupBounds = numpy.flatnonzero((orderedValues[:, 1:] != orderedValues[:, :-1]).any(axis=0)) + 1
+            groupStarts = numpy.concatenate([[0], groupBounds])
+            groupEnds = numpy.concatenate([groupBounds, [tokenCount]])
+            groupSizes = groupEnds - groupStarts
+            bucketGroups = numpy.flatnonzero((groupSizes >= 2) & (groupSizes <= maxBucketSize))
+
+            for groupNumber in bucketGroups:
+                groupTokens = numpy.sort(tokenOrder[groupStarts[groupNumber]:groupEnds[groupNumber]])
+                pairRows, pairColumns = numpy.triu_indices(len(groupTokens), 1)
+                pairKeys.append(groupTokens[pairRows] * tokenCount + groupTokens[pairColumns])
+
+        pairKeys = numpy.unique(numpy.concatenate(pairKeys))
+        return {'from': pairKeys // max(tokenCount, 1), 'to': pairKeys % max(tokenCount, 1)}
+
+    def calculatePairSimilarities(self, termDocument, pairFrom, pairTo, maxEntries=10000000):
+        """
+        Calculate cosine similarities of a list of token pairs. For each pair, the documents of the token
+        having less documents are searched in the documents of the other token
+        :param termDocument: Term-document matrix obtained with getTermDocumentMatrix
+        :param pairFrom: Array of token IDs
+        :param pairTo: Array of token IDs
+        :param maxEntries: Maximum number of document entries searched at the same time (memory limit)
+        :return: Array of cosine similarities of each pair
+        """
+        documentCount = termDocument['document_count']
+        tokenIndptr = termDocument['token_indptr']
+        tokenDocumentCounts = numpy.diff(tokenIndptr)
+
+        # Entries ordered by token and document, to search a document of a token
+        entryKeys = termDocument['tokens'] * documentCount + termDocument['documents']
+        keyOrder = numpy.argsort(entryKeys)
+        entryKeys = entryKeys[keyOrder]
+        entryDocuments = termDocument['documents'][keyOrder]
+        entryValues = termDocument['values'][keyOrder]
+
+        swapPair = tokenDocumentCounts[pairFrom] > tokenDocumentCounts[pairTo]
+        shortTokens = numpy.where(swapPair, pairTo, pairFrom)
+        longTokens = numpy.where(swapPair, pairFrom, pairTo)
+
+        pairLengths = tokenDocumentCounts[shortTokens]
+        pairLengthSums = numpy.cumsum(pairLengths)
+        dotProducts = numpy.zeros(len(pairFrom), dtype=numpy.float64)
+
+        chunkStart = 0
+        while chunkStart < len(pairFrom):
+            previousSum = pairLengthSums[chunkStart - 1] if chunkStart > 0 else 0
+            chunkEnd = max(numpy.searchsorted(pairLengthSums, previousSum + maxEntries, side='right'), chunkStart + 1)
+            chunkLengths = pairLengths[chunkStart:chunkEnd]
+
+            entryPositions = numpy.arange(chunkLengths.sum()) + numpy.repeat(
+                tokenIndptr[shortTokens[chunkStart:chunkEnd]] - (numpy.cumsum(chunkLengths) - chunkLengths),
+                chunkLengths)
+
+            # Search each document of the short token in the documents of the long token
+            searchKeys = numpy.repeat(longTokens[chunkStart:chunkEnd], chunkLengths) * documentCount + \
+                entryDocuments[entryPositions]
+            foundPositions = numpy.minimum(numpy.searchsorted(entryKeys, searchKeys), len(entryKeys) - 1)
+            entryProducts = numpy.where(entryKeys[foundPositions] == searchKeys,
+                                        entryValues[entryPositions] * entryValues[foundPositions], 0)
+
+            dotProducts[chunkStart:chunkEnd] = numpy.bincount(
+                numpy.repeat(numpy.arange(chunkEnd - chunkStart), chunkLengths), weights=entryProducts,
+                minlength=chunkEnd - chunkStart)
+            chunkStart = chunkEnd
+
+        return dotProducts / numpy.sqrt(termDocument['squared_norms'][pairFrom] *
+                                        termDocument['squared_norms'][pairTo])
+
+    def calculateApproximateSimilarities(self, numberHashes=64, bandSize=4, maxBucketSize=1000, seed=0,
+                                         pairsPerShard=1000000):
+        """
+        Calculate similarities only for pairs of tokens likely to be similar, found with MinHash and
+        LSH over the documents of each token. Exact similarity is calculated for each candidate pair,
+        so stored values are the same as the ones of calculateAllSimilarities, but pairs not found
+        are missing. Values are stored in shard files, each pair once
+        :param numberHashes: Number of MinHash functions
+        :param bandSize: Number of hash values of each LSH band. Lower values find more pairs
+        :param maxBucketSize: Maximum number of tokens with the same band values to generate pairs
+        :param seed: Seed to generate the hash functions
+        :param pairsPerShard: Approximate number of pairs stored in each shard file
+        :return: Candidate pairs [from: token ID of each pair, to: token ID of each pair]
+        """
+        print '[Calculating approximate similarities between tokens: ' + str(numberHashes) + ' hashes, ' + \
+              str(numberHashes // bandSize) + ' bands]'
 
-        # Store calculation results in file
-        with open(self.dictionaryPath + fileconfig.similarityFileName, 'w') as similarityFile:
-            similarityFile.write(json.dumps(similarityMatrix, separators=(',', ':')))
-            similarityFile.close()
+        termDocument = self.getTermDocumentMatrix()
+        candidatePairs = self.getCandidatePairs(
+            signatures=self.getMinHashSignatures(termDocument=termDocument, numberHashes=numberHashes, seed=seed),
+            bandSize=bandSize, maxBucketSize=maxBucketSize)
+
+        cosineSims = self.calculatePairSimilarities(termDocument=termDocument, pairFrom=candidatePairs['from'],
+                                                    pairTo=candidatePairs['to'])
+
+        self.removeSimilarityFiles()
+        self.saveSimilarityShards(pairFrom=candidatePairs['from'], pairTo=candidatePairs['to'],
+                                  cosineSims=cosineSims, pairsPerShard=pairsPerShard)
+
+        return candidatePairs
+
+    def saveSimilarityShards(self, pairFrom, pairTo, cosineSims, pairsPerShard=1000000):
+        """
+        Store similarities of a list of pairs ordered by first token in shard files, and the
+        index file listing the shards. Pairs with zero similarity are not stored
+        :param pairFrom: Array of token IDs (ordered)
+        :param pairTo: Array of token IDs
+        :param cosineSims: Array of cosine similarities of each pair
+        :param pairsPerShard: Approximate number of pairs stored in each shard file
+        :return:
+        """
+        tokenCount = len(self.postings)
+        tokenPairBounds = numpy.searchsorted(pairFrom, numpy.arange(tokenCount + 1))
+
+        shardTasks = []
+        blockStart = 0
+        while blockStart < tokenCount:
+            blockEnd = max(numpy.searchsorted(tokenPairBounds, tokenPairBounds[blockStart] + pairsPerShard,
+                                              side='right') - 1, blockStart + 1)
+            blockEnd = min(blockEnd, tokenCount)
+
+            blockSimilarities = {}
+            for pairNumber in range(tokenPairBounds[blockStart], tokenPairBounds[blockEnd]):
+                cosineSim = float(cosineSims[pairNumber])
+                if cosineSim > 0:
+                    blockSimilarities.setdefault(self.postings[pairFrom[pairNumber]], {})[
+                        self.postings[pairTo[pairNumber]]] = round(float(1) / cosineSim, 4)
+
+            shardTask = {'shard': len(shardTasks), 'start': blockStart, 'end': blockEnd,
+                         'file': fileconfig.similarityShardFilePrefix + str(len(shardTasks)) + '.json'}
+
+            with open(self.dictionaryPath + shardTask['file'], 'w') as shardFile:
+                shardFile.write(json.dumps(blockSimilarities, separators=(',', ':')))
+                shardFile.close()
+
+            shardTasks.append(shardTask)
+            blockStart = blockEnd
+
+        with open(self.dictionaryPath + fileconfig.similarityShardIndexFileName, 'w') as shardIndexFile:
+            shardIndexFile.write(json.dumps({'terms': tokenCount, 'shards': shardTasks}, separators=(',', ':')))
+            shardIndexFile.close()
+
+    def removeSimilarityFiles(self):
+        """
+        Remove similarity files stored in disk (single file, shards and binary files)
+        :return:
+        """
+        similarityFilePath = self.dictionaryPath + fileconfig.similarityFileName
+        if os.path.exists(similarityFilePath):
+            os.remove(similarityFilePath)
+
+        shardIndexFilePath = self.dictionaryPath + fileconfig.similarityShardIndexFileName
+        if os.path.exists(shardIndexFilePath):
+            with open(shardIndexFilePath, 'r') as shardIndexFile:
+                shardIndex = json.loads(shardIndexFile.read())
+                shardIndexFile.close()
+
+            for shardTask in shardIndex['shards']:
+                if os.path.exists(self.dictionaryPath + shardTask['file']):
+                    os.remove(self.dictionaryPath + shardTask['file'])
+
+            os.remove(shardIndexFilePath)
+
+        for storeFileName in ['tokens.json', 'indptr.npy', 'indices.npy', 'data.npy']:
+            if os.path.exists(self.dictionaryPath + fileconfig.similarityStoreFilePrefix + storeFileName):
+                os.remove(self.dictionaryPath + fileconfig.similarityStoreFilePrefix + storeFileName)
 
     def loadSimilarities(self):
         """
@@ -362,18 +869,345 @@ class Dictionary:
         """
         print '[Loading similarity values]'
         similarityMatrixFilePath = self.dictionaryPath + fileconfig.similarityFileName
-        if os.path.exists(similarityMatrixFilePath):
+        shardIndexFilePath = self.dictionaryPath + fileconfig.similarityShardIndexFileName
+        similarityStoreFilePrefix = self.dictionaryPath + fileconfig.similarityStoreFilePrefix
+
+        if os.path.exists(similarityStoreFilePrefix + 'tokens.json'):
+            with open(similarityStoreFilePrefix + 'tokens.json', 'r') as tokensFile:
+                self.similarityStore = SimilarityMatrix(tokens=json.loads(tokensFile.read()))
+                tokensFile.close()
+
+            # Similarity values are read from binary files when they are used
+            self.similarityStore.loadFromFiles(filePrefix=similarityStoreFilePrefix)
+            self.similarityPairs = {}
+            self.similarityNeighbours = {}
+            self.createSimilarityCache(cacheSize=similarityStoreCacheSize)
+        elif os.path.exists(similarityMatrixFilePath):
+            self.similarityPairs = {}
+
             with open(similarityMatrixFilePath, 'r') as similarityFile:
-                self.similarityMatrix = json.loads(similarityFile.read())
+                self.addSimilarityRows(json.loads(similarityFile.read()))
                 similarityFile.close()
 
+            # Build list of similar tokens for each token
+            self.createSimilarityNeighbours()
+        elif os.path.exists(shardIndexFilePath):
+            with open(shardIndexFilePath, 'r') as shardIndexFile:
+                shardIndex = json.loads(shardIndexFile.read())
+                shardIndexFile.close()
+
+            # Each shard contains the similarities of different tokens
+            self.similarityPairs = {}
+            for shardTask in shardIndex['shards']:
+                with open(self.dictionaryPath + shardTask['file'], 'r') as shardFile:
+                    self.addSimilarityRows(json.loads(shardFile.read()))
+                    shardFile.close()
+
+            # Build list of similar tokens for each token
+            self.createSimilarityNeighbours()
+
+    def addSimilarityRows(self, similarityRows):
+        """
+        Add similarity values stored as {token: {token: value}} (format of similarity files). A pair
+        may be stored under any of both tokens, but it is kept once: the value stored under the lower
+        token has priority. Rows are removed from similarityRows while they are added. Keys use the
+        token strings of postings, so they are not duplicated in memory and are found by identity
+        :param similarityRows: Similarity values of each token
+        :return:
+        """
+        similarityPairs = self.similarityPairs
+        postingTokens = dict([(token, token) for token in self.postings])
+
+        for tokenFrom in similarityRows.keys():
+            tokenFromSimilarities = similarityRows.pop(tokenFrom)
+            tokenFrom = postingTokens.get(tokenFrom, tokenFrom)
+
+            for tokenTo, similarityValue in tokenFromSimilarities.iteritems():
+                tokenTo = postingTokens.get(tokenTo, tokenTo)
+                if tokenFrom <= tokenTo:
+                    similarityPairs[(tokenFrom, tokenTo)] = similarityValue
+                else:
+                    similarityPairs.setdefault((tokenTo, tokenFrom), similarityValue)
+
+    def createSimilarityNeighbours(self):
+        """
+        Create list of similar tokens for each token from similarity pairs. Each pair is stored
+        once, so it is added in the lists of both tokens
+        :return:
+        """
+        similarityNeighbours = {}
+        tokenPositions = dict([(token, position) for position, token in enumerate(self.postings)])
+
+        for tokenFrom, tokenTo in self.similarityPairs:
+            similarityNeighbours.setdefault(tokenFrom, []).append(tokenTo)
+
+            if tokenTo != tokenFrom:
+                similarityNeighbours.setdefault(tokenTo, []).append(tokenFrom)
+
+        # Store neighbours in postings order (order of token IDs in the similarity matrix), so
+        # features with equal heuristic values are chosen in the same order by all the engines
+        self.similarityNeighbours = {}
+        for token in similarityNeighbours:
+            self.similarityNeighbours[token] = sorted(similarityNeighbours[token], key=tokenPositions.get)
+
+    def startSimilarityCache(self, cacheSize):
+        """
+        Calculate similarity rows on demand instead of loading similarity files: the row of a token
+        (its similarities with all the tokens) is calculated from the term-document matrix the first
+        time it is used, and at most cacheSize rows are kept (least recently used rows are removed).
+        Only rows of the tokens used by the search are calculated
+        :param cacheSize: Maximum number of similarity rows kept in memory
+        :return:
+        """
+        self.freeSimilarities()
+        self.createSimilarityCache(cacheSize=cacheSize)
+
+        self.similarityTermDocument = self.getTermDocumentMatrix()
+
+    def createSimilarityCache(self, cacheSize):
+        """
+        Create empty similarity cache. Rows are read from the memory-mapped matrix when it is loaded,
+        otherwise they are calculated from the term-document matrix
+        :param cacheSize: Maximum number of similarity rows kept in memory
+        :return:
+        """
+        self.similarityCache = OrderedDict()
+        self.similarityCacheSize = max(cacheSize, 1)
+        self.similarityCacheHits = 0
+        self.similarityCacheMisses = 0
+
+        self.similarityCacheTokenIds = {}
+        for tokenId, token in enumerate(self.postings):
+            self.similarityCacheTokenIds[token] = tokenId
+
+    def getSimilarityRow(self, token):
+        """
+        Get similarity row of a token from the cache, reading it from binary files or calculating it
+        when it is not available
+        :param token: Token
+        :return: List [similar tokens: list of tokens in postings order, similarity values {token: value}]
+        """
+        similarityRow = self.similarityCache.pop(token, None)
+
+        if similarityRow is None:
+            self.similarityCacheMisses += 1
+
+            if self.similarityStore is not None:
+                similarityRow = self.getStoreRow(token)
+            else:
+                similarityValues = {}
+                if token in self.similarityCacheTokenIds:
+                    tokenId = self.similarityCacheTokenIds[token]
+                    similarityValues = self.calculateBlockSimilarities(termDocument=self.similarityTermDocument,
+                                                                       blockStart=tokenId, blockEnd=tokenId + 1,
+                                                                       lowerTokens=True).get(token, {})
+
+                similarityRow = [sorted(similarityValues, key=self.similarityCacheTokenIds.get), similarityValues,
+                                 None]
+
+            # Remove least recently used row
+            if len(self.similarityCache) >= self.similarityCacheSize:
+                self.similarityCache.popitem(last=False)
+        else:
+            self.similarityCacheHits += 1
+
+        # Row is stored again as the most recently used one
+        self.similarityCache[token] = similarityRow
+        return similarityRow
+
+    def getSimilarityCacheCounters(self):
+        """
+        Get number of rows found in the cache (hits) and calculated (misses) since the last call
+        :return: List [hits, misses]
+        """
+        cacheCounters = [self.similarityCacheHits, self.similarityCacheMisses]
+        self.similarityCacheHits = 0
+        self.similarityCacheMisses = 0
+
+        return cacheCounters
+
+    def getSimilarityCounters(self):
+        """
+        Get number of similarity rows requested by searches (lookups) and requested rows which were not
+        in memory (misses) since the last call
+        :return: List [lookups, misses]
+        """
+        similarityCounters = [self.similarityLookups, self.similarityMisses]
+        self.similarityLookups = 0
+        self.similarityMisses = 0
+
+        return similarityCounters
+
+    def getSimilarTokens(self, token):
+        """
+        Get list of tokens having non-zero similarity with a token. Works only if similarity
+        values have been loaded before
+        :param token: Token to check
+        :return: List of similar tokens (in postings order)
+        """
+        if self.similarityCache is not None:
+            return self.getSimilarityRow(token)[0]
+
+        if token in self.similarityNeighbours:
+            return self.similarityNeighbours[token]
+
+        return []
+
+    def getSimilarityPowers(self, token, exponent):
+        """
+        Get similar tokens of a token and their similarity values raised to an exponent (heuristic
+        information of UFSACO). Powers of a row are calculated once, and kept while the row is in
+        memory and the exponent does not change
+        :param token: Token
+        :param exponent: Exponent applied to similarity values
+        :return: List [similar tokens: list of tokens in postings order,
+                 similarity powers {token: value ** exponent} (tokens with zero similarity are not included)]
+        """
+        self.similarityLookups += 1
+
+        if self.similarityCache is not None:
+            # Rows not found in the cache are read from binary files or calculated
+            if token not in self.similarityCache:
+                self.similarityMisses += 1
+
+            similarityRow = self.getSimilarityRow(token)
+
+            if similarityRow[2] is None or similarityRow[2][0] != exponent:
+                similarityRow[2] = [exponent, dict([(similarToken, similarityValue ** exponent)
+                                                    for similarToken, similarityValue in similarityRow[1].iteritems()
+                                                    if similarityValue != 0])]
+
+            return [similarityRow[0], similarityRow[2][1]]
+
+        # Powers of previous exponent are not used again
+        if exponent != self.similarityPowerExponent:
+            self.similarityPowerRows = {}
+            self.similarityPowerExponent = exponent
+
+        similarTokens = self.similarityNeighbours.get(token, [])
+
+        similarityPowers = self.similarityPowerRows.get(token)
+        if similarityPowers is None:
+            self.similarityMisses += 1
+
+            similarityPowers = {}
+            for similarToken in similarTokens:
+                similarityValue = self.getSimilarity(token, similarToken)
+                if similarityValue != 0:
+                    similarityPowers[similarToken] = similarityValue ** exponent
+
+            self.similarityPowerRows[token] = similarityPowers
+
+        return [similarTokens, similarityPowers]
+
+    def getStoreRow(self, token):
+        """
+        Read similarity row of a token from the memory-mapped matrix. Rows are kept in the similarity
+        cache (see getSimilarityRow), so each similarity value of the row is then obtained without
+        searching the matrix
+        :param token: Token
+        :return: List [similar tokens: list of tokens in postings order, similarity values {token: value}]
+        """
+        similarTokens = []
+        similarityValues = {}
+
+        # Rows are ordered by token ID, and binary files keep postings order
+        if token in self.similarityStore.tokenIds:
+            similarTokenIds, rowValues = self.similarityStore.getRow(self.similarityStore.tokenIds[token])
+            similarTokens = [self.similarityStore.tokens[tokenId] for tokenId in similarTokenIds.tolist()]
+            similarityValues = dict(zip(similarTokens, rowValues.tolist()))
+
+        return [similarTokens, similarityValues, None]
+
+    def getCandidateTokens(self, candidateListSize):
+        """
+        Get the similar tokens having the highest similarity values for each token (candidate lists).
+        Candidates keep postings order, and tokens with equal similarity values are chosen in that order.
+        With binary files, candidates of all the tokens are selected at once from the similarity matrix
+        :param candidateListSize: Maximum number of candidates for each token
+        :return: Candidate tokens of each token {token: list of tokens}
+        """
+        candidateTokens = {}
+
+        if self.similarityStore is not None:
+            candidateMatrix = self.similarityStore.createCandidateMatrix(candidateListSize=candidateListSize)
+
+            for token in self.postings:
+                if token in candidateMatrix.tokenIds:
+                    similarTokenIds = candidateMatrix.getRow(candidateMatrix.tokenIds[token])[0]
+                    candidateTokens[token] = [candidateMatrix.tokens[tokenId] for tokenId in similarTokenIds.tolist()]
+                else:
+                    candidateTokens[token] = []
+        else:
+            for token in self.postings:
+                similarTokens = self.getSimilarTokens(token)
+
+                if len(similarTokens) > candidateListSize:
+                    topTokens = set(sorted(similarTokens,
+                                           key=lambda similarToken: self.getSimilarity(token, similarToken),
+                                           reverse=True)[0:candidateListSize])
+                    similarTokens = [similarToken for similarToken in similarTokens if similarToken in topTokens]
+
+                candidateTokens[token] = similarTokens
+
+        return candidateTokens
+
+    def getSimilarityMatrix(self, quantise=False):
+        """
+        Get array-backed similarity matrix of the dictionary: the memory-mapped matrix when
+        binary files have been loaded, otherwise a matrix created from similarity values
+        :param quantise: Quantise similarity values to 16 bits (see SimilarityMatrix.getQuantisedMatrix)
+        :return: SimilarityMatrix
+        """
+        if self.similarityStore is not None:
+            return self.similarityStore.getQuantisedMatrix() if quantise is True else self.similarityStore
+
+        similarity = SimilarityMatrix(tokens=self.postings)
+
+        pairFrom = []
+        pairTo = []
+        similarityValues = []
+        for (tokenFrom, tokenTo), similarityValue in self.similarityPairs.iteritems():
+            if tokenFrom in similarity.tokenIds and tokenTo in similarity.tokenIds:
+                pairFrom.append(similarity.tokenIds[tokenFrom])
+                pairTo.append(similarity.tokenIds[tokenTo])
+                similarityValues.append(similarityValue)
+
+        similarity.loadFromPairs(pairFrom=numpy.array(pairFrom, dtype=numpy.int64),
+                                 pairTo=numpy.array(pairTo, dtype=numpy.int64),
+                                 similarityValues=numpy.array(similarityValues, dtype=numpy.float64))
+
+        return similarity.getQuantisedMatrix() if quantise is True else similarity
+
+    def saveSimilarityStore(self, quantise=False):
+        """
+        Store loaded similarity values in binary files (CSR arrays and token list), which are
+        used by loadSimilarities instead of JSON files
+        :param quantise: Store similarity values quantised to 16 bits
+        :return:
+        """
+        self.getSimilarityMatrix(quantise=quantise).saveToFiles(
+            filePrefix=self.dictionaryPath + fileconfig.similarityStoreFilePrefix)
+
     def freeSimilarities(self):
         """
         Free memory for similarity matrix
         :return:
         """
-        del (self.similarityMatrix)
-        self.similarityMatrix = {}
+        del (self.similarityPairs)
+        self.similarityPairs = {}
+
+        del (self.similarityNeighbours)
+        self.similarityNeighbours = {}
+
+        self.similarityPowerRows = {}
+        self.similarityPowerExponent = None
+
+        self.similarityStore = None
+
+        self.similarityCache = None
+        self.similarityCacheTokenIds = {}
+        self.similarityTermDocument = None
 
     def calculateSimilarity(self, token1, token2):
         """
@@ -415,15 +1249,24 @@ class Dictionary:
         :param token2: Token 2 to check similarity
         :return: Tokens similarity
         """
-        if token1 in self.similarityMatrix and token2 in self.similarityMatrix[token1]:
-            return self.similarityMatrix[token1][token2]
-        elif token2 in self.similarityMatrix and token1 in self.similarityMatrix[token2]:
-            return self.similarityMatrix[token2][token1]
-        return 0
+        # Rows read from binary files or calculated on demand: row of any of both tokens, or row of the first token
+        if self.similarityCache is not None:
+            if token1 in self.similarityCache:
+                return self.similarityCache[token1][1].get(token2, 0)
+            elif token2 in self.similarityCache:
+                return self.similarityCache[token2][1].get(token1, 0)
+
+            return self.getSimilarityRow(token1)[1].get(token2, 0)
+
+        # Each pair is stored once, under its ordered key
+        return self.similarityPairs.get((token1, token2) if token1 <= token2 else (token2, token1), 0)
 
-    def saveToDisk(self, calculateSimilarities=True):
+    def saveToDisk(self, calculateSimilarities=True, numberProcesses=None, memoryLimit=1024):
         """
         Save index content to disk
+        :param calculateSimilarities: Calculate similarities between tokens
+        :param numberProcesses: Number of processes to calculate similarities (None to use all the processors)
+        :param memoryLimit: Approximate memory limit in MB to calculate similarities
         :return:
         """
         print '[Storing data for dictionary: ' + self.dictionaryName + ']'
@@ -488,7 +1331,7 @@ class Dictionary:
 
         # Calculate token similarities
         if calculateSimilarities is True:
-            self.calculateAllSimilarities()
+            self.calculateShardedSimilarities(numberProcesses=numberProcesses, memoryLimit=memoryLimit)
 
     def loadFromDisk(self):
         """
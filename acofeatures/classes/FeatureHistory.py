@@ -0,0 +1,175 @@
+import os
+from array import array
+
+
+class FeatureHistory:
+    def __init__(self, tokens, historyFilePath=None):
+        """
+        Compact storage of visited features on each cycle. For each cycle, token IDs and
+        their counters are kept in typed arrays. If a file path is provided, counters of
+        each cycle are written to disk instead of being kept in memory.
+
+        File format is a sequence of records (32-bit integers):
+        [cycle iteration, number of tokens, token IDs..., counters...]
+        :param tokens: List of tokens (token ID is the position in the list)
+        :param historyFilePath: File to store the counters of each cycle (None to keep them in memory)
+        """
+        self.tokens = tokens
+        self.tokenIds = None
+        self.historyFilePath = historyFilePath
+        self.historyFile = None
+
+        # Number of stored cycles
+        self.cycleCount = 0
+
+        # In-memory storage: cycle iterations, start position of each cycle, token IDs and counters
+        self.cycleIterations = array('i')
+        self.cycleOffsets = array('l', [0])
+        self.cycleTokenIds = array('i')
+        self.cycleCounters = array('i')
+
+    def addCycle(self, cycleIteration, tokenIds, counters):
+        """
+        Store visited features of a cycle
+        :param cycleIteration: Cycle iteration
+        :param tokenIds: List of visited token IDs
+        :param counters: List of counters for each token ID
+        :return:
+        """
+        tokenIds = array('i', tokenIds)
+        counters = array('i', counters)
+
+        if self.historyFilePath is not None:
+            # History file is created when first cycle is stored
+            if self.historyFile is None:
+                self.historyFile = open(self.historyFilePath, 'wb')
+
+            array('i', [cycleIteration, len(tokenIds)]).tofile(self.historyFile)
+            tokenIds.tofile(self.historyFile)
+            counters.tofile(self.historyFile)
+        else:
+            self.cycleIterations.append(cycleIteration)
+            self.cycleTokenIds.extend(tokenIds)
+            self.cycleCounters.extend(counters)
+            self.cycleOffsets.append(len(self.cycleTokenIds))
+
+        self.cycleCount += 1
+
+    def addCycleCounter(self, cycleIteration, featureCounter):
+        """
+        Store visited features of a cycle
+        :param cycleIteration: Cycle iteration
+        :param featureCounter: Counter for each visited token {token: counter}
+        :return:
+        """
+        # Map from token to token ID, created on first use
+        if self.tokenIds is None:
+            self.tokenIds = {}
+            for tokenId, token in enumerate(self.tokens):
+                self.tokenIds[token] = tokenId
+
+        visitedTokens = list(featureCounter)
+        self.addCycle(cycleIteration=cycleIteration,
+                      tokenIds=[self.tokenIds[token] for token in visitedTokens],
+                      counters=[featureCounter[token] for token in visitedTokens])
+
+    def iterCycles(self):
+        """
+        Iterate over stored cycles, reading them from disk if needed
+        :return: Generator of [cycle iteration, counter for each visited token {token: counter}]
+        """
+        if self.historyFilePath is not None:
+            if self.historyFile is not None:
+                self.historyFile.flush()
+
+            if not os.path.exists(self.historyFilePath):
+                return
+
+            with open(self.historyFilePath, 'rb') as historyFile:
+                while True:
+                    cycleHeader = array('i')
+                    try:
+                        cycleHeader.fromfile(historyFile, 2)
+                    except EOFError:
+                        break
+
+                    tokenIds = array('i')
+                    tokenIds.fromfile(historyFile, cycleHeader[1])
+                    counters = array('i')
+                    counters.fromfile(historyFile, cycleHeader[1])
+
+                    yield cycleHeader[0], self.getFeatureCounter(tokenIds, counters)
+
+                historyFile.close()
+        else:
+            for cycleNumber in range(0, self.cycleCount):
+                cycleStart = self.cycleOffsets[cycleNumber]
+                cycleEnd = self.cycleOffsets[cycleNumber + 1]
+
+                yield self.cycleIterations[cycleNumber], self.getFeatureCounter(
+                    self.cycleTokenIds[cycleStart:cycleEnd],
+                    self.cycleCounters[cycleStart:cycleEnd]
+                )
+
+    def getFeatureCounter(self, tokenIds, counters):
+        """
+        Convert token IDs and counters of a cycle into a feature counter
+        :param tokenIds: List of token IDs
+        :param counters: List of counters for each token ID
+        :return: Counter for each visited token {token: counter}
+        """
+        featureCounter = {}
+        for tokenId, counter in zip(tokenIds, counters):
+            featureCounter[self.tokens[tokenId]] = counter
+
+        return featureCounter
+
+    def getState(self):
+        """
+        Get stored history, to be restored later with setState
+        :return: Dictionary with stored arrays (in memory) or file size (stored on disk)
+        """
+        if self.historyFilePath is not None:
+            historyFileSize = 0
+            if self.historyFile is not None:
+                self.historyFile.flush()
+                historyFileSize = self.historyFile.tell()
+
+            return {'cycles': self.cycleCount, 'file_size': historyFileSize}
+
+        return {
+            'cycles': self.cycleCount,
+            'iterations': self.cycleIterations,
+            'offsets': self.cycleOffsets,
+            'token_ids': self.cycleTokenIds,
+            'counters': self.cycleCounters
+        }
+
+    def setState(self, historyState):
+        """
+        Restore history obtained with getState. If history is stored on disk, cycles
+        written after the state was obtained are removed from the file
+        :param historyState: History state
+        :return:
+        """
+        self.cycleCount = historyState['cycles']
+
+        if self.historyFilePath is not None:
+            self.close()
+            self.historyFile = open(self.historyFilePath, 'r+b' if os.path.exists(self.historyFilePath) else 'wb')
+            self.historyFile.truncate(historyState['file_size'])
+            self.historyFile.seek(0, 2)
+        else:
+            self.cycleIterations = historyState['iterations']
+            self.cycleOffsets = historyState['offsets']
+            self.cycleTokenIds = historyState['token_ids']
+            self.cycleCounters = historyState['counters']
+
+    def close(self):
+        """
+        Close history file (if any)
+        :return:
+        """
+        if self.historyFile is not None:
+            self.historyFile.close()
+            self.historyFile = None
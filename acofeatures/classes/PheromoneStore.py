@@ -0,0 +1,120 @@
+import heapq
+
+
+class PheromoneStore:
+    def __init__(self, tokens, initialPheromone, minimumScale=1e-100):
+        """
+        Pheromone values with lazy global decay. Pheromone value of a token is stored
+        as value / scale, so decaying all the tokens only modifies the scale factor.
+        Values are stored only for tokens whose pheromone has been increased, the rest
+        of tokens share the initial value.
+        :param tokens: List of tokens (postings order, used to rank tokens with equal values)
+        :param initialPheromone: Initial pheromone value for all the tokens
+        :param minimumScale: Scale value to renormalise stored values (avoid underflow)
+        """
+        self.tokens = tokens
+        self.tokenPositions = dict([(token, position) for position, token in enumerate(tokens)])
+        self.scale = 1.0
+        self.minimumScale = minimumScale
+
+        # Stored value for tokens without pheromone increments
+        self.defaultValue = float(initialPheromone)
+
+        # Stored values for tokens with pheromone increments
+        self.values = {}
+
+    def __getitem__(self, token):
+        """
+        Get pheromone value for a token
+        :param token: Token
+        :return: Pheromone value
+        """
+        if token in self.values:
+            return self.scale * self.values[token]
+
+        return self.scale * self.defaultValue
+
+    def __contains__(self, token):
+        return token in self.tokenPositions
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def getTopTokens(self, topNumber):
+        """
+        Get tokens having the highest pheromone values. Stored values are usually higher than the
+        value shared by the rest of tokens, but they may be lower (for instance, values blended with
+        other colonies), so both groups of tokens are ranked together
+        :param topNumber: Number of tokens to retrieve
+        :return: List of tokens ordered by pheromone value (descending, postings order for equal values)
+        """
+        tokenRank = lambda token: (self.values.get(token, self.defaultValue), -self.tokenPositions[token])
+
+        topTokens = heapq.nlargest(topNumber, self.values, key=tokenRank)
+
+        # Tokens sharing the initial value are needed unless every top token has a higher value. They
+        # are ranked by postings order, so only the first topNumber of them may be in the top
+        if len(topTokens) < topNumber or (len(topTokens) > 0 and self.values[topTokens[-1]] <= self.defaultValue):
+            defaultTokens = []
+            for token in self.tokens:
+                if len(defaultTokens) >= topNumber:
+                    break
+
+                if token not in self.values:
+                    defaultTokens.append(token)
+
+            topTokens = heapq.nlargest(topNumber, topTokens + defaultTokens, key=tokenRank)
+
+        return topTokens
+
+    def decay(self, decayValue):
+        """
+        Multiply pheromone value of all the tokens by the same factor
+        :param decayValue: Multiplication factor [0 to 1]
+        :return:
+        """
+        if decayValue <= 0:
+            # All values are set to zero, no need to keep stored values
+            self.scale = 1.0
+            self.defaultValue = 0.0
+            self.values = {}
+        else:
+            self.scale *= decayValue
+
+            if self.scale < self.minimumScale:
+                self.renormalise()
+
+    def add(self, token, value):
+        """
+        Increase pheromone value of a token
+        :param token: Token
+        :param value: Value to add
+        :return:
+        """
+        if token not in self.values:
+            self.values[token] = self.defaultValue
+
+        self.values[token] += value / self.scale
+
+    def setValue(self, token, value):
+        """
+        Set pheromone value of a token
+        :param token: Token
+        :param value: Pheromone value
+        :return:
+        """
+        self.values[token] = value / self.scale
+
+    def renormalise(self):
+        """
+        Apply scale factor to stored values and reset scale factor
+        :return:
+        """
+        for token in self.values:
+            self.values[token] *= self.scale
+
+        self.defaultValue *= self.scale
+        self.scale = 1.0
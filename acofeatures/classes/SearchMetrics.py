@@ -0,0 +1,131 @@
+import json
+
+
+class SearchMetrics:
+    def __init__(self, metricsPrefix='ufsaco'):
+        """
+        Counters and timers recorded by UFSACO engines during the search. Engines record
+        values only when a SearchMetrics instance is provided.
+        Counters: number of events {name: value}
+        Timers: number of measures, total time and maximum time in seconds {name: [count, total, max]}
+        :param metricsPrefix: Prefix for metric names in Prometheus format
+        """
+        self.metricsPrefix = metricsPrefix
+        self.counters = {}
+        self.timers = {}
+
+    def addCounter(self, counterName, value=1):
+        """
+        Increase a counter
+        :param counterName: Counter name
+        :param value: Value to add
+        :return:
+        """
+        self.counters[counterName] = self.counters.get(counterName, 0) + value
+
+    def addTime(self, timerName, seconds):
+        """
+        Add a time measure to a timer
+        :param timerName: Timer name
+        :param seconds: Measured time in seconds
+        :return:
+        """
+        if timerName not in self.timers:
+            self.timers[timerName] = [0, 0.0, 0.0]
+
+        timerValues = self.timers[timerName]
+        timerValues[0] += 1
+        timerValues[1] += seconds
+        timerValues[2] = max(timerValues[2], seconds)
+
+    def reset(self):
+        """
+        Remove all the recorded values
+        :return:
+        """
+        self.counters = {}
+        self.timers = {}
+
+    def getState(self):
+        """
+        Get recorded values, to be merged into other instance (for instance, values of a worker process)
+        :return: Dictionary {counters: counter values, timers: timer values}
+        """
+        return {'counters': dict(self.counters), 'timers': dict(self.timers)}
+
+    def merge(self, metricsState):
+        """
+        Add values obtained with getState to recorded values
+        :param metricsState: Recorded values of other instance
+        :return:
+        """
+        for counterName in metricsState['counters']:
+            self.addCounter(counterName, metricsState['counters'][counterName])
+
+        for timerName in metricsState['timers']:
+            timerCount, timerTotal, timerMax = metricsState['timers'][timerName]
+
+            if timerName not in self.timers:
+                self.timers[timerName] = [0, 0.0, 0.0]
+
+            timerValues = self.timers[timerName]
+            timerValues[0] += timerCount
+            timerValues[1] += timerTotal
+            timerValues[2] = max(timerValues[2], timerMax)
+
+    def toJson(self):
+        """
+        Export recorded values in JSON format
+        :return: JSON string
+        """
+        timers = {}
+        for timerName in self.timers:
+            timerCount, timerTotal, timerMax = self.timers[timerName]
+            timers[timerName] = {
+                'count': timerCount,
+                'total_seconds': timerTotal,
+                'mean_seconds': timerTotal / timerCount if timerCount > 0 else 0,
+                'max_seconds': timerMax
+            }
+
+        return json.dumps({'counters': self.counters, 'timers': timers}, indent=2, sort_keys=True)
+
+    def toPrometheus(self):
+        """
+        Export recorded values in Prometheus text format. Counters are exported as counter metrics
+        (suffix _total) and timers as summary metrics (suffix _seconds)
+        :return: Prometheus text
+        """
+        metricLines = []
+
+        for counterName in sorted(self.counters):
+            metricName = self.metricsPrefix + '_' + counterName + '_total'
+            metricLines.append('# TYPE ' + metricName + ' counter')
+            metricLines.append(metricName + ' ' + repr(self.counters[counterName]))
+
+        for timerName in sorted(self.timers):
+            timerCount, timerTotal, timerMax = self.timers[timerName]
+            metricName = self.metricsPrefix + '_' + timerName + '_seconds'
+            metricLines.append('# TYPE ' + metricName + ' summary')
+            metricLines.append(metricName + '_count ' + repr(timerCount))
+            metricLines.append(metricName + '_sum ' + repr(timerTotal))
+
+            metricLines.append('# TYPE ' + metricName + '_max gauge')
+            metricLines.append(metricName + '_max ' + repr(timerMax))
+
+        return '\n'.join(metricLines) + '\n'
+
+    def saveToFile(self, metricsFilePath, metricsFormat='json'):
+        """
+        Store recorded values in a file
+        :param metricsFilePath: File path
+        :param metricsFormat: File format (json or prometheus)
+        :return:
+        """
+        with open(metricsFilePath, 'w') as metricsFile:
+            if metricsFormat == 'prometheus':
+                metricsFile.write(self.toPrometheus())
+            else:
+                metricsFile.write(self.toJson())
+
+            metricsFile.close()
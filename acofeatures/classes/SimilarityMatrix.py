@@ -0,0 +1,264 @@
+import os
+import copy
+import json
+import multiprocessing
+import numpy
+
+
+def createSharedArray(values):
+    """
+    Copy an array into shared memory, so it can be read by worker processes without copying it
+    :param values: NumPy array to copy
+    :return: NumPy array backed by shared memory
+    """
+    sharedBuffer = multiprocessing.RawArray('b', max(values.nbytes, 1))
+    sharedValues = numpy.frombuffer(sharedBuffer, dtype=numpy.int8)[0:values.nbytes].view(values.dtype)
+    sharedValues[:] = values
+    return sharedValues
+
+
+class SimilarityMatrix:
+    def __init__(self, tokens):
+        """
+        Array-backed similarity matrix between tokens. Each token is mapped to an integer ID
+        (its position in the token list) and similarity values are stored in CSR arrays:
+        * indptr: row start positions for each token ID
+        * indices: token IDs of the similar tokens
+        * data: similarity values (float64, or float16 when values are quantised)
+        :param tokens: List of tokens (dictionary postings)
+        """
+        self.tokens = list(tokens)
+        self.tokenCount = len(self.tokens)
+
+        # Map from token to integer ID
+        self.tokenIds = {}
+        for tokenId, token in enumerate(self.tokens):
+            self.tokenIds[token] = tokenId
+
+        # CSR arrays for the similarity values
+        self.indptr = numpy.zeros(self.tokenCount + 1, dtype=numpy.int64)
+        self.indices = numpy.zeros(0, dtype=numpy.int32)
+        self.data = numpy.zeros(0, dtype=numpy.float64)
+
+    def loadFromPairs(self, pairFrom, pairTo, similarityValues):
+        """
+        Build CSR arrays from similarity values of pairs of tokens. Each pair is given once, so values
+        are made symmetric: sim(a,b) is stored in the rows of a and b
+        :param pairFrom: Array of token IDs
+        :param pairTo: Array of token IDs
+        :param similarityValues: Array of similarity values of each pair
+        :return:
+        """
+        notDiagonal = pairFrom != pairTo
+        rowIds = numpy.concatenate([pairFrom, pairTo[notDiagonal]]).astype(numpy.int64)
+        columnIds = numpy.concatenate([pairTo, pairFrom[notDiagonal]]).astype(numpy.int64)
+        rowValues = numpy.concatenate([similarityValues, similarityValues[notDiagonal]])
+
+        # Values of each row are ordered by token ID
+        valueOrder = numpy.lexsort((columnIds, rowIds))
+
+        self.indptr = numpy.zeros(self.tokenCount + 1, dtype=numpy.int64)
+        self.indptr[1:] = numpy.cumsum(numpy.bincount(rowIds, minlength=self.tokenCount))
+        self.indices = columnIds[valueOrder].astype(numpy.int32)
+        self.data = rowValues[valueOrder].astype(numpy.float64)
+
+    def isQuantised(self):
+        """
+        Verify if similarity values are quantised to 16 bits
+        :return: True if values are stored as float16
+        """
+        return self.data.dtype == numpy.float16
+
+    def getQuantisedMatrix(self):
+        """
+        Create a matrix with similarity values quantised to 16 bits (float16), using a quarter of the
+        memory of float64 values. Token list, token IDs, indptr and indices are shared with this matrix.
+        Stored values are inverted similarities (1/sim >= 1): each quantised value has a relative error
+        of at most 2^-11 (0.049%), and values greater than 65504 (similarities lower than 1.5e-5) are
+        stored as 65504. Values raised to beta have a relative error of about beta * 2^-11
+        :return: SimilarityMatrix with quantised values
+        """
+        if self.isQuantised():
+            return self
+
+        quantisedMatrix = copy.copy(self)
+        quantisedMatrix.data = numpy.minimum(self.data, numpy.finfo(numpy.float16).max).astype(numpy.float16)
+        return quantisedMatrix
+
+    def getValuePowers(self, exponent):
+        """
+        Precompute quantised similarity values raised to an exponent. Quantised values have at most
+        65536 different values, so powers are a table indexed by the 16 bits of each value
+        :param exponent: Exponent (beta)
+        :return: Array of powers for each 16-bit value
+        """
+        with numpy.errstate(over='ignore', invalid='ignore'):
+            return numpy.arange(65536, dtype=numpy.uint16).view(numpy.float16).astype(numpy.float64) ** exponent
+
+    def getValues(self, positions, exponent=None, valuePowers=None):
+        """
+        Get similarity values of a group of positions of the CSR arrays, or values raised to an exponent
+        :param positions: Positions (array or slice)
+        :param exponent: Exponent (None to get similarity values)
+        :param valuePowers: Powers of quantised values obtained with getValuePowers (required for quantised values)
+        :return: Array of values
+        """
+        values = self.data[positions]
+
+        if exponent is None:
+            return values
+        elif valuePowers is not None:
+            return valuePowers[values.view(numpy.uint16)]
+
+        return values ** exponent
+
+    def createCandidateMatrix(self, candidateListSize):
+        """
+        Create a matrix keeping, for each token, only the similar tokens having the
+        highest similarity values. Token list and token IDs are shared with this matrix
+        :param candidateListSize: Maximum number of similar tokens for each token
+        :return: SimilarityMatrix with candidate tokens
+        """
+        rowLengths = numpy.diff(self.indptr)
+        rowNumbers = numpy.repeat(numpy.arange(self.tokenCount), rowLengths)
+
+        # Sort values of each row by similarity value (descending), rows are kept in order
+        valueOrder = numpy.lexsort((-self.data, rowNumbers))
+        valueRank = numpy.arange(len(valueOrder)) - self.indptr[rowNumbers[valueOrder]]
+
+        # Keep the first values of each row, ordered by token ID
+        candidatePositions = numpy.sort(valueOrder[valueRank < candidateListSize])
+
+        candidateMatrix = copy.copy(self)
+        candidateMatrix.indptr = numpy.zeros(self.tokenCount + 1, dtype=numpy.int64)
+        candidateMatrix.indptr[1:] = numpy.cumsum(numpy.minimum(rowLengths, candidateListSize))
+        candidateMatrix.indices = self.indices[candidatePositions]
+        candidateMatrix.data = self.data[candidatePositions]
+
+        return candidateMatrix
+
+    def getSubMatrix(self, tokens):
+        """
+        Create a matrix with the similarity values between a subset of tokens. Tokens of the
+        subset keep the order of this matrix, and receive new consecutive IDs
+        :param tokens: List of tokens to keep
+        :return: SimilarityMatrix with the subset of tokens
+        """
+        keepToken = numpy.zeros(self.tokenCount, dtype=bool)
+        keepToken[numpy.array([self.tokenIds[token] for token in tokens if token in self.tokenIds],
+                              dtype=numpy.int64)] = True
+
+        # New ID of each kept token (-1 for removed tokens)
+        keptTokenIds = numpy.flatnonzero(keepToken)
+        newTokenIds = numpy.zeros(self.tokenCount, dtype=numpy.int64) - 1
+        newTokenIds[keptTokenIds] = numpy.arange(len(keptTokenIds))
+
+        # Keep values whose row and column tokens are kept. Rows and columns keep their order
+        rowNumbers = numpy.repeat(numpy.arange(self.tokenCount), numpy.diff(self.indptr))
+        keepValue = keepToken[rowNumbers] & keepToken[self.indices]
+
+        subMatrix = SimilarityMatrix(tokens=[self.tokens[tokenId] for tokenId in keptTokenIds])
+        subMatrix.indptr[1:] = numpy.cumsum(numpy.bincount(newTokenIds[rowNumbers[keepValue]],
+                                                           minlength=len(keptTokenIds)))
+        subMatrix.indices = newTokenIds[self.indices[keepValue]].astype(numpy.int32)
+        subMatrix.data = self.data[keepValue]
+
+        return subMatrix
+
+    def saveToFiles(self, filePrefix):
+        """
+        Store token list and CSR arrays in binary files, to be loaded with loadFromFiles. Each file
+        is written with a temporary name and then renamed, so arrays memory-mapped from previous
+        files (for instance, when quantising a loaded matrix) are still valid while files are written
+        :param filePrefix: Path and prefix of the file names
+        :return:
+        """
+        with open(filePrefix + 'tokens.json', 'w') as tokensFile:
+            tokensFile.write(json.dumps(self.tokens, separators=(',', ':')))
+            tokensFile.close()
+
+        for arrayName, arrayValues in [('indptr', self.indptr), ('indices', self.indices), ('data', self.data)]:
+            with open(filePrefix + arrayName + '.npy.tmp', 'wb') as arrayFile:
+                numpy.save(arrayFile, arrayValues)
+                arrayFile.close()
+
+            os.rename(filePrefix + arrayName + '.npy.tmp', filePrefix + arrayName + '.npy')
+
+    def loadFromFiles(self, filePrefix):
+        """
+        Load CSR arrays stored with saveToFiles. Arrays are memory-mapped (read-only): values are read
+        from disk when they are used, and processes using the same files share them in the page cache
+        :param filePrefix: Path and prefix of the file names
+        :return:
+        """
+        self.indptr = numpy.load(filePrefix + 'indptr.npy', mmap_mode='r')
+        self.indices = numpy.load(filePrefix + 'indices.npy', mmap_mode='r')
+        self.data = numpy.load(filePrefix + 'data.npy', mmap_mode='r')
+
+    def shareMemory(self):
+        """
+        Move CSR arrays into shared memory, so worker processes read the same matrix. Memory-mapped
+        arrays are already shared between processes, so they are kept
+        :return:
+        """
+        if not isinstance(self.indptr, numpy.memmap):
+            self.indptr = createSharedArray(self.indptr)
+
+        if not isinstance(self.indices, numpy.memmap):
+            self.indices = createSharedArray(self.indices)
+
+        if not isinstance(self.data, numpy.memmap):
+            self.data = createSharedArray(self.data)
+
+    def getRow(self, tokenId, exponent=None, valuePowers=None):
+        """
+        Get similar tokens for a token
+        :param tokenId: Token ID
+        :param exponent: Exponent applied to similarity values (None to get similarity values)
+        :param valuePowers: Powers of quantised values obtained with getValuePowers
+        :return: List [indices: IDs of similar tokens, data: similarity values (or their powers)]
+        """
+        rowPositions = slice(self.indptr[tokenId], self.indptr[tokenId + 1])
+        return self.indices[rowPositions], self.getValues(positions=rowPositions, exponent=exponent,
+                                                          valuePowers=valuePowers)
+
+    def getDenseRows(self, tokenIds, exponent=None, valuePowers=None):
+        """
+        Get similarity values between a list of tokens and all the tokens. Tokens without similarity
+        value are zero, also when an exponent is applied
+        :param tokenIds: Array of token IDs
+        :param exponent: Exponent applied to similarity values (None to get similarity values)
+        :param valuePowers: Powers of quantised values obtained with getValuePowers
+        :return: Matrix of similarity values or their powers (one row for each token ID)
+        """
+        rowStarts = self.indptr[tokenIds]
+        rowLengths = self.indptr[tokenIds + 1] - rowStarts
+
+        # Positions of the values of all the rows inside the CSR arrays
+        valuePositions = numpy.concatenate(
+            [numpy.arange(rowStart, rowStart + rowLength) for rowStart, rowLength in zip(rowStarts, rowLengths)]
+            + [numpy.zeros(0, dtype=numpy.int64)]
+        )
+        rowNumbers = numpy.repeat(numpy.arange(len(tokenIds)), rowLengths)
+
+        denseRows = numpy.zeros((len(tokenIds), self.tokenCount), dtype=numpy.float64)
+        denseRows[rowNumbers, self.indices[valuePositions]] = self.getValues(positions=valuePositions,
+                                                                             exponent=exponent,
+                                                                             valuePowers=valuePowers)
+        return denseRows
+
+    def getSimilarity(self, token1, token2):
+        """
+        Get similarity value between two tokens
+        :param token1: Token 1 to check similarity
+        :param token2: Token 2 to check similarity
+        :return: Tokens similarity
+        """
+        if token1 in self.tokenIds and token2 in self.tokenIds:
+            rowIndices, rowData = self.getRow(self.tokenIds[token1])
+            position = numpy.searchsorted(rowIndices, self.tokenIds[token2])
+
+            if position < len(rowIndices) and rowIndices[position] == self.tokenIds[token2]:
+                return float(rowData[position])
+
+        return 0
@@ -1,5 +1,15 @@
+import os
+import time
 import random
+import bisect
+import cPickle
+import heapq
+import hashlib
+from collections import deque
 from Dictionary import Dictionary
+from config import fileconfig
+from PheromoneStore import PheromoneStore
+from FeatureHistory import FeatureHistory
 
 
 class UFSACO:
@@ -12,7 +22,27 @@ class UFSACO:
                  decayRate=0.2,
                  beta=1,
                  initialPheromone=0.2,
-                 exploreExploitCoeff=0.7
+                 exploreExploitCoeff=0.7,
+                 candidateListSize=0,
+                 probabilisticSelection='max',
+                 historyFilePath=None,
+                 stableCycles=0,
+                 stableTopNumber=None,
+                 pheromoneEpsilon=0,
+                 maxSearchTime=0,
+                 checkpointInterval=0,
+                 checkpointFileName=fileconfig.checkpointFileName,
+                 seed=None,
+                 dictionary=None,
+                 metrics=None,
+                 greedyCacheSize=0,
+                 minDocumentFrequency=0,
+                 maxDocumentFrequency=0,
+                 stopwordsFilePath=None,
+                 tokenPattern=None,
+                 vocabularySize=0,
+                 vocabularyMethod='information_gain',
+                 similarityCacheSize=0
                  ):
         """
         UFSACO algorithm to find optimal feature subset based on unsupervised classification
@@ -26,25 +56,88 @@ class UFSACO:
         :param beta: Beta value for transition rule
         :param initialPheromone: Initial pheromone value
         :param exploreExploitCoeff: Exploration / exploitation coefficient [0 to 1]
+        :param candidateListSize: Number of most similar features evaluated on each ant step (0 to evaluate all)
+        :param probabilisticSelection: Selection of probabilistic transition rule (max: highest probability,
+                                       roulette: random selection weighted by probability)
+        :param historyFilePath: File to stream visited features of each cycle (None to keep them in memory)
+        :param stableCycles: Stop when top features ranking does not change for this number of cycles (0 to disable)
+        :param stableTopNumber: Number of top features to verify ranking changes (None to use numberFeatures)
+        :param pheromoneEpsilon: Stop when the highest pheromone change in a cycle is lower than this value (0 to disable)
+        :param maxSearchTime: Stop when search time exceeds this number of seconds (0 to disable)
+        :param checkpointInterval: Number of cycles between search checkpoints (0 to disable)
+        :param checkpointFileName: Checkpoint file name, stored in dictionary folder
+        :param seed: Seed for random generators. Each ant of each cycle uses an independent random generator
+                     derived from the seed (None to use global random generator)
+        :param dictionary: Dictionary already loaded with similarities, shared between searches
+                           (None to load dictionaryName from disk)
+        :param metrics: SearchMetrics instance to record counters and timers of the search (None to disable)
+        :param greedyCacheSize: Maximum number of features keeping their greedy transitions during a cycle
+                                (0 to disable)
+        :param minDocumentFrequency: Minimum number of documents of a feature to be searched
+        :param maxDocumentFrequency: Maximum number of documents of a feature to be searched (0 for no limit,
+                                     float value lower or equal than 1 for a proportion of documents)
+        :param stopwordsFilePath: File with features excluded from the search, one per line (None to disable)
+        :param tokenPattern: Regular expression that searched features must match (None to disable)
+        :param vocabularySize: Search only the top features after previous restrictions (0 to search all)
+        :param vocabularyMethod: Value to choose top features (information_gain, gain_ratio or document_frequency)
+        :param similarityCacheSize: Calculate similarity rows when they are used instead of loading similarity
+                                    files, keeping this number of rows in memory (0 to load similarity files).
+                                    Not applied to a shared dictionary, unless the search is restricted
         """
         # Initialize posting tokens
         self.postingTokens = set()
 
-        # Attempt to load dictionary
-        self.dictionary = Dictionary(dictionaryName=dictionaryName, folderHierarchy=dictionaryFolderHier)
-        self.dictExists = self.dictionary.loadFromDisk()
+        if dictionary is not None:
+            # Use dictionary loaded previously
+            self.dictionary = dictionary
+            self.dictExists = True
+        else:
+            # Attempt to load dictionary
+            self.dictionary = Dictionary(dictionaryName=dictionaryName, folderHierarchy=dictionaryFolderHier)
+            self.dictExists = self.dictionary.loadFromDisk()
+
+            # Load dictionary similarities (not needed when they are calculated on demand)
+            if self.dictExists is True and similarityCacheSize <= 0:
+                self.dictionary.loadSimilarities()
 
-        # Load dictionary similarities
         if self.dictExists is True:
-            # Load similarities
-            self.dictionary.loadSimilarities()
+            # Restrict search to a subset of features, without modifying the dictionary stored in disk
+            stopwords = None
+            if stopwordsFilePath is not None:
+                with open(stopwordsFilePath, 'r') as stopwordsFile:
+                    stopwords = set([line.decode('utf-8').strip().lower() for line in stopwordsFile])
+                    stopwordsFile.close()
+
+            vocabularyTokens = self.dictionary.getRestrictedTokens(
+                minDocumentFrequency=minDocumentFrequency,
+                maxDocumentFrequency=maxDocumentFrequency,
+                stopwords=stopwords,
+                tokenPattern=tokenPattern,
+                topNumber=vocabularySize,
+                topMethod=vocabularyMethod
+            )
+
+            if len(vocabularyTokens) == 0:
+                print '[No features left after restricting search]'
+                self.dictExists = False
+            elif len(vocabularyTokens) < len(self.dictionary.postings):
+                print '[Restricting search to ' + str(len(vocabularyTokens)) + ' of ' + \
+                      str(len(self.dictionary.postings)) + ' features]'
+                self.dictionary = self.dictionary.getRestrictedDictionary(tokens=vocabularyTokens)
+
+        # Dictionaries shared between searches keep their similarities (restricted dictionaries are copies)
+        if self.dictExists is True and similarityCacheSize > 0 and self.dictionary is not dictionary:
+            print '[Calculating similarities on demand, keeping up to ' + str(similarityCacheSize) + ' rows]'
+            self.dictionary.startSimilarityCache(cacheSize=similarityCacheSize)
 
+        if self.dictExists is True:
             # Keep dictionary postings as a set
             self.postingTokens = set(self.dictionary.postings)
 
             # Set parameters for algorithm
             self.numberCycles = numberCycles
-            self.numberAnts = numberAnts
+            # Each ant starts in a different feature
+            self.numberAnts = min(numberAnts, self.dictionary.termCount)
             self.beta = beta
             self.initialPheromone = initialPheromone
 
@@ -66,8 +159,63 @@ class UFSACO:
             else:
                 self.numberFeatures = self.dictionary.termCount
 
-            # List of feature selection counter for each iteration
-            self.featureCounterIteration = {}
+            # Verify probabilistic selection method
+            if probabilisticSelection in ['max', 'roulette']:
+                self.probabilisticSelection = probabilisticSelection
+            else:
+                self.probabilisticSelection = 'max'
+
+            # Candidate list of each feature (created when search starts)
+            self.candidateListSize = max(candidateListSize, 0)
+            self.candidateLists = {}
+
+            # Number of ant steps using candidate lists and number of steps using all the features
+            # because every candidate was already visited
+            self.candidateStepCounter = 0
+            self.candidateFallbackCounter = 0
+
+            # Stop criteria different from number of cycles
+            self.stableCycles = max(stableCycles, 0)
+            self.stableTopNumber = stableTopNumber if stableTopNumber is not None else self.numberFeatures
+            self.pheromoneEpsilon = max(pheromoneEpsilon, 0)
+            self.maxSearchTime = max(maxSearchTime, 0)
+
+            # Stop criterion reached by search (cycles, stable_ranking, pheromone_delta or time_limit)
+            # and number of completed cycles
+            self.stopCriterion = None
+            self.completedCycles = 0
+
+            # Highest pheromone change in last cycle, top features ranking and number of cycles without changes
+            self.pheromoneDelta = 0
+            self.stableTopFeatures = None
+            self.stableCycleCounter = 0
+
+            # Random generators: seed, current cycle and random generator of the ant being moved
+            self.seed = seed
+            self.cycleIteration = 0
+            self.antRandom = random
+
+            # Greedy transitions of each feature in current cycle and order in which they were stored
+            self.greedyCacheSize = max(greedyCacheSize, 0)
+            self.greedyCache = {}
+            self.greedyCacheOrder = deque()
+
+            # Counters and timers of the search (None when disabled)
+            self.metrics = metrics
+
+            # Pheromone exchange with other colonies (island model, configured by UFSACOIslands)
+            self.migrationConnection = None
+            self.migrationInterval = 0
+            self.migrationSize = 0
+            self.migrationRate = 0
+
+            # Search checkpoint configuration
+            self.checkpointInterval = max(checkpointInterval, 0)
+            self.checkpointFilePath = self.dictionary.dictionaryPath + checkpointFileName
+
+            # Visited features on each iteration (created when search starts)
+            self.historyFilePath = historyFilePath
+            self.featureHistory = None
 
             # Initialize feature counter variable for ants
             self.featureCounter = {}
@@ -79,10 +227,22 @@ class UFSACO:
         :return:
         """
         print '[Initializing pheromone values]'
-        self.pheromoneValue = {}
+        self.pheromoneValue = PheromoneStore(tokens=self.dictionary.postings, initialPheromone=self.initialPheromone)
 
-        for token in self.postingTokens:
-            self.pheromoneValue[token] = self.initialPheromone
+    def initCandidateLists(self):
+        """
+        Create candidate list for each feature: the features having the highest
+        similarity values (heuristic desirability), up to candidateListSize features
+        (see Dictionary.getCandidateTokens)
+        :return:
+        """
+        self.candidateLists = {}
+        self.candidateStepCounter = 0
+        self.candidateFallbackCounter = 0
+
+        if self.candidateListSize > 0:
+            print '[Creating candidate lists]'
+            self.candidateLists = self.dictionary.getCandidateTokens(candidateListSize=self.candidateListSize)
 
     def updatePheromone(self, cycleIteration):
         """
@@ -91,28 +251,129 @@ class UFSACO:
         :return:
         """
         if self.dictExists is True:
-            # Update pheromone in each token
-            decayValue = 1 - self.decayRate
-
-            for token in self.postingTokens:
-                tokenPheromoneValue = decayValue * self.pheromoneValue[token]
+            # Highest pheromone change: tokens without visits only lose the decayed pheromone
+            if self.pheromoneEpsilon > 0:
+                self.pheromoneDelta = self.getPheromoneDelta()
 
-                if self.totalFeatureCounter > 0 and token in self.featureCounter:
-                    tokenPheromoneValue += float(self.featureCounter[token]) / self.totalFeatureCounter
+            # Decay pheromone in all the tokens (global scale factor)
+            self.pheromoneValue.decay(1 - self.decayRate)
 
-                # Assign new value to pheromone
-                self.pheromoneValue[token] = tokenPheromoneValue
+            # Increase pheromone only in visited tokens
+            if self.totalFeatureCounter > 0:
+                for token in self.featureCounter:
+                    self.pheromoneValue.add(token, float(self.featureCounter[token]) / self.totalFeatureCounter)
 
             # Store feature counter for iteration
-            self.featureCounterIteration[cycleIteration] = self.featureCounter
+            self.featureHistory.addCycleCounter(cycleIteration=cycleIteration, featureCounter=self.featureCounter)
 
-    def getUnvisitedHeuristics(self, currentToken, unvisitedTokenList):
+    def migratePheromone(self, cycleIteration):
+        """
+        Exchange pheromone values with other colonies (island model). Every migrationInterval cycles,
+        the highest pheromone values are sent through the migration connection and the values received
+        from the other colonies are blended with current pheromone values
+        :param cycleIteration: Cycle iteration
+        :return:
+        """
+        if self.migrationConnection is None or self.migrationInterval <= 0 or \
+                (cycleIteration + 1) % self.migrationInterval != 0:
+            return
+
+        print '[Exchanging pheromone values]'
+        self.migrationConnection.send({
+            'type': 'migration',
+            'cycle': cycleIteration,
+            'pheromone': self.getFeatureResults(topNumber=self.migrationSize, onlyTokens=False)
+        })
+
+        self.blendPheromone(tokenPheromone=self.migrationConnection.recv(), blendRate=self.migrationRate)
+
+    def blendPheromone(self, tokenPheromone, blendRate):
+        """
+        Blend pheromone values of a group of tokens with other values
+        :param tokenPheromone: Pheromone values to blend {token: pheromone value}
+        :param blendRate: Weight of the values to blend [0 to 1]
+        :return:
+        """
+        for token in tokenPheromone:
+            if token in self.postingTokens:
+                self.pheromoneValue.setValue(token, (1 - blendRate) * self.pheromoneValue[token] +
+                                             blendRate * tokenPheromone[token])
+
+    def getPheromoneDelta(self):
+        """
+        Calculate the highest pheromone change that the global update of current cycle
+        will produce. Only tokens having stored pheromone values are checked, tokens
+        sharing the initial value change all by the same amount
+        :return: Highest absolute pheromone change
+        """
+        pheromoneDelta = 0
+
+        # Tokens sharing the initial value (if any)
+        if len(self.pheromoneValue.values) < len(self.postingTokens):
+            pheromoneDelta = self.decayRate * self.pheromoneValue.scale * self.pheromoneValue.defaultValue
+
+        for token in set(self.pheromoneValue.values).union(self.featureCounter):
+            tokenDelta = -self.decayRate * self.pheromoneValue[token]
+
+            if self.totalFeatureCounter > 0 and token in self.featureCounter:
+                tokenDelta += float(self.featureCounter[token]) / self.totalFeatureCounter
+
+            pheromoneDelta = max(pheromoneDelta, abs(tokenDelta))
+
+        return pheromoneDelta
+
+    def checkStopCriteria(self, searchStartTime):
+        """
+        Verify stop criteria after a cycle has finished
+        :param searchStartTime: Time when search started
+        :return: Name of the reached stop criterion, None to continue searching
+        """
+        # Top features ranking does not change
+        if self.stableCycles > 0:
+            topFeatures = self.getFeatureResults(topNumber=self.stableTopNumber)
+
+            if topFeatures == self.stableTopFeatures:
+                self.stableCycleCounter += 1
+            else:
+                self.stableTopFeatures = topFeatures
+                self.stableCycleCounter = 0
+
+            if self.stableCycleCounter >= self.stableCycles:
+                return 'stable_ranking'
+
+        # Pheromone values almost do not change
+        if self.pheromoneEpsilon > 0 and self.pheromoneDelta < self.pheromoneEpsilon:
+            return 'pheromone_delta'
+
+        # Search time is over
+        if self.maxSearchTime > 0 and time.time() - searchStartTime >= self.maxSearchTime:
+            return 'time_limit'
+
+        return None
+
+    def resetFeatureCounter(self):
+        """
+        Initialize feature counter and total feature counter for a new cycle
+        :return:
+        """
+        self.featureCounter = {}
+        self.totalFeatureCounter = 0
+
+    def getCycleFeatureCounter(self):
+        """
+        Get feature counter of current cycle
+        :return: Counter for each visited token {token: counter}
+        """
+        return dict(self.featureCounter)
+
+    def getUnvisitedHeuristics(self, currentToken, visitedTokenList):
         """
         Calculate heuristics information for unvisited feature list
         when ant is in a specific feature
         :param currentToken: Ant position
-        :param unvisitedTokenList: List of unvisited features by ant
-        :return: List [heuristics: list of heuristic values, max_token: for greedy movement, total_heuristics: sum of heuristic values]
+        :param visitedTokenList: Set of features visited by ant
+        :return: List [heuristics: list of heuristic values, max_token: for greedy movement, total_heuristics: sum of heuristic values,
+                 tokens: list of tokens having heuristic value, cumulative_heuristics: cumulative sum of heuristic values for tokens]
         """
         # Keep token having maximum value of heuristics
         argMaxValue = 0
@@ -121,12 +382,43 @@ class UFSACO:
         # List of unvisited heuristics
         unvisitedHeuristics = {}
 
+        # Tokens and cumulative sum of heuristic values, for roulette wheel selection
+        heuristicsTokens = []
+        cumulativeHeuristics = []
+
         # Keep total of heuristics sum
         totalHeuristics = 0
 
-        for unvisitedToken in unvisitedTokenList:
-            heuristicsValue = float(self.pheromoneValue[unvisitedToken] * (
-                self.dictionary.getSimilarity(currentToken, unvisitedToken) ** self.beta))
+        # Only tokens similar to the current token may have a heuristic value different from zero. Similarity
+        # values raised to beta are calculated once for each row
+        similarTokens, similarityPowers = self.dictionary.getSimilarityPowers(currentToken, exponent=self.beta)
+
+        # Use candidate list of current token, unless every candidate has been visited
+        if self.candidateListSize > 0:
+            self.candidateStepCounter += 1
+
+            if currentToken in self.candidateLists and \
+                    not visitedTokenList.issuperset(self.candidateLists[currentToken]):
+                similarTokens = self.candidateLists[currentToken]
+            else:
+                self.candidateFallbackCounter += 1
+
+        # Read stored pheromone values directly, applying the pheromone scale factor
+        pheromoneScale = self.pheromoneValue.scale
+        pheromoneDefault = self.pheromoneValue.defaultValue
+        pheromoneValues = self.pheromoneValue.values
+
+        for unvisitedToken in similarTokens:
+            if unvisitedToken in visitedTokenList:
+                continue
+
+            # Tokens without similarity value have zero heuristic value
+            similarityPower = similarityPowers.get(unvisitedToken, 0)
+            if similarityPower == 0:
+                continue
+
+            heuristicsValue = float(pheromoneScale * pheromoneValues.get(unvisitedToken, pheromoneDefault) *
+                                    similarityPower)
 
             # Store heuristics value if it is different from zero
             if heuristicsValue != 0:
@@ -135,70 +427,206 @@ class UFSACO:
                 # Increment total of heuristics
                 totalHeuristics += heuristicsValue
 
+                heuristicsTokens.append(unvisitedToken)
+                cumulativeHeuristics.append(totalHeuristics)
+
                 # In case obtained value is higher than previous maximum, substitute
                 if heuristicsValue > argMaxValue:
                     argMaxValue = heuristicsValue
                     argMaxToken = unvisitedToken
 
-        return {'heuristics': unvisitedHeuristics, 'max_token': argMaxToken, 'total_heuristics': totalHeuristics}
+        # Evaluated tokens are only counted when metrics are recorded (similarity rows are counted by the dictionary)
+        if self.metrics is not None:
+            self.metrics.addCounter('heuristic_evaluations',
+                                    len([token for token in similarTokens if token not in visitedTokenList]))
 
-    def probabilityTransitionRule(self, unvisitedHeuristics, totalUnvisited):
+        return {'heuristics': unvisitedHeuristics, 'max_token': argMaxToken, 'total_heuristics': totalHeuristics,
+                'tokens': heuristicsTokens, 'cumulative_heuristics': cumulativeHeuristics}
+
+    def resetGreedyCache(self):
+        """
+        Remove greedy transitions stored in the cache (they are valid while pheromone values do not change)
+        :return:
+        """
+        self.greedyCache = {}
+        self.greedyCacheOrder = deque()
+
+    def addGreedyCache(self, currentToken, greedyTokens):
+        """
+        Store greedy transitions of a feature. When the cache is full, the oldest feature is removed
+        :param currentToken: Feature
+        :param greedyTokens: Next features for greedy movement
+        :return:
+        """
+        if len(self.greedyCacheOrder) >= self.greedyCacheSize:
+            del self.greedyCache[self.greedyCacheOrder.popleft()]
+
+        self.greedyCache[currentToken] = greedyTokens
+        self.greedyCacheOrder.append(currentToken)
+
+    def getGreedyTokens(self, currentToken):
+        """
+        Get similar tokens having the highest heuristic values, without considering visited tokens. An ant
+        visits at most numberFeatures tokens besides the current one, so numberFeatures + 1 tokens are kept
+        :param currentToken: Ant position
+        :return: List of tokens ordered by heuristic value (descending, same order as greedy movement for ties)
         """
-        Get token with highest probability to be chosen as next feature
+        similarTokens, similarityPowers = self.dictionary.getSimilarityPowers(currentToken, exponent=self.beta)
+
+        if self.candidateListSize > 0:
+            similarTokens = self.candidateLists.get(currentToken, [])
+
+        # Read stored pheromone values directly, applying the pheromone scale factor
+        pheromoneScale = self.pheromoneValue.scale
+        pheromoneDefault = self.pheromoneValue.defaultValue
+        pheromoneValues = self.pheromoneValue.values
+
+        tokenHeuristics = {}
+        for similarToken in similarTokens:
+            similarityPower = similarityPowers.get(similarToken, 0)
+            if similarityPower == 0:
+                continue
+
+            heuristicsValue = float(pheromoneScale * pheromoneValues.get(similarToken, pheromoneDefault) *
+                                    similarityPower)
+
+            if heuristicsValue != 0:
+                tokenHeuristics[similarToken] = heuristicsValue
+
+        return heapq.nlargest(self.numberFeatures + 1, [token for token in similarTokens if token in tokenHeuristics],
+                              key=tokenHeuristics.__getitem__)
+
+    def getCachedGreedyFeature(self, currentToken, visitedTokenList):
+        """
+        Get next feature for greedy movement from the greedy transitions of current feature, which are
+        calculated once per cycle. Next feature is the first greedy transition not visited by the ant
+        :param currentToken: Ant position
+        :param visitedTokenList: Features visited by ant
+        :return: Next feature (None if it can not be obtained from greedy transitions)
+        """
+        greedyTokens = self.greedyCache.get(currentToken)
+
+        if greedyTokens is None:
+            greedyTokens = self.getGreedyTokens(currentToken)
+            self.addGreedyCache(currentToken, greedyTokens)
+
+            if self.metrics is not None:
+                self.metrics.addCounter('greedy_cache_misses')
+        elif self.metrics is not None:
+            self.metrics.addCounter('greedy_cache_hits')
+
+        nextToken = self.getFirstUnvisited(greedyTokens=greedyTokens, visitedTokenList=visitedTokenList)
+
+        # Step uses candidate list of current token
+        if nextToken is not None and self.candidateListSize > 0:
+            self.candidateStepCounter += 1
+
+        return nextToken
+
+    def getFirstUnvisited(self, greedyTokens, visitedTokenList):
+        """
+        Get first greedy transition not visited by the ant
+        :param greedyTokens: Greedy transitions of current feature
+        :param visitedTokenList: Set of features visited by ant
+        :return: Next feature (None if every greedy transition has been visited)
+        """
+        for greedyToken in greedyTokens:
+            if greedyToken not in visitedTokenList:
+                return greedyToken
+
+        return None
+
+    def probabilityTransitionRule(self, unvisitedHeuristics, totalUnvisited, candidateTokens=None,
+                                  cumulativeHeuristics=None):
+        """
+        Get next feature using probabilistic rule. Depending on probabilisticSelection value,
+        get token with highest probability or select a random token weighted by its probability
         :param unvisitedHeuristics: List of unvisited tokens heuristics
         :param totalUnvisited: Total of sum of tokens heuristics
-        :return: Token with highest probability
+        :param candidateTokens: List of tokens having heuristic value (for roulette selection)
+        :param cumulativeHeuristics: Cumulative sum of heuristic values of tokens (for roulette selection)
+        :return: Selected token
         """
-        argMaxProbValue = 0
-        argMaxToken = None
-        for unvisitedToken in unvisitedHeuristics:
-            probValue = unvisitedHeuristics[unvisitedToken] / totalUnvisited
+        if self.probabilisticSelection == 'roulette':
+            return self.rouletteSelection(candidateTokens=candidateTokens, cumulativeHeuristics=cumulativeHeuristics)
 
+        # Probability is proportional to heuristic value, which is compared directly (dividing by
+        # the total may round different values to the same probability). Tokens are evaluated in
+        # postings order, so the first token wins on equal values
+        argMaxValue = 0
+        argMaxToken = None
+        for unvisitedToken in candidateTokens:
             # In case obtained value is higher than previous maximum, substitute
-            if probValue > argMaxProbValue:
-                argMaxProbValue = probValue
+            if unvisitedHeuristics[unvisitedToken] > argMaxValue:
+                argMaxValue = unvisitedHeuristics[unvisitedToken]
                 argMaxToken = unvisitedToken
 
         return argMaxToken
 
+    def rouletteSelection(self, candidateTokens, cumulativeHeuristics):
+        """
+        Roulette wheel selection: a token is chosen with probability proportional to its
+        heuristic value, using binary search on the cumulative sum of heuristic values
+        :param candidateTokens: List of tokens having heuristic value
+        :param cumulativeHeuristics: Cumulative sum of heuristic values of tokens
+        :return: Selected token
+        """
+        if len(candidateTokens) == 0:
+            return None
+
+        rouletteValue = self.antRandom.random() * cumulativeHeuristics[-1]
+        selectedPosition = bisect.bisect_right(cumulativeHeuristics, rouletteValue)
+
+        return candidateTokens[min(selectedPosition, len(candidateTokens) - 1)]
+
     def moveAnt(self, currentFeature):
         """
         Move ant to next feature and modify feature counter
         :param currentFeature: Feature where ant has been positioned
         :return:
         """
-        # Initialize unvisited features
-        unvisitedFeatureList = set(self.dictionary.postings)
-        unvisitedFeatureList.remove(currentFeature)
+        # Initialize visited features (every other feature in postings is unvisited)
+        visitedFeatureList = set([currentFeature])
 
         # Execute according to the number of features an ant has to move in
         for featureNumber in range(0, self.numberFeatures):
-            # Get heuristic information for unvisited features
-            heuristicsInformation = self.getUnvisitedHeuristics(
-                currentToken=currentFeature,
-                unvisitedTokenList=unvisitedFeatureList
-            )
-
             """
             Random assignment to choose transition rule [0, 1]
             On each feature, ant decides to move in a greedy or probabilistic way
             """
-            transitionSelection = random.random()
-
-            if transitionSelection <= self.exploreExploitCoefficient:
-                # Get next feature from maximum value found in heuristics information
-                nextFeature = heuristicsInformation['max_token']
-            else:
-                # Calculate transition using probabilistic rule
-                nextFeature = self.probabilityTransitionRule(unvisitedHeuristics=heuristicsInformation['heuristics'],
-                                                             totalUnvisited=heuristicsInformation['total_heuristics'])
+            transitionSelection = self.antRandom.random()
+            nextFeature = None
+
+            # Greedy movement from the greedy transitions of current feature (if enabled)
+            if transitionSelection <= self.exploreExploitCoefficient and self.greedyCacheSize > 0:
+                nextFeature = self.getCachedGreedyFeature(currentToken=currentFeature,
+                                                          visitedTokenList=visitedFeatureList)
+
+            if nextFeature is None:
+                # Get heuristic information for unvisited features
+                heuristicsInformation = self.getUnvisitedHeuristics(
+                    currentToken=currentFeature,
+                    visitedTokenList=visitedFeatureList
+                )
+
+                if transitionSelection <= self.exploreExploitCoefficient:
+                    # Get next feature from maximum value found in heuristics information
+                    nextFeature = heuristicsInformation['max_token']
+                else:
+                    # Calculate transition using probabilistic rule
+                    nextFeature = self.probabilityTransitionRule(
+                        unvisitedHeuristics=heuristicsInformation['heuristics'],
+                        totalUnvisited=heuristicsInformation['total_heuristics'],
+                        candidateTokens=heuristicsInformation['tokens'],
+                        cumulativeHeuristics=heuristicsInformation['cumulative_heuristics']
+                    )
 
             # Move ant to new feature
             if nextFeature is not None:
                 currentFeature = nextFeature
 
-                # Remove feature from unvisited list
-                unvisitedFeatureList.remove(nextFeature)
+                # Add feature to visited list
+                visitedFeatureList.add(nextFeature)
 
                 # Update counter
                 if nextFeature not in self.featureCounter:
@@ -207,57 +635,310 @@ class UFSACO:
                 self.featureCounter[nextFeature] += 1
                 self.totalFeatureCounter += 1
             else:
+                # Ant stops: there are no unvisited features with heuristic value
+                if self.metrics is not None:
+                    self.metrics.addCounter('dead_end_steps')
                 break
 
-    def searchSubset(self):
+    def getRandomStream(self, *streamKey):
         """
-        Perform ACO algorithm for searching subset of features
+        Create a random generator derived from the seed and a stream key. The same
+        seed and key always produce the same sequence of random values
+        :param streamKey: Values identifying the random generator (cycle, ant number...)
+        :return: Random generator
+        """
+        streamSeed = '-'.join([str(keyValue) for keyValue in (self.seed,) + streamKey])
+        return random.Random(int(hashlib.md5(streamSeed).hexdigest(), 16))
+
+    def getAntRandom(self, antNumber):
+        """
+        Get random generator for an ant in current cycle
+        :param antNumber: Ant number
+        :return: Random generator (global random generator if there is no seed)
+        """
+        if self.seed is None:
+            return random
+
+        return self.getRandomStream(self.cycleIteration, antNumber)
+
+    def placeAnts(self):
+        """
+        Assign a unique random feature to each ant
+        :return: List of initial features (one for each ant)
+        """
+        # Get term count range from dictionary
+        termCountRange = self.dictionary.termCount - 1
+
+        # Random generator for the placement of current cycle
+        placementRandom = random
+        if self.seed is not None:
+            placementRandom = self.getRandomStream(self.cycleIteration, 'placement')
+
+        # This vector is used to assign ants in different features randomly
+        initialFeaturesValues = []
+        initialFeatures = []
+        for antNumber in range(0, self.numberAnts):
+            # Assign a unique feature to each ant
+            while True:
+                randomFeatureValue = placementRandom.randint(0, termCountRange)
+                if randomFeatureValue not in initialFeaturesValues:
+                    break
+
+            # Append feature value to list
+            initialFeaturesValues.append(randomFeatureValue)
+            initialFeatures.append(self.dictionary.postings[randomFeatureValue])
+
+        return initialFeatures
+
+    def moveAnts(self, initialFeatures, antNumbers=None):
+        """
+        Move all the ants of a cycle, one after another
+        :param initialFeatures: List of initial features (one for each ant)
+        :param antNumbers: Number of each ant in the cycle (None for consecutive numbers)
         :return:
         """
-        if self.dictExists is True:
-            # Step 1: initialize pheromone
-            self.initPheromone()
+        if antNumbers is None:
+            antNumbers = range(0, len(initialFeatures))
 
-            # Get term count range from dictionary
-            termCountRange = self.dictionary.termCount - 1
+        for antNumber, antCurrentFeature in zip(antNumbers, initialFeatures):
+            self.antRandom = self.getAntRandom(antNumber)
 
-            # Execute searching for a number of iterations set in the constructor
-            cycleIteration = 0
+            if self.metrics is None:
+                self.moveAnt(currentFeature=antCurrentFeature)
+            else:
+                moveStartTime = time.time()
+                self.moveAnt(currentFeature=antCurrentFeature)
+                self.metrics.addTime('move_ant', time.time() - moveStartTime)
+
+    def getPheromoneState(self):
+        """
+        Get pheromone values to store in a checkpoint
+        :return: Pheromone state
+        """
+        return {
+            'scale': self.pheromoneValue.scale,
+            'default': self.pheromoneValue.defaultValue,
+            'values': self.pheromoneValue.values
+        }
+
+    def setPheromoneState(self, pheromoneState):
+        """
+        Restore pheromone values from a checkpoint
+        :param pheromoneState: Pheromone state obtained with getPheromoneState
+        :return:
+        """
+        self.pheromoneValue.scale = pheromoneState['scale']
+        self.pheromoneValue.defaultValue = pheromoneState['default']
+        self.pheromoneValue.values = pheromoneState['values']
+
+    def getCheckpointParameters(self):
+        """
+        Get search configuration stored in checkpoints. A checkpoint is only resumed by a search
+        having the same configuration: dictionary and searched features, engine and parameters
+        of the transition rule and pheromone update
+        :return: Search configuration {parameter: value}
+        """
+        return {
+            'dictionary': self.dictionary.dictionaryName,
+            'features': hashlib.md5(u'\n'.join(self.dictionary.postings).encode('utf-8')).hexdigest(),
+            'engine': self.__class__.__name__,
+            'number_ants': self.numberAnts,
+            'number_features': self.numberFeatures,
+            'beta': self.beta,
+            'decay_rate': self.decayRate,
+            'initial_pheromone': self.initialPheromone,
+            'explore_exploit': self.exploreExploitCoefficient,
+            'candidate_list_size': self.candidateListSize,
+            'probabilistic_selection': self.probabilisticSelection,
+            'seed': self.seed
+        }
+
+    def saveCheckpoint(self, cycleIteration, searchElapsedTime):
+        """
+        Store search state in checkpoint file: pheromone values, cycle iteration, random
+        generator state, stop criteria state and visited features history. File is
+        replaced only once the new checkpoint is completely written
+        :param cycleIteration: Next cycle iteration to execute
+        :param searchElapsedTime: Search time until the checkpoint
+        :return:
+        """
+        checkpointState = {
+            'parameters': self.getCheckpointParameters(),
+            'cycle': cycleIteration,
+            'elapsed': searchElapsedTime,
+            'random': random.getstate(),
+            'pheromone': self.getPheromoneState(),
+            'history': self.featureHistory.getState(),
+            'stable_top_features': self.stableTopFeatures,
+            'stable_cycles': self.stableCycleCounter,
+            'candidate_steps': self.candidateStepCounter,
+            'candidate_fallbacks': self.candidateFallbackCounter
+        }
+
+        temporaryFilePath = self.checkpointFilePath + '.tmp'
+        with open(temporaryFilePath, 'wb') as checkpointFile:
+            cPickle.dump(checkpointState, checkpointFile, cPickle.HIGHEST_PROTOCOL)
+            checkpointFile.close()
+
+        os.rename(temporaryFilePath, self.checkpointFilePath)
+
+    def loadCheckpoint(self):
+        """
+        Restore search state from checkpoint file. Checkpoints stored by a search with a different
+        configuration (see getCheckpointParameters) are ignored
+        :return: Checkpoint state (None if there is no checkpoint or it can not be resumed)
+        """
+        if not os.path.exists(self.checkpointFilePath):
+            return None
+
+        with open(self.checkpointFilePath, 'rb') as checkpointFile:
+            checkpointState = cPickle.load(checkpointFile)
+            checkpointFile.close()
 
-            # Create range for ants
-            antRange = range(0, self.numberAnts)
+        checkpointParameters = checkpointState.get('parameters', {})
+        searchParameters = self.getCheckpointParameters()
+        changedParameters = sorted([parameterName for parameterName in searchParameters
+                                    if checkpointParameters.get(parameterName) != searchParameters[parameterName]])
 
-            # This part will be executed self.numberCycles times from the constructor
-            while cycleIteration < self.numberCycles:
-                print '[Iteration #' + str(cycleIteration + 1) + ']'
+        if len(changedParameters) > 0:
+            print '[Checkpoint ignored, search configuration is different: ' + ', '.join(changedParameters) + ']'
+            return None
 
-                # Step 2: place ants in random features
-                self.featureCounter = {}  # Initialize feature counter in each iteration
-                self.totalFeatureCounter = 0  # Initialize total feature counter
+        print '[Resuming search from checkpoint]'
 
-                # This vector is used to assign ants in different features randomly
-                initialFeaturesValues = []
-                for antNumber in antRange:
-                    # Assign a unique feature to each ant
-                    while True:
-                        randomFeatureValue = random.randint(0, termCountRange)
-                        if randomFeatureValue not in initialFeaturesValues:
-                            break
+        random.setstate(checkpointState['random'])
+        self.setPheromoneState(checkpointState['pheromone'])
+        self.featureHistory.setState(checkpointState['history'])
+        self.stableTopFeatures = checkpointState['stable_top_features']
+        self.stableCycleCounter = checkpointState['stable_cycles']
+        self.candidateStepCounter = checkpointState['candidate_steps']
+        self.candidateFallbackCounter = checkpointState['candidate_fallbacks']
+
+        return checkpointState
+
+    def iterSearch(self, resume=False, topNumber=None):
+        """
+        Perform ACO algorithm for searching subset of features, one cycle at a time. A snapshot of the
+        search is generated after each cycle, so search progress can be followed and search can be stopped
+        at any cycle (stop criterion is set to "stopped" when the generator is closed before the end)
+        :param resume: Continue search from last checkpoint (if any)
+        :param topNumber: Number of top features included in each snapshot (None to use stableTopNumber)
+        :return: Generator of snapshots [cycle: cycle number, elapsed: search time in seconds,
+                 top_features: tokens with the highest pheromone value, feature_counter: counter for each
+                 token visited in the cycle {token: counter}, stop_criterion: stop criterion reached in the
+                 cycle (None if search continues)]
+        """
+        if self.dictExists is True:
+            if topNumber is None:
+                topNumber = self.stableTopNumber
 
-                    # Assign feature to ant and save into list of visited
-                    antCurrentFeature = self.dictionary.postings[randomFeatureValue]
+            # Step 1: initialize pheromone and candidate lists
+            self.initPheromone()
+            self.initCandidateLists()
+            self.featureHistory = FeatureHistory(tokens=self.dictionary.postings, historyFilePath=self.historyFilePath)
 
-                    # Append feature value to list
-                    initialFeaturesValues.append(randomFeatureValue)
+            # Similarity rows are counted from the start of the search
+            self.dictionary.getSimilarityCounters()
 
-                    # Create new thread, append to list
-                    self.moveAnt(currentFeature=antCurrentFeature)
+            # Initialize stop criteria
+            searchStartTime = time.time()
+            self.stopCriterion = 'cycles'
+            self.stableTopFeatures = None
+            self.stableCycleCounter = 0
 
-                # Step 4: global pheromone update
-                self.updatePheromone(cycleIteration=cycleIteration)
+            # Execute searching for a number of iterations set in the constructor
+            cycleIteration = 0
 
-                # Add iteration counter
-                cycleIteration += 1
+            # Restore search state from last checkpoint
+            if resume is True:
+                checkpointState = self.loadCheckpoint()
+
+                if checkpointState is not None:
+                    cycleIteration = checkpointState['cycle']
+                    searchStartTime -= checkpointState['elapsed']
+
+            try:
+                # This part will be executed self.numberCycles times from the constructor (unless a stop criterion is reached)
+                while cycleIteration < self.numberCycles:
+                    print '[Iteration #' + str(cycleIteration + 1) + ']'
+                    self.cycleIteration = cycleIteration
+
+                    cycleStartTime = time.time()
+
+                    # Step 2: place ants in random features
+                    self.resetFeatureCounter()  # Initialize feature counter in each iteration
+                    self.resetGreedyCache()  # Greedy transitions depend on pheromone values
+                    initialFeatures = self.placeAnts()
+
+                    # Step 3: move ants through the features
+                    moveStartTime = time.time()
+                    self.moveAnts(initialFeatures=initialFeatures)
+
+                    # Step 4: global pheromone update and pheromone exchange with other colonies (if any)
+                    updateStartTime = time.time()
+                    self.updatePheromone(cycleIteration=cycleIteration)
+                    self.migratePheromone(cycleIteration=cycleIteration)
+
+                    if self.metrics is not None:
+                        cycleEndTime = time.time()
+                        self.metrics.addTime('move_ants', updateStartTime - moveStartTime)
+                        self.metrics.addTime('update_pheromone', cycleEndTime - updateStartTime)
+                        self.metrics.addTime('cycle', cycleEndTime - cycleStartTime)
+                        self.metrics.addCounter('ant_steps', self.totalFeatureCounter)
+
+                        similarityLookups, similarityMisses = self.dictionary.getSimilarityCounters()
+                        self.metrics.addCounter('similarity_lookups', similarityLookups)
+                        self.metrics.addCounter('similarity_misses', similarityMisses)
+
+                        if self.dictionary.similarityCache is not None:
+                            cacheHits, cacheMisses = self.dictionary.getSimilarityCacheCounters()
+                            self.metrics.addCounter('similarity_cache_hits', cacheHits)
+                            self.metrics.addCounter('similarity_cache_misses', cacheMisses)
+
+                    # Add iteration counter
+                    cycleIteration += 1
+                    self.completedCycles = cycleIteration
+
+                    # Step 5: verify stop criteria
+                    stopCriterion = self.checkStopCriteria(searchStartTime=searchStartTime)
+                    if stopCriterion is not None:
+                        self.stopCriterion = stopCriterion
+                    else:
+                        # Step 6: store search checkpoint
+                        if self.checkpointInterval > 0 and cycleIteration % self.checkpointInterval == 0:
+                            self.saveCheckpoint(cycleIteration=cycleIteration,
+                                                searchElapsedTime=time.time() - searchStartTime)
+
+                        if cycleIteration >= self.numberCycles:
+                            stopCriterion = 'cycles'
+
+                    # Step 7: generate snapshot of the cycle
+                    yield {
+                        'cycle': cycleIteration,
+                        'elapsed': time.time() - searchStartTime,
+                        'top_features': self.getFeatureResults(topNumber=topNumber),
+                        'feature_counter': self.getCycleFeatureCounter(),
+                        'stop_criterion': stopCriterion
+                    }
+
+                    if stopCriterion is not None:
+                        break
+            except GeneratorExit:
+                # Search stopped by the caller
+                self.stopCriterion = 'stopped'
+                raise
+            finally:
+                self.completedCycles = cycleIteration
+                self.featureHistory.close()
+
+    def searchSubset(self, resume=False):
+        """
+        Perform ACO algorithm for searching subset of features
+        :param resume: Continue search from last checkpoint (if any)
+        :return:
+        """
+        for _ in self.iterSearch(resume=resume):
+            pass
 
     def getFeatureResults(self, topNumber, onlyTokens=True):
         """
@@ -266,11 +947,8 @@ class UFSACO:
         :param onlyTokens: Get only token list. If False, return also pheromone value
         :return:
         """
-        # Sort results based on pheromone value
-        orderedFeatures = sorted(self.pheromoneValue, key=self.pheromoneValue.__getitem__, reverse=True)
-
-        if len(orderedFeatures) >= topNumber:
-            orderedFeatures = orderedFeatures[0:topNumber]
+        # Get tokens having the highest pheromone value
+        orderedFeatures = self.pheromoneValue.getTopTokens(topNumber=topNumber)
 
         # Return only token list
         if onlyTokens is True:
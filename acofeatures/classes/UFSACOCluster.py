@@ -0,0 +1,308 @@
+import os
+import time
+import socket
+import binascii
+import threading
+import traceback
+from multiprocessing.connection import Listener
+from multiprocessing.connection import Client
+from multiprocessing import AuthenticationError
+from UFSACOVectorized import UFSACOVectorized
+from Dictionary import Dictionary
+from config import fileconfig
+
+
+def isLoopbackHost(host):
+    """
+    Verify that a host name or address only accepts connections from the same host
+    :param host: Host name or address
+    :return: True if host is a loopback address
+    """
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+
+def createAuthKey():
+    """
+    Create a random authentication key to share between coordinator and workers
+    :return: Authentication key (hexadecimal string)
+    """
+    return binascii.hexlify(os.urandom(16))
+
+
+class UFSACOCoordinator:
+    def __init__(self, jobs, authKey, host='localhost', port=6000, jobTimeout=0, maxAttempts=3):
+        """
+        Coordinator of UFSACO searches executed by worker processes on several hosts. Workers connect
+        through TCP and receive one job at a time. If a worker is lost (connection closed or job timeout),
+        its job is queued again and executed by another worker
+        :param jobs: List of jobs [name: job name, engine: engine name, parameters: UFSACO parameters
+                     (including seed), top_features: number of features to retrieve]
+        :param authKey: Authentication key shared with workers. Workers send pickled objects, so only
+                        processes knowing the key must be able to connect (see createAuthKey)
+        :param host: Host name or address to listen for workers
+        :param port: Port to listen for workers
+        :param jobTimeout: Maximum number of seconds to wait for the results of a job (0 to wait without limit)
+        :param maxAttempts: Maximum number of times a job is sent to workers
+        """
+        self.jobs = jobs
+        self.host = host
+        self.port = port
+        self.authKey = authKey
+        self.jobTimeout = max(jobTimeout, 0)
+        self.maxAttempts = max(maxAttempts, 1)
+
+        # Job numbers waiting for a worker, number of times each job was sent and results of each job
+        self.pendingJobs = range(0, len(jobs))
+        self.jobAttempts = [0] * len(jobs)
+        self.jobResults = {}
+
+        # Condition to wait for pending jobs and job results
+        self.jobCondition = threading.Condition()
+
+        # Coordinator is accepting worker connections
+        self.listening = False
+
+    def getNextJob(self):
+        """
+        Get next pending job, waiting while jobs executed by other workers may be queued again
+        :return: Job number (None when all the jobs have results)
+        """
+        with self.jobCondition:
+            while len(self.pendingJobs) == 0 and len(self.jobResults) < len(self.jobs):
+                self.jobCondition.wait(1)
+
+            if len(self.pendingJobs) == 0:
+                return None
+
+            jobNumber = self.pendingJobs.pop(0)
+            self.jobAttempts[jobNumber] += 1
+            return jobNumber
+
+    def setJobResult(self, jobNumber, jobResult):
+        """
+        Store results of a job
+        :param jobNumber: Job number
+        :param jobResult: Job results sent by a worker
+        :return:
+        """
+        with self.jobCondition:
+            self.jobResults[jobNumber] = jobResult
+            self.jobCondition.notify_all()
+
+    def requeueJob(self, jobNumber, workerName):
+        """
+        Queue again a job of a lost worker. Jobs sent maxAttempts times are marked as failed
+        :param jobNumber: Job number
+        :param workerName: Name of the lost worker
+        :return:
+        """
+        with self.jobCondition:
+            if self.jobAttempts[jobNumber] < self.maxAttempts:
+                print '[Worker ' + workerName + ' lost, job #' + str(jobNumber + 1) + ' queued again]'
+                self.pendingJobs.insert(0, jobNumber)
+            else:
+                print '[Worker ' + workerName + ' lost, job #' + str(jobNumber + 1) + ' failed]'
+                self.jobResults[jobNumber] = {'type': 'error', 'job': jobNumber, 'worker': workerName,
+                                              'message': 'Job failed after ' + str(self.maxAttempts) + ' attempts'}
+
+            self.jobCondition.notify_all()
+
+    def serveWorker(self, workerConnection):
+        """
+        Send jobs to a worker until all the jobs have results
+        :param workerConnection: Connection with the worker
+        :return:
+        """
+        workerName = 'unknown'
+        jobNumber = None
+
+        try:
+            workerName = workerConnection.recv()['worker']
+            print '[Worker ' + workerName + ' connected]'
+
+            while True:
+                jobNumber = self.getNextJob()
+
+                if jobNumber is None:
+                    workerConnection.send({'type': 'stop'})
+                    break
+
+                jobMessage = dict(self.jobs[jobNumber])
+                jobMessage['type'] = 'job'
+                jobMessage['job'] = jobNumber
+                workerConnection.send(jobMessage)
+
+                # Worker is considered lost if results are not received before job timeout
+                if self.jobTimeout > 0 and not workerConnection.poll(self.jobTimeout):
+                    raise IOError('Job timeout')
+
+                jobResult = workerConnection.recv()
+                jobResult['worker'] = workerName
+                print '[Job #' + str(jobNumber + 1) + ' of ' + str(len(self.jobs)) + ' finished by ' + \
+                      workerName + ']'
+
+                self.setJobResult(jobNumber, jobResult)
+                jobNumber = None
+        except (EOFError, IOError, socket.error):
+            if jobNumber is not None:
+                self.requeueJob(jobNumber, workerName)
+        finally:
+            workerConnection.close()
+
+    def acceptWorkers(self, listener):
+        """
+        Accept worker connections, serving each worker in its own thread
+        :param listener: Listener for worker connections
+        :return:
+        """
+        while self.listening is True:
+            try:
+                workerConnection = listener.accept()
+            except (EOFError, IOError, socket.error, AuthenticationError):
+                # Failed authentication or listener closed
+                continue
+
+            workerThread = threading.Thread(target=self.serveWorker, args=(workerConnection,))
+            workerThread.daemon = True
+            workerThread.start()
+
+    def run(self):
+        """
+        Wait for workers and distribute the jobs until all of them have results
+        :return: List of results for each job
+        """
+        listener = Listener((self.host, self.port), authkey=self.authKey)
+        self.listening = True
+        print '[Waiting for workers on ' + self.host + ':' + str(self.port) + ']'
+
+        acceptThread = threading.Thread(target=self.acceptWorkers, args=(listener,))
+        acceptThread.daemon = True
+        acceptThread.start()
+
+        with self.jobCondition:
+            while len(self.jobResults) < len(self.jobs):
+                self.jobCondition.wait(1)
+
+        self.listening = False
+        listener.close()
+        return [self.jobResults[jobNumber] for jobNumber in range(0, len(self.jobs))]
+
+
+class UFSACOWorker:
+    def __init__(self, engines, authKey, host='localhost', port=6000, workerName=None):
+        """
+        Worker executing UFSACO searches sent by a coordinator. Dictionaries are read from the
+        dictionary folder configured in dirconfig.py, so every host must have the same folder available.
+        Each dictionary is loaded once and shared by all the jobs of the worker
+        :param engines: Available UFSACO engines {engine name: UFSACO class}
+        :param authKey: Authentication key shared with the coordinator
+        :param host: Host name or address of the coordinator
+        :param port: Port of the coordinator
+        :param workerName: Name to identify the worker (None to use host name and process ID)
+        """
+        self.engines = engines
+        self.host = host
+        self.port = port
+        self.authKey = authKey
+        self.workerName = workerName if workerName is not None else socket.gethostname() + ':' + str(os.getpid())
+
+        # Loaded dictionaries and similarity matrices {dictionary name: value}
+        self.dictionaries = {}
+        self.similarityMatrices = {}
+
+    def getDictionary(self, dictionaryName):
+        """
+        Get dictionary with similarities, loading it the first time
+        :param dictionaryName: Dictionary name
+        :return: Dictionary (None if dictionary does not exist)
+        """
+        if dictionaryName not in self.dictionaries:
+            dictionary = Dictionary(dictionaryName=dictionaryName, folderHierarchy='')
+            if dictionary.loadFromDisk() is False:
+                return None
+
+            dictionary.loadSimilarities()
+            self.dictionaries[dictionaryName] = dictionary
+
+        return self.dictionaries[dictionaryName]
+
+    def getSimilarityMatrix(self, dictionaryName):
+        """
+        Get similarity matrix of a dictionary, creating it the first time
+        :param dictionaryName: Dictionary name
+        :return: Similarity matrix
+        """
+        if dictionaryName not in self.similarityMatrices:
+            self.similarityMatrices[dictionaryName] = self.getDictionary(dictionaryName).getSimilarityMatrix()
+
+        return self.similarityMatrices[dictionaryName]
+
+    def runJob(self, jobMessage):
+        """
+        Perform UFSACO search of a job
+        :param jobMessage: Job sent by the coordinator
+        :return: Job results [features: selected features, search_time, stop_criterion, cycles]
+        """
+        dictionaryName = jobMessage.get('dictionary', 'training')
+        dictionary = self.getDictionary(dictionaryName)
+        if dictionary is None:
+            return {'type': 'error', 'job': jobMessage['job'],
+                    'message': 'Dictionary ' + dictionaryName + ' does not exist'}
+
+        engine = self.engines[jobMessage['engine']]
+        engineParameters = dict(jobMessage['parameters'])
+
+        # Vectorized engines use the similarity matrix created once for all the jobs
+        if issubclass(engine, UFSACOVectorized):
+            engineParameters['similarity'] = self.getSimilarityMatrix(dictionaryName)
+
+        aco = engine(
+            dictionaryName=dictionaryName,
+            dictionaryFolderHier='',
+            dictionary=dictionary,
+            checkpointFileName=jobMessage['name'] + '.' + fileconfig.checkpointFileName,
+            **engineParameters
+        )
+
+        searchStartTime = time.time()
+        aco.searchSubset()
+        searchTime = round(time.time() - searchStartTime, 4)
+
+        return {
+            'type': 'result',
+            'job': jobMessage['job'],
+            'features': aco.getFeatureResults(topNumber=jobMessage['top_features']),
+            'search_time': searchTime,
+            'stop_criterion': aco.stopCriterion,
+            'cycles': aco.completedCycles
+        }
+
+    def run(self):
+        """
+        Connect to the coordinator and perform jobs until coordinator sends stop message
+        :return:
+        """
+        coordinatorConnection = Client((self.host, self.port), authkey=self.authKey)
+        coordinatorConnection.send({'worker': self.workerName})
+
+        try:
+            while True:
+                jobMessage = coordinatorConnection.recv()
+
+                if jobMessage['type'] == 'stop':
+                    break
+
+                print '[Job #' + str(jobMessage['job'] + 1) + ': ' + jobMessage['name'] + ']'
+
+                try:
+                    jobResult = self.runJob(jobMessage)
+                except Exception:
+                    # Errors of a job are sent to the coordinator, the job is not queued again
+                    jobResult = {'type': 'error', 'job': jobMessage['job'], 'message': traceback.format_exc()}
+
+                coordinatorConnection.send(jobResult)
+        finally:
+            coordinatorConnection.close()
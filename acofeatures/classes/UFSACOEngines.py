@@ -0,0 +1,15 @@
+from UFSACO import UFSACO
+from UFSACOVectorized import UFSACOVectorized
+
+# Available UFSACO engines (selected with the "engine" configuration value). They are defined apart from
+# ufsaco.py, so sweep workers can use them without loading classifiers (Weka and JVM)
+ufsacoEngines = {
+    'default': UFSACO,
+    'vectorized': UFSACOVectorized
+}
+
+# Optional configuration available only for a specific engine
+ufsacoEngineOptions = {
+    'default': [],
+    'vectorized': ['batchAnts', 'numberProcesses', 'quantiseSimilarities']
+}
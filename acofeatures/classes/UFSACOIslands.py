@@ -0,0 +1,302 @@
+import random
+import multiprocessing
+from UFSACO import UFSACO
+from UFSACOVectorized import UFSACOVectorized
+from Dictionary import Dictionary
+from FeatureHistory import FeatureHistory
+from config import fileconfig
+
+# Colonies executed by island processes. They are inherited by the processes when they are started,
+# so dictionary and similarity values are loaded only once
+islandColonies = []
+
+
+def runIsland(islandNumber, migrationConnection, resume):
+    """
+    Perform search of a colony inside an island process. Pheromone values are exchanged through the
+    migration connection during the search, and search results are sent at the end
+    :param islandNumber: Island number
+    :param migrationConnection: Connection with the coordinator process
+    :param resume: Continue search from last checkpoint (if any)
+    :return:
+    """
+    # Random generator must not share the state of the parent process
+    random.seed()
+
+    colony = islandColonies[islandNumber]
+    colony.migrationConnection = migrationConnection
+    colony.searchSubset(resume=resume)
+
+    migrationConnection.send({
+        'type': 'done',
+        'pheromone': colony.getFeatureResults(topNumber=colony.dictionary.termCount, onlyTokens=False),
+        'stop_criterion': colony.stopCriterion,
+        'cycles': colony.completedCycles,
+        'history': list(colony.featureHistory.iterCycles()),
+        'candidate_steps': colony.candidateStepCounter,
+        'candidate_fallbacks': colony.candidateFallbackCounter,
+        'metrics': colony.metrics.getState() if colony.metrics is not None else None
+    })
+    migrationConnection.close()
+
+
+class UFSACOIslands:
+    def __init__(self,
+                 numberAnts,
+                 numberFeatures,
+                 dictionaryName,
+                 dictionaryFolderHier='',
+                 engine=UFSACO,
+                 islandParameters=None,
+                 migrationInterval=10,
+                 migrationSize=10,
+                 migrationRate=0.5,
+                 checkpointFileName=fileconfig.checkpointFileName,
+                 **kwargs
+                 ):
+        """
+        Island model of UFSACO: several independent colonies search on the same dictionary, each one
+        in its own process and with its own pheromone values. Every migrationInterval cycles, each
+        colony sends its highest pheromone values to the coordinator, which sends back the average
+        values of the other colonies to be blended with the pheromone values of each colony.
+        Final ranking is obtained from the average pheromone values of all the colonies
+        :param numberAnts: Number of ants (agents) of each colony
+        :param numberFeatures: Number of features to extract
+        :param dictionaryName: Name of dictionary to load
+        :param dictionaryFolderHier: Hierarchy of dictionary object (for routing)
+        :param engine: UFSACO class used by the colonies
+        :param islandParameters: List of UFSACO parameters for each colony {parameter: value}. Parameters
+                                 not defined for a colony take the common value (None for two colonies
+                                 using common parameters)
+        :param migrationInterval: Number of cycles between pheromone exchanges (0 to disable)
+        :param migrationSize: Number of highest pheromone values sent by each colony
+        :param migrationRate: Weight of the values received from other colonies [0 to 1]
+        :param checkpointFileName: Checkpoint file name, prefixed with the island number for each colony
+        :param kwargs: UFSACO parameters common to all the colonies. History file path (if any) is
+                       suffixed with the island number for each colony
+        """
+        if islandParameters is None:
+            islandParameters = [{}, {}]
+
+        self.numberIslands = len(islandParameters)
+        self.migrationInterval = max(migrationInterval, 0)
+        self.migrationSize = max(migrationSize, 0)
+        self.migrationRate = min(max(migrationRate, 0), 1)
+
+        # Load dictionary and similarities once for all the colonies
+        self.dictionary = Dictionary(dictionaryName=dictionaryName, folderHierarchy=dictionaryFolderHier)
+        self.dictExists = self.dictionary.loadFromDisk()
+
+        # Search results (combined for all the colonies)
+        self.pheromoneValue = {}
+        self.stopCriterion = None
+        self.completedCycles = 0
+        self.islandResults = []
+        self.featureHistory = None
+
+        # Counters and timers of all the colonies (None when disabled)
+        self.metrics = kwargs.get('metrics')
+
+        # Candidate lists are used if any of the colonies uses them
+        self.candidateListSize = 0
+        self.candidateStepCounter = 0
+        self.candidateFallbackCounter = 0
+
+        # Colonies of each island
+        self.colonies = []
+
+        if self.dictExists is True:
+            # Similarity rows calculated on demand are cached separately by each island process
+            if kwargs.get('similarityCacheSize', 0) > 0 and not issubclass(engine, UFSACOVectorized):
+                self.dictionary.startSimilarityCache(cacheSize=kwargs['similarityCacheSize'])
+            else:
+                self.dictionary.loadSimilarities()
+
+            # Vectorized colonies share the same similarity matrix
+            if issubclass(engine, UFSACOVectorized):
+                kwargs['similarity'] = self.dictionary.getSimilarityMatrix(
+                    quantise=kwargs.get('quantiseSimilarities', False))
+
+            for islandNumber, islandParameter in enumerate(islandParameters):
+                colonyParameters = dict(kwargs)
+                colonyParameters.update(islandParameter)
+
+                # Each colony uses different random generators
+                if colonyParameters.get('seed') is not None:
+                    colonyParameters['seed'] = str(colonyParameters['seed']) + '-' + str(islandNumber)
+
+                # Each colony streams visited features to its own file
+                if colonyParameters.get('historyFilePath') is not None:
+                    colonyParameters['historyFilePath'] = colonyParameters['historyFilePath'] + '.island' + \
+                        str(islandNumber)
+
+                colony = engine(
+                    numberAnts=colonyParameters.pop('numberAnts', numberAnts),
+                    numberFeatures=colonyParameters.pop('numberFeatures', numberFeatures),
+                    dictionaryName=dictionaryName,
+                    dictionaryFolderHier=dictionaryFolderHier,
+                    dictionary=self.dictionary,
+                    checkpointFileName='island' + str(islandNumber) + '.' + checkpointFileName,
+                    **colonyParameters
+                )
+
+                colony.migrationInterval = self.migrationInterval
+                colony.migrationSize = self.migrationSize
+                colony.migrationRate = self.migrationRate
+
+                self.candidateListSize = max(self.candidateListSize, colony.candidateListSize)
+                self.colonies.append(colony)
+
+            # Dictionary similarities are not used by vectorized colonies
+            if issubclass(engine, UFSACOVectorized):
+                self.dictionary.freeSimilarities()
+
+    def getMigrantPheromone(self, migrationPheromone, islandNumber):
+        """
+        Get pheromone values to send to a colony: average value of each token sent by the other colonies
+        :param migrationPheromone: Pheromone values sent by each colony {island number: {token: value}}
+        :param islandNumber: Island number of the colony
+        :return: Pheromone values {token: value}
+        """
+        pheromoneSum = {}
+        pheromoneCount = {}
+
+        for otherIslandNumber in migrationPheromone:
+            if otherIslandNumber != islandNumber:
+                otherPheromone = migrationPheromone[otherIslandNumber]
+
+                for token in otherPheromone:
+                    pheromoneSum[token] = pheromoneSum.get(token, 0) + otherPheromone[token]
+                    pheromoneCount[token] = pheromoneCount.get(token, 0) + 1
+
+        migrantPheromone = {}
+        for token in pheromoneSum:
+            migrantPheromone[token] = pheromoneSum[token] / pheromoneCount[token]
+
+        return migrantPheromone
+
+    def searchSubset(self, resume=False):
+        """
+        Perform search of all the colonies in island processes. Coordinator exchanges pheromone values
+        between the colonies still searching, until every colony sends its results. If an island process
+        stops before sending its results, the rest of islands are stopped and IOError is raised
+        :param resume: Continue search of each colony from its last checkpoint (if any)
+        :return:
+        """
+        global islandColonies
+
+        if self.dictExists is True:
+            islandColonies = self.colonies
+
+            migrationConnections = []
+            islandProcesses = []
+            islandResults = {}
+
+            try:
+                for islandNumber in range(0, self.numberIslands):
+                    coordinatorConnection, islandConnection = multiprocessing.Pipe()
+                    islandProcess = multiprocessing.Process(target=runIsland,
+                                                            args=(islandNumber, islandConnection, resume))
+                    islandProcess.start()
+
+                    # Island end is only kept by the island process, so its connection is closed when it stops
+                    islandConnection.close()
+
+                    migrationConnections.append(coordinatorConnection)
+                    islandProcesses.append(islandProcess)
+
+                # Each colony sends one message per exchange: its highest pheromone values or its results
+                searchingIslands = range(0, self.numberIslands)
+                while len(searchingIslands) > 0:
+                    migrationPheromone = {}
+
+                    for islandNumber in searchingIslands:
+                        try:
+                            islandMessage = migrationConnections[islandNumber].recv()
+                        except EOFError:
+                            islandProcesses[islandNumber].join(1)
+                            raise IOError('Island ' + str(islandNumber) + ' stopped before sending its results '
+                                          '(exit code: ' + str(islandProcesses[islandNumber].exitcode) + ')')
+
+                        if islandMessage['type'] == 'done':
+                            islandResults[islandNumber] = islandMessage
+                        else:
+                            migrationPheromone[islandNumber] = islandMessage['pheromone']
+
+                    for islandNumber in migrationPheromone:
+                        migrationConnections[islandNumber].send(
+                            self.getMigrantPheromone(migrationPheromone=migrationPheromone, islandNumber=islandNumber)
+                        )
+
+                    searchingIslands = sorted(migrationPheromone)
+
+                for islandProcess in islandProcesses:
+                    islandProcess.join()
+            finally:
+                for islandProcess in islandProcesses:
+                    if islandProcess.is_alive():
+                        islandProcess.terminate()
+                        islandProcess.join()
+
+                for migrationConnection in migrationConnections:
+                    migrationConnection.close()
+
+            self.islandResults = [islandResults[islandNumber] for islandNumber in range(0, self.numberIslands)]
+            self.combineResults()
+
+    def combineResults(self):
+        """
+        Combine search results of the colonies: average pheromone values, stop criteria,
+        candidate list counters, search metrics and visited features of each cycle
+        :return:
+        """
+        self.pheromoneValue = {}
+        for islandResult in self.islandResults:
+            for token in islandResult['pheromone']:
+                self.pheromoneValue[token] = self.pheromoneValue.get(token, 0) + \
+                    islandResult['pheromone'][token] / self.numberIslands
+
+        self.stopCriterion = ', '.join([islandResult['stop_criterion'] for islandResult in self.islandResults])
+        self.completedCycles = max([islandResult['cycles'] for islandResult in self.islandResults])
+        self.candidateStepCounter = sum([islandResult['candidate_steps'] for islandResult in self.islandResults])
+        self.candidateFallbackCounter = sum(
+            [islandResult['candidate_fallbacks'] for islandResult in self.islandResults])
+
+        if self.metrics is not None:
+            for islandResult in self.islandResults:
+                self.metrics.merge(islandResult['metrics'])
+
+        # Visited features of each cycle are added for all the colonies
+        cycleCounters = {}
+        for islandResult in self.islandResults:
+            for cycleIteration, featureCounter in islandResult['history']:
+                cycleCounter = cycleCounters.setdefault(cycleIteration, {})
+                for token in featureCounter:
+                    cycleCounter[token] = cycleCounter.get(token, 0) + featureCounter[token]
+
+        self.featureHistory = FeatureHistory(tokens=self.dictionary.postings)
+        for cycleIteration in sorted(cycleCounters):
+            self.featureHistory.addCycleCounter(cycleIteration=cycleIteration,
+                                                featureCounter=cycleCounters[cycleIteration])
+
+    def getFeatureResults(self, topNumber, onlyTokens=True):
+        """
+        Return top m features after searching subset, using average pheromone values of the colonies
+        :param topNumber: Top number of features to retrieve
+        :param onlyTokens: Get only token list. If False, return also pheromone value
+        :return:
+        """
+        # Features having the same pheromone value keep postings order, as in a single colony
+        tokenPositions = dict((token, position) for position, token in enumerate(self.dictionary.postings))
+        orderedFeatures = sorted(self.pheromoneValue,
+                                 key=lambda token: (-self.pheromoneValue[token], tokenPositions[token]))
+        orderedFeatures = orderedFeatures[0:topNumber]
+
+        if onlyTokens is True:
+            return orderedFeatures
+        else:
+            featureResults = {}
+            for token in orderedFeatures:
+                featureResults[token] = self.pheromoneValue[token]
+
+            return featureResults
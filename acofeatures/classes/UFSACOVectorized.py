@@ -0,0 +1,670 @@
+import random
+import multiprocessing
+import numpy
+from UFSACO import UFSACO
+from SimilarityMatrix import createSharedArray
+
+# Engine used by worker processes. It is inherited by the workers when the pool is created,
+# pheromone and similarity arrays are placed in shared memory before that moment
+workerEngine = None
+
+
+def initWorker():
+    """
+    Initialize worker process: random generator must not share the state of the parent process
+    :return:
+    """
+    random.seed()
+
+
+def moveAntsWorker(antGroup):
+    """
+    Move a group of ants inside a worker process
+    :param antGroup: List [features: initial features, ants: ant numbers, cycle: cycle iteration]
+    :return: List [tokens: token IDs visited by the ants, counter: counter for each token ID,
+             total: total feature counter, candidate_steps: steps using candidate lists,
+             candidate_fallbacks: steps using all the features, metrics: recorded counters and timers]
+    """
+    workerEngine.resetFeatureCounter()
+    workerEngine.resetGreedyCache()
+    workerEngine.candidateStepCounter = 0
+    workerEngine.candidateFallbackCounter = 0
+
+    if workerEngine.metrics is not None:
+        workerEngine.metrics.reset()
+
+    workerEngine.cycleIteration = antGroup['cycle']
+    workerEngine.moveAntsLocal(initialFeatures=antGroup['features'], antNumbers=antGroup['ants'])
+
+    visitedTokenIds = numpy.flatnonzero(workerEngine.featureCounterArray)
+    return {
+        'tokens': visitedTokenIds,
+        'counter': workerEngine.featureCounterArray[visitedTokenIds],
+        'total': workerEngine.totalFeatureCounter,
+        'candidate_steps': workerEngine.candidateStepCounter,
+        'candidate_fallbacks': workerEngine.candidateFallbackCounter,
+        'metrics': workerEngine.metrics.getState() if workerEngine.metrics is not None else None
+    }
+
+
+class UFSACOVectorized(UFSACO):
+    def __init__(self, numberAnts, numberFeatures, dictionaryName, batchAnts=False, numberProcesses=1,
+                 similarity=None, quantiseSimilarities=False, **kwargs):
+        """
+        UFSACO algorithm using NumPy arrays. Tokens are handled as integer IDs (position in
+        dictionary postings), pheromone values are stored in a float array and similarity
+        values are read from an array-backed matrix, so each ant step is a vectorized operation
+        :param numberAnts: Number of ants (agents)
+        :param numberFeatures: Number of features to extract
+        :param dictionaryName: Name of dictionary to load
+        :param batchAnts: Move all the ants of a cycle in lock-step, one matrix operation per step
+        :param numberProcesses: Number of worker processes to move the ants of a cycle
+        :param similarity: Similarity matrix already created from the dictionary, shared between searches
+                           (None to create it from dictionary similarities)
+        :param quantiseSimilarities: Use similarity values quantised to 16 bits (a quarter of the memory
+                                     of the values, see SimilarityMatrix.getQuantisedMatrix)
+        :param kwargs: Rest of UFSACO parameters
+        """
+        # Similarity matrix needs all the similarity values, so they are not calculated on demand
+        if kwargs.pop('similarityCacheSize', 0) > 0:
+            print '[Similarities on demand not available for vectorized engine, loading similarity files]'
+
+        UFSACO.__init__(self, numberAnts=numberAnts, numberFeatures=numberFeatures,
+                        dictionaryName=dictionaryName, **kwargs)
+
+        self.batchAnts = batchAnts
+        self.numberProcesses = max(numberProcesses, 1)
+        self.workerPool = None
+
+        # Similarity matrix with the candidate list of each token
+        self.candidateSimilarity = None
+
+        # Quantised similarity values raised to beta, calculated once for each search
+        self.similarityPowers = None
+
+        if self.dictExists is True:
+            if similarity is not None:
+                # Use similarity matrix created previously (only the tokens of a restricted search)
+                if similarity.tokenCount != len(self.dictionary.postings):
+                    similarity = similarity.getSubMatrix(tokens=self.dictionary.postings)
+
+                self.similarity = similarity.getQuantisedMatrix() if quantiseSimilarities is True else similarity
+            else:
+                # Convert similarity values into array-backed matrix (memory-mapped matrix if binary files
+                # have been loaded) and free dictionary values
+                self.similarity = self.dictionary.getSimilarityMatrix(quantise=quantiseSimilarities)
+                self.dictionary.freeSimilarities()
+
+            # Pheromone value and feature counter for each token ID
+            self.pheromone = numpy.zeros(self.similarity.tokenCount, dtype=numpy.float64)
+            self.featureCounterArray = numpy.zeros(self.similarity.tokenCount, dtype=numpy.int64)
+
+    @property
+    def pheromoneValue(self):
+        """
+        Pheromone value for each token
+        :return: Dictionary {token: pheromone value}
+        """
+        return dict(zip(self.similarity.tokens, self.pheromone.tolist()))
+
+    def initPheromone(self):
+        """
+        Initialize pheromone value for all features
+        :return:
+        """
+        print '[Initializing pheromone values]'
+        self.pheromone.fill(self.initialPheromone)
+
+    def getCheckpointParameters(self):
+        """
+        Get search configuration stored in checkpoints, including quantisation of similarity values
+        :return: Search configuration {parameter: value}
+        """
+        checkpointParameters = UFSACO.getCheckpointParameters(self)
+        checkpointParameters['quantised'] = self.similarity.isQuantised()
+
+        return checkpointParameters
+
+    def getPheromoneState(self):
+        """
+        Get pheromone values to store in a checkpoint
+        :return: Pheromone state
+        """
+        return numpy.array(self.pheromone)
+
+    def setPheromoneState(self, pheromoneState):
+        """
+        Restore pheromone values from a checkpoint (array is kept, it may be in shared memory)
+        :param pheromoneState: Pheromone state obtained with getPheromoneState
+        :return:
+        """
+        self.pheromone[:] = pheromoneState
+
+    def blendPheromone(self, tokenPheromone, blendRate):
+        """
+        Blend pheromone values of a group of tokens with other values
+        :param tokenPheromone: Pheromone values to blend {token: pheromone value}
+        :param blendRate: Weight of the values to blend [0 to 1]
+        :return:
+        """
+        blendTokens = [token for token in tokenPheromone if token in self.similarity.tokenIds]
+        blendTokenIds = numpy.array([self.similarity.tokenIds[token] for token in blendTokens], dtype=numpy.int64)
+        blendValues = numpy.array([tokenPheromone[token] for token in blendTokens], dtype=numpy.float64)
+
+        self.pheromone[blendTokenIds] = (1 - blendRate) * self.pheromone[blendTokenIds] + blendRate * blendValues
+
+    def initCandidateLists(self):
+        """
+        Create candidate list for each feature: the features having the highest
+        similarity values (heuristic desirability), up to candidateListSize features
+        :return:
+        """
+        self.candidateSimilarity = None
+        self.candidateStepCounter = 0
+        self.candidateFallbackCounter = 0
+
+        if self.candidateListSize > 0:
+            print '[Creating candidate lists]'
+            self.candidateSimilarity = self.similarity.createCandidateMatrix(candidateListSize=self.candidateListSize)
+
+        self.initSimilarityPowers()
+
+    def initSimilarityPowers(self):
+        """
+        Calculate quantised similarity values raised to beta once for the search, so heuristic value
+        of each step is a single multiplication of pheromone and a value of the table (the table is
+        shared by the candidate lists). Powers of values not quantised are calculated in each step,
+        only for the similar tokens (an array of powers would use as much memory as the values)
+        :return:
+        """
+        self.similarityPowers = None
+
+        if self.similarity.isQuantised():
+            self.similarityPowers = self.similarity.getValuePowers(exponent=self.beta)
+
+    def resetFeatureCounter(self):
+        """
+        Initialize feature counter and total feature counter for a new cycle
+        :return:
+        """
+        self.featureCounterArray = numpy.zeros(self.similarity.tokenCount, dtype=numpy.int64)
+        self.totalFeatureCounter = 0
+
+    def getCycleFeatureCounter(self):
+        """
+        Get feature counter of current cycle
+        :return: Counter for each visited token {token: counter}
+        """
+        visitedTokenIds = numpy.flatnonzero(self.featureCounterArray)
+        return dict(zip([self.similarity.tokens[tokenId] for tokenId in visitedTokenIds],
+                        self.featureCounterArray[visitedTokenIds].tolist()))
+
+    def updatePheromone(self, cycleIteration):
+        """
+        Global pheromone update
+        :param cycleIteration: Iteration of pheromone update
+        :return:
+        """
+        if self.dictExists is True:
+            if self.pheromoneEpsilon > 0:
+                self.pheromoneDelta = self.getPheromoneDelta()
+
+            self.pheromone *= 1 - self.decayRate
+
+            if self.totalFeatureCounter > 0:
+                self.pheromone += self.featureCounterArray / float(self.totalFeatureCounter)
+
+            # Store feature counter for iteration
+            visitedTokenIds = numpy.flatnonzero(self.featureCounterArray)
+            self.featureHistory.addCycle(cycleIteration=cycleIteration,
+                                         tokenIds=visitedTokenIds.tolist(),
+                                         counters=self.featureCounterArray[visitedTokenIds].tolist())
+
+    def getPheromoneDelta(self):
+        """
+        Calculate the highest pheromone change that the global update of current cycle will produce
+        :return: Highest absolute pheromone change
+        """
+        pheromoneDelta = -self.decayRate * self.pheromone
+
+        if self.totalFeatureCounter > 0:
+            pheromoneDelta += self.featureCounterArray / float(self.totalFeatureCounter)
+
+        return float(numpy.abs(pheromoneDelta).max())
+
+    def getUnvisitedHeuristics(self, currentToken, visitedTokenList):
+        """
+        Calculate heuristics information for unvisited feature list
+        when ant is in a specific feature. Only similar tokens of current token
+        are evaluated, so the cost of a step depends on the number of similar tokens
+        :param currentToken: Ant position (token ID)
+        :param visitedTokenList: Boolean mask of token IDs visited by ant
+        :return: List [tokens: array of candidate token IDs, heuristics: array of heuristic values
+                 for candidates, max_token: for greedy movement, total_heuristics: sum of heuristic values]
+        """
+        similarTokens, similarityPowers = self.similarity.getRow(currentToken, exponent=self.beta,
+                                                                 valuePowers=self.similarityPowers)
+
+        # Use candidate list of current token, unless every candidate has been visited
+        if self.candidateSimilarity is not None:
+            self.candidateStepCounter += 1
+            candidateTokens, candidatePowers = self.candidateSimilarity.getRow(currentToken, exponent=self.beta,
+                                                                               valuePowers=self.similarityPowers)
+
+            if not visitedTokenList[candidateTokens].all():
+                similarTokens, similarityPowers = candidateTokens, candidatePowers
+            else:
+                self.candidateFallbackCounter += 1
+
+        # Keep only unvisited similar tokens
+        unvisitedSimilar = ~visitedTokenList[similarTokens]
+        candidateTokens = similarTokens[unvisitedSimilar]
+        similarityPowers = similarityPowers[unvisitedSimilar]
+
+        heuristics = self.pheromone[candidateTokens] * similarityPowers
+
+        # Rows of the similarity matrix and candidate lists are always in memory (no similarity misses)
+        if self.metrics is not None:
+            self.metrics.addCounter('heuristic_evaluations', len(candidateTokens))
+            self.metrics.addCounter('similarity_lookups', 2 if self.candidateSimilarity is not None else 1)
+
+        totalHeuristics = float(heuristics.sum())
+
+        argMaxToken = None
+        if totalHeuristics > 0:
+            argMaxToken = int(candidateTokens[heuristics.argmax()])
+
+        return {'tokens': candidateTokens, 'heuristics': heuristics, 'max_token': argMaxToken,
+                'total_heuristics': totalHeuristics}
+
+    def getGreedyTokens(self, currentToken):
+        """
+        Get similar token IDs having the highest heuristic values, without considering visited tokens
+        :param currentToken: Ant position (token ID)
+        :return: List of token IDs ordered by heuristic value (descending, same order as greedy movement for ties)
+        """
+        if self.candidateSimilarity is not None:
+            similarTokens, similarityPowers = self.candidateSimilarity.getRow(currentToken, exponent=self.beta,
+                                                                              valuePowers=self.similarityPowers)
+        else:
+            similarTokens, similarityPowers = self.similarity.getRow(currentToken, exponent=self.beta,
+                                                                     valuePowers=self.similarityPowers)
+
+        if self.metrics is not None:
+            self.metrics.addCounter('similarity_lookups')
+
+        heuristics = self.pheromone[similarTokens] * similarityPowers
+
+        # Stable sort keeps the first token ID for equal heuristic values, as argmax does
+        greedyPositions = numpy.argsort(-heuristics, kind='mergesort')[:self.numberFeatures + 1]
+        greedyPositions = greedyPositions[heuristics[greedyPositions] > 0]
+
+        return similarTokens[greedyPositions].tolist()
+
+    def getFirstUnvisited(self, greedyTokens, visitedTokenList):
+        """
+        Get first greedy transition not visited by the ant
+        :param greedyTokens: Greedy transitions of current token (token IDs)
+        :param visitedTokenList: Boolean mask of token IDs visited by ant
+        :return: Next token ID (None if every greedy transition has been visited)
+        """
+        for greedyToken in greedyTokens:
+            if not visitedTokenList[greedyToken]:
+                return greedyToken
+
+        return None
+
+    def probabilityTransitionRule(self, unvisitedHeuristics, totalUnvisited, candidateTokens=None,
+                                  cumulativeHeuristics=None):
+        """
+        Get next feature using probabilistic rule. Depending on probabilisticSelection value,
+        get token with highest probability or select a random token weighted by its probability
+        :param unvisitedHeuristics: Array of unvisited tokens heuristics
+        :param totalUnvisited: Total of sum of tokens heuristics
+        :param candidateTokens: Array of token IDs for the heuristic values
+        :param cumulativeHeuristics: Not used, cumulative sum is calculated from heuristic values
+        :return: Selected token ID
+        """
+        if totalUnvisited > 0:
+            if self.probabilisticSelection == 'roulette':
+                cumulativeHeuristics = numpy.cumsum(unvisitedHeuristics)
+                rouletteValue = self.antRandom.random() * cumulativeHeuristics[-1]
+                selectedPosition = numpy.searchsorted(cumulativeHeuristics, rouletteValue, side='right')
+
+                # Random value rounded up to the total: last token having heuristic value (as default engine)
+                if selectedPosition >= len(candidateTokens):
+                    selectedPosition = numpy.flatnonzero(unvisitedHeuristics)[-1]
+
+                return int(candidateTokens[selectedPosition])
+
+            # Probability is proportional to heuristic value (first token ID on equal values)
+            return int(candidateTokens[unvisitedHeuristics.argmax()])
+
+        return None
+
+    def moveAnt(self, currentFeature):
+        """
+        Move ant to next feature and modify feature counter
+        :param currentFeature: Feature where ant has been positioned
+        :return:
+        """
+        currentTokenId = self.similarity.tokenIds[currentFeature]
+
+        # Initialize visited features mask
+        visitedFeatureMask = numpy.zeros(self.similarity.tokenCount, dtype=bool)
+        visitedFeatureMask[currentTokenId] = True
+
+        for featureNumber in range(0, self.numberFeatures):
+            transitionSelection = self.antRandom.random()
+            nextTokenId = None
+
+            # Greedy movement from the greedy transitions of current token (if enabled)
+            if transitionSelection <= self.exploreExploitCoefficient and self.greedyCacheSize > 0:
+                nextTokenId = self.getCachedGreedyFeature(currentToken=currentTokenId,
+                                                          visitedTokenList=visitedFeatureMask)
+
+            if nextTokenId is None:
+                heuristicsInformation = self.getUnvisitedHeuristics(
+                    currentToken=currentTokenId,
+                    visitedTokenList=visitedFeatureMask
+                )
+
+                if transitionSelection <= self.exploreExploitCoefficient:
+                    nextTokenId = heuristicsInformation['max_token']
+                else:
+                    nextTokenId = self.probabilityTransitionRule(
+                        unvisitedHeuristics=heuristicsInformation['heuristics'],
+                        totalUnvisited=heuristicsInformation['total_heuristics'],
+                        candidateTokens=heuristicsInformation['tokens']
+                    )
+
+            # Move ant to new feature
+            if nextTokenId is not None:
+                currentTokenId = nextTokenId
+                visitedFeatureMask[nextTokenId] = True
+
+                # Update counter
+                self.featureCounterArray[nextTokenId] += 1
+                self.totalFeatureCounter += 1
+            else:
+                # Ant stops: there are no unvisited features with heuristic value
+                if self.metrics is not None:
+                    self.metrics.addCounter('dead_end_steps')
+                break
+
+    def moveAnts(self, initialFeatures, antNumbers=None):
+        """
+        Move all the ants of a cycle, distributing them between worker processes if
+        more than one process is configured
+        :param initialFeatures: List of initial features (one for each ant)
+        :param antNumbers: Number of each ant in the cycle (None for consecutive numbers)
+        :return:
+        """
+        if self.numberProcesses > 1:
+            self.moveAntsParallel(initialFeatures=initialFeatures)
+        else:
+            self.moveAntsLocal(initialFeatures=initialFeatures, antNumbers=antNumbers)
+
+    def moveAntsLocal(self, initialFeatures, antNumbers=None):
+        """
+        Move all the ants of a cycle in current process. In batch mode, ants advance in
+        lock-step and each step is computed for the whole colony at once
+        :param initialFeatures: List of initial features (one for each ant)
+        :param antNumbers: Number of each ant in the cycle (None for consecutive numbers)
+        :return:
+        """
+        if self.batchAnts is True:
+            self.moveAntsBatch(initialFeatures=initialFeatures, antNumbers=antNumbers)
+        else:
+            UFSACO.moveAnts(self, initialFeatures=initialFeatures, antNumbers=antNumbers)
+
+    def moveAntsParallel(self, initialFeatures):
+        """
+        Split the ants of a cycle between worker processes. Pheromone does not change
+        during a cycle, so ants are independent until the global pheromone update.
+        Feature counters of all the workers are merged at the end
+        :param initialFeatures: List of initial features (one for each ant)
+        :return:
+        """
+        # Workers are started on the first cycle, once pheromone and candidate lists are initialized
+        if self.workerPool is None:
+            self.startWorkerPool()
+
+        # Ant numbers are kept, so each ant uses the same random generator as in a serial run
+        antNumbers = range(0, len(initialFeatures))
+        antGroups = []
+        for groupNumber in range(0, self.numberProcesses):
+            antGroups.append({
+                'features': initialFeatures[groupNumber::self.numberProcesses],
+                'ants': antNumbers[groupNumber::self.numberProcesses],
+                'cycle': self.cycleIteration
+            })
+
+        for workerResult in self.workerPool.map(moveAntsWorker, antGroups):
+            self.featureCounterArray[workerResult['tokens']] += workerResult['counter']
+            self.totalFeatureCounter += workerResult['total']
+            self.candidateStepCounter += workerResult['candidate_steps']
+            self.candidateFallbackCounter += workerResult['candidate_fallbacks']
+
+            if workerResult['metrics'] is not None:
+                self.metrics.merge(workerResult['metrics'])
+
+    def startWorkerPool(self):
+        """
+        Move similarity and pheromone arrays into shared memory and start worker processes
+        :return:
+        """
+        global workerEngine
+
+        self.similarity.shareMemory()
+        if self.candidateSimilarity is not None:
+            self.candidateSimilarity.shareMemory()
+
+        self.pheromone = createSharedArray(self.pheromone)
+
+        workerEngine = self
+        self.workerPool = multiprocessing.Pool(processes=self.numberProcesses, initializer=initWorker)
+
+    def stopWorkerPool(self):
+        """
+        Stop worker processes
+        :return:
+        """
+        global workerEngine
+
+        if self.workerPool is not None:
+            self.workerPool.close()
+            self.workerPool.join()
+            self.workerPool = None
+
+        workerEngine = None
+
+    def iterSearch(self, resume=False, topNumber=None):
+        """
+        Perform ACO algorithm for searching subset of features, one cycle at a time. Worker
+        processes (if any) are stopped at the end of the search or when the generator is closed
+        :param resume: Continue search from last checkpoint (if any)
+        :param topNumber: Number of top features included in each snapshot (None to use stableTopNumber)
+        :return: Generator of snapshots (see UFSACO.iterSearch)
+        """
+        try:
+            for searchSnapshot in UFSACO.iterSearch(self, resume=resume, topNumber=topNumber):
+                yield searchSnapshot
+        finally:
+            self.stopWorkerPool()
+
+    def getBatchUnvisitedHeuristics(self, currentTokens, unvisitedTokens):
+        """
+        Calculate heuristics information for unvisited features of a group of ants
+        :param currentTokens: Array of ant positions (token IDs)
+        :param unvisitedTokens: Boolean matrix of unvisited token IDs (one row for each ant)
+        :return: List [heuristics: matrix of heuristic values, max_token: array of token IDs for greedy movement
+                 (-1 when there is no candidate), total_heuristics: array of sums of heuristic values]
+        """
+        # Dense rows contain similarity powers, and zero for tokens without similarity value
+        if self.candidateSimilarity is None:
+            similarityRows = self.similarity.getDenseRows(currentTokens, exponent=self.beta,
+                                                          valuePowers=self.similarityPowers)
+        else:
+            # Use candidate lists, except for ants having visited every candidate
+            similarityRows = self.candidateSimilarity.getDenseRows(currentTokens, exponent=self.beta,
+                                                                   valuePowers=self.similarityPowers)
+            fallbackAnts = ~((similarityRows > 0) & unvisitedTokens).any(axis=1)
+
+            self.candidateStepCounter += len(currentTokens)
+            self.candidateFallbackCounter += int(fallbackAnts.sum())
+
+            if fallbackAnts.any():
+                similarityRows[fallbackAnts] = self.similarity.getDenseRows(currentTokens[fallbackAnts],
+                                                                            exponent=self.beta,
+                                                                            valuePowers=self.similarityPowers)
+
+        heuristics = self.pheromone * similarityRows
+        heuristics[~unvisitedTokens] = 0
+
+        # Dense rows contain a value for every token: only unvisited similar tokens are counted. Rows
+        # of the similarity matrix and candidate lists are always in memory (no similarity misses)
+        if self.metrics is not None:
+            evaluatedTokens = int(((similarityRows != 0) & unvisitedTokens).sum())
+            self.metrics.addCounter('heuristic_evaluations', evaluatedTokens)
+
+            similarityLookups = len(currentTokens)
+            if self.candidateSimilarity is not None:
+                similarityLookups += int(fallbackAnts.sum())
+
+            self.metrics.addCounter('similarity_lookups', similarityLookups)
+
+        totalHeuristics = heuristics.sum(axis=1)
+
+        argMaxTokens = heuristics.argmax(axis=1)
+        argMaxTokens[totalHeuristics <= 0] = -1
+
+        return {'heuristics': heuristics, 'max_token': argMaxTokens, 'total_heuristics': totalHeuristics}
+
+    def batchProbabilityTransitionRule(self, unvisitedHeuristics, totalUnvisited, antRandoms):
+        """
+        Get next feature using probabilistic rule for a group of ants
+        :param unvisitedHeuristics: Matrix of unvisited tokens heuristics (one row for each ant)
+        :param totalUnvisited: Array of sums of tokens heuristics
+        :param antRandoms: Random generator of each ant
+        :return: Array of selected token IDs (-1 when there is no candidate)
+        """
+        nextTokens = numpy.full(len(totalUnvisited), -1, dtype=numpy.int64)
+
+        candidateAnts = totalUnvisited > 0
+
+        if self.probabilisticSelection == 'roulette':
+            # Roulette wheel selection: first token whose cumulative heuristic value exceeds a random value
+            cumulativeHeuristics = numpy.cumsum(unvisitedHeuristics[candidateAnts], axis=1)
+            rouletteValues = numpy.array([antRandoms[antNumber].random() for antNumber in numpy.flatnonzero(candidateAnts)]) \
+                * cumulativeHeuristics[:, -1]
+            exceedingValues = cumulativeHeuristics > rouletteValues[:, numpy.newaxis]
+            selectedTokens = exceedingValues.argmax(axis=1)
+
+            # Random value rounded up to the total: last token having heuristic value (as default engine)
+            roundedAnts = ~exceedingValues.any(axis=1)
+            if roundedAnts.any():
+                selectedTokens[roundedAnts] = unvisitedHeuristics.shape[1] - 1 - \
+                    (unvisitedHeuristics[candidateAnts][roundedAnts][:, ::-1] > 0).argmax(axis=1)
+
+            nextTokens[candidateAnts] = selectedTokens
+        else:
+            # Probability is proportional to heuristic value (first token ID on equal values)
+            nextTokens[candidateAnts] = unvisitedHeuristics[candidateAnts].argmax(axis=1)
+
+        return nextTokens
+
+    def moveAntsBatch(self, initialFeatures, antNumbers=None):
+        """
+        Move all the ants of a cycle in lock-step. Pheromone values do not change during
+        a cycle, so on each step the next feature of every active ant is calculated with a
+        single matrix operation. Feature counters are reduced once at the end of the cycle
+        :param initialFeatures: List of initial features (one for each ant)
+        :param antNumbers: Number of each ant in the cycle (None for consecutive numbers)
+        :return:
+        """
+        antCount = len(initialFeatures)
+        antRange = numpy.arange(antCount)
+
+        if antNumbers is None:
+            antNumbers = range(0, antCount)
+
+        # Random generator of each ant (same random values as moving ants one after another)
+        antRandoms = [self.getAntRandom(antNumber) for antNumber in antNumbers]
+
+        # Current position of each ant
+        antTokens = numpy.array([self.similarity.tokenIds[feature] for feature in initialFeatures], dtype=numpy.int64)
+
+        # Unvisited features mask for each ant
+        unvisitedFeatureMask = numpy.ones((antCount, self.similarity.tokenCount), dtype=bool)
+        unvisitedFeatureMask[antRange, antTokens] = False
+
+        # Ants still moving (an ant stops when there are no candidate features)
+        activeAnts = numpy.ones(antCount, dtype=bool)
+
+        # Token IDs selected on each step
+        selectedTokens = []
+
+        for featureNumber in range(0, self.numberFeatures):
+            activeAntIds = numpy.flatnonzero(activeAnts)
+
+            if len(activeAntIds) == 0:
+                break
+
+            heuristicsInformation = self.getBatchUnvisitedHeuristics(
+                currentTokens=antTokens[activeAntIds],
+                unvisitedTokens=unvisitedFeatureMask[activeAntIds]
+            )
+
+            # Random assignment to choose transition rule for each ant
+            transitionSelection = numpy.array([antRandoms[antId].random() for antId in activeAntIds])
+
+            # Exploiting ants take the highest heuristic, the rest use the probabilistic rule
+            nextTokens = heuristicsInformation['max_token'].copy()
+            exploringAnts = numpy.flatnonzero(transitionSelection > self.exploreExploitCoefficient)
+
+            if len(exploringAnts) > 0:
+                nextTokens[exploringAnts] = self.batchProbabilityTransitionRule(
+                    unvisitedHeuristics=heuristicsInformation['heuristics'][exploringAnts],
+                    totalUnvisited=heuristicsInformation['total_heuristics'][exploringAnts],
+                    antRandoms=[antRandoms[antId] for antId in activeAntIds[exploringAnts]]
+                )
+
+            # Move ants having a next feature, stop the rest
+            movedAnts = nextTokens >= 0
+
+            if self.metrics is not None:
+                self.metrics.addCounter('dead_end_steps', int((~movedAnts).sum()))
+            movedAntIds = activeAntIds[movedAnts]
+            antTokens[movedAntIds] = nextTokens[movedAnts]
+            unvisitedFeatureMask[movedAntIds, nextTokens[movedAnts]] = False
+            activeAnts[activeAntIds[~movedAnts]] = False
+
+            selectedTokens.append(nextTokens[movedAnts])
+
+        # Reduce feature counters of all the ants
+        if len(selectedTokens) > 0:
+            selectedTokens = numpy.concatenate(selectedTokens)
+            self.featureCounterArray += numpy.bincount(selectedTokens, minlength=self.similarity.tokenCount)
+            self.totalFeatureCounter += len(selectedTokens)
+
+    def getFeatureResults(self, topNumber, onlyTokens=True):
+        """
+        Return top m features after searching subset
+        :param topNumber: Top number of features to retrieve
+        :param onlyTokens: Get only token list. If False, return also pheromone value
+        :return:
+        """
+        # Sort token IDs based on pheromone value. Sort is stable, so equal values keep postings order
+        # (also for the last selected values)
+        orderedTokenIds = numpy.argsort(-self.pheromone, kind='mergesort')[0:topNumber]
+        orderedFeatures = [self.similarity.tokens[tokenId] for tokenId in orderedTokenIds]
+
+        if onlyTokens is True:
+            return orderedFeatures
+        else:
+            featureResults = {}
+            for tokenId in orderedTokenIds:
+                featureResults[self.similarity.tokens[tokenId]] = float(self.pheromone[tokenId])
+
+            return featureResults
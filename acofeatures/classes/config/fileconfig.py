@@ -14,3 +14,9 @@ documentsFileName = 'index.documents.json'
 postingsFileName = 'index.postings.json'
 preprocessedDocsFileName = 'index.preprocessed.docs.json'
 similarityFileName = 'index.similarities.json'
+similarityShardIndexFileName = 'index.similarities.shards.json'
+similarityShardFilePrefix = 'index.similarities.shard'
+similarityStoreFilePrefix = 'index.similarities.store.'
+
+# UFSACO search checkpoint
+checkpointFileName = 'ufsaco.checkpoint.bin'
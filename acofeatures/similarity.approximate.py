@@ -0,0 +1,253 @@
+import sys
+import json
+import random
+import argparse
+import numpy
+
+from classes.Dictionary import Dictionary
+from classes.UFSACO import UFSACO
+
+
+def getSampleDictionary(dictionary, sampleTokenIds, pairFrom, pairTo, cosineSims):
+    """
+    Create a dictionary containing only the sample tokens and the similarities of a list of pairs
+    :param dictionary: Dictionary
+    :param sampleTokenIds: Token IDs of the sample
+    :param pairFrom: Array of token IDs
+    :param pairTo: Array of token IDs
+    :param cosineSims: Array of cosine similarities of each pair
+    :return: Dictionary
+    """
+    sampleDictionary = dictionary.getRestrictedDictionary(tokens=[dictionary.postings[tokenId]
+                                                                  for tokenId in sampleTokenIds])
+
+    similarityRows = {}
+    for tokenFromId, tokenToId, cosineSim in zip(pairFrom.tolist(), pairTo.tolist(), cosineSims.tolist()):
+        if cosineSim > 0:
+            similarityRows.setdefault(dictionary.postings[tokenFromId], {})[
+                dictionary.postings[tokenToId]] = round(float(1) / cosineSim, 4)
+
+    sampleDictionary.similarityPairs = {}
+    sampleDictionary.addSimilarityRows(similarityRows)
+    sampleDictionary.createSimilarityNeighbours()
+    return sampleDictionary
+
+
+def getNeighbourRecall(sampleTokenIds, exactPairs, approximatePairs, neighbourNumber):
+    """
+    Calculate recall of the nearest neighbours of each sample token
+    :param sampleTokenIds: Token IDs of the sample
+    :param exactPairs: Similar pairs of the exact calculation {(token ID, token ID): cosine similarity}
+    :param approximatePairs: Set of pairs found by the approximate calculation
+    :param neighbourNumber: Number of nearest neighbours of each token
+    :return: Recall of nearest neighbours
+    """
+    tokenNeighbours = {}
+    for tokenFromId, tokenToId in exactPairs:
+        tokenNeighbours.setdefault(tokenFromId, []).append((exactPairs[(tokenFromId, tokenToId)], tokenToId))
+        tokenNeighbours.setdefault(tokenToId, []).append((exactPairs[(tokenFromId, tokenToId)], tokenFromId))
+
+    foundNeighbours = 0
+    totalNeighbours = 0
+    for tokenId in sampleTokenIds:
+        nearestNeighbours = sorted(tokenNeighbours.get(tokenId, []), key=lambda neighbour: (-neighbour[0],
+                                                                                            neighbour[1]))
+        for cosineSim, neighbourId in nearestNeighbours[0:neighbourNumber]:
+            totalNeighbours += 1
+            if (min(tokenId, neighbourId), max(tokenId, neighbourId)) in approximatePairs:
+                foundNeighbours += 1
+
+    return float(foundNeighbours) / totalNeighbours if totalNeighbours > 0 else 1.0
+
+
+def main(dictionaryName, numberHashes, bandSize, maxBucketSize, seed, sampleSize, neighbourNumber,
+         numberAnts, numberFeatures, numberCycles, reportFilePath, buildSimilarities):
+    """
+    Calculate approximate similarities of a dictionary (MinHash and LSH) and report their accuracy.
+    Accuracy is measured on a random sample of tokens, comparing the approximate pairs with the exact
+    similarities between the sample tokens:
+    * pair_recall: proportion of similar pairs found by the approximate calculation
+    * neighbour_recall: proportion of the nearest neighbours of each token found
+    * top_feature_overlap: proportion of the top features found by UFSACO on the sample tokens
+      that are the same with exact and approximate similarities
+    :return:
+    """
+    dictionary = Dictionary(dictionaryName=dictionaryName, folderHierarchy='')
+    if dictionary.loadFromDisk() is False:
+        print 'Dictionary ' + dictionaryName + ' does not exist. Execution aborted.'
+        return 1
+
+    if buildSimilarities is True:
+        candidatePairs = dictionary.calculateApproximateSimilarities(numberHashes=numberHashes, bandSize=bandSize,
+                                                                     maxBucketSize=maxBucketSize, seed=seed)
+    else:
+        termDocument = dictionary.getTermDocumentMatrix()
+        candidatePairs = dictionary.getCandidatePairs(
+            signatures=dictionary.getMinHashSignatures(termDocument=termDocument, numberHashes=numberHashes,
+                                                       seed=seed),
+            bandSize=bandSize, maxBucketSize=maxBucketSize)
+
+    print '[Measuring accuracy on a sample of ' + str(min(sampleSize, len(dictionary.postings))) + ' tokens]'
+    termDocument = dictionary.getTermDocumentMatrix()
+    sampleTokenIds = sorted(random.Random(seed).sample(range(0, len(dictionary.postings)),
+                                                       min(sampleSize, len(dictionary.postings))))
+
+    # Exact similarities between all the pairs of sample tokens
+    sampleRows, sampleColumns = numpy.triu_indices(len(sampleTokenIds))
+    exactFrom = numpy.array(sampleTokenIds, dtype=numpy.int64)[sampleRows]
+    exactTo = numpy.array(sampleTokenIds, dtype=numpy.int64)[sampleColumns]
+    exactSims = dictionary.calculatePairSimilarities(termDocument=termDocument, pairFrom=exactFrom, pairTo=exactTo)
+
+    # Approximate pairs between sample tokens
+    isSampleToken = numpy.zeros(len(dictionary.postings), dtype=bool)
+    isSampleToken[sampleTokenIds] = True
+    approximateMask = isSampleToken[candidatePairs['from']] & isSampleToken[candidatePairs['to']]
+    approximateFrom = candidatePairs['from'][approximateMask]
+    approximateTo = candidatePairs['to'][approximateMask]
+    approximateSims = dictionary.calculatePairSimilarities(termDocument=termDocument, pairFrom=approximateFrom,
+                                                           pairTo=approximateTo)
+
+    # Pairs of different tokens with similarity different from zero
+    exactPairs = {}
+    for tokenFromId, tokenToId, cosineSim in zip(exactFrom.tolist(), exactTo.tolist(), exactSims.tolist()):
+        if cosineSim > 0 and tokenFromId != tokenToId:
+            exactPairs[(tokenFromId, tokenToId)] = cosineSim
+
+    approximatePairs = set(zip(approximateFrom.tolist(), approximateTo.tolist()))
+    foundPairs = len([pair for pair in exactPairs if pair in approximatePairs])
+
+    # Top features of UFSACO with exact and approximate similarities of the sample tokens
+    topFeatures = {}
+    for similarityType, pairFrom, pairTo, cosineSims in [('exact', exactFrom, exactTo, exactSims),
+                                                         ('approximate', approximateFrom, approximateTo,
+                                                          approximateSims)]:
+        aco = UFSACO(numberAnts=numberAnts, numberFeatures=numberFeatures, dictionaryName=dictionaryName,
+                     numberCycles=numberCycles, seed=seed,
+                     dictionary=getSampleDictionary(dictionary=dictionary, sampleTokenIds=sampleTokenIds,
+                                                    pairFrom=pairFrom, pairTo=pairTo, cosineSims=cosineSims))
+        aco.searchSubset()
+        topFeatures[similarityType] = aco.getFeatureResults(topNumber=numberFeatures)
+
+    accuracyReport = {
+        'tokens': len(dictionary.postings),
+        'candidate_pairs': len(candidatePairs['from']),
+        'all_pairs': len(dictionary.postings) * (len(dictionary.postings) + 1) / 2,
+        'sample_tokens': len(sampleTokenIds),
+        'sample_similar_pairs': len(exactPairs),
+        'pair_recall': float(foundPairs) / len(exactPairs) if len(exactPairs) > 0 else 1.0,
+        'neighbour_recall': getNeighbourRecall(sampleTokenIds=sampleTokenIds, exactPairs=exactPairs,
+                                               approximatePairs=approximatePairs, neighbourNumber=neighbourNumber),
+        'nearest_neighbours': neighbourNumber,
+        'top_feature_overlap': float(len(set(topFeatures['exact']).intersection(topFeatures['approximate']))) /
+                               max(len(topFeatures['exact']), 1),
+        'top_features': topFeatures
+    }
+
+    outputStr = '[Candidate pairs: ' + str(accuracyReport['candidate_pairs']) + ' of ' + \
+                str(accuracyReport['all_pairs']) + ']\n'
+    outputStr += '[Pair recall: ' + str(round(accuracyReport['pair_recall'], 4)) + ' (' + str(foundPairs) + \
+                 ' of ' + str(len(exactPairs)) + ' similar pairs of the sample)]\n'
+    outputStr += '[Nearest neighbour recall: ' + str(round(accuracyReport['neighbour_recall'], 4)) + \
+                 ' (' + str(neighbourNumber) + ' neighbours)]\n'
+    outputStr += '[UFSACO top feature overlap: ' + str(round(accuracyReport['top_feature_overlap'], 4)) + \
+                 ' (' + str(numberFeatures) + ' features)]\n'
+    print outputStr
+
+    if reportFilePath is not None:
+        with open(reportFilePath, 'w') as reportFile:
+            reportFile.write(json.dumps(accuracyReport, indent=2, sort_keys=True))
+            reportFile.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Calculate approximate similarities of a dictionary with MinHash and LSH, and report their accuracy against exact similarities on a sample of tokens.")
+
+    # Dictionary argument definition
+    parser.add_argument("-d",
+                        metavar='DICTIONARY_NAME',
+                        type=str,
+                        default='training',
+                        help="Dictionary name (default: training).")
+
+    # Number of hash functions argument definition
+    parser.add_argument("--hashes",
+                        metavar='NUMBER_HASHES',
+                        type=int,
+                        default=64,
+                        help="Number of MinHash functions (default: 64).")
+
+    # Band size argument definition
+    parser.add_argument("--band",
+                        metavar='BAND_SIZE',
+                        type=int,
+                        default=4,
+                        help="Number of hash values of each LSH band. Lower values find more pairs (default: 4).")
+
+    # Bucket size argument definition
+    parser.add_argument("--bucket",
+                        metavar='MAX_BUCKET_SIZE',
+                        type=int,
+                        default=1000,
+                        help="Maximum number of tokens with the same band values to generate pairs (default: 1000).")
+
+    # Seed argument definition
+    parser.add_argument("--seed",
+                        metavar='SEED',
+                        type=int,
+                        default=0,
+                        help="Seed for hash functions, token sample and UFSACO searches (default: 0).")
+
+    # Sample size argument definition
+    parser.add_argument("--sample",
+                        metavar='SAMPLE_SIZE',
+                        type=int,
+                        default=1000,
+                        help="Number of tokens of the sample used to measure accuracy (default: 1000).")
+
+    # Nearest neighbours argument definition
+    parser.add_argument("--neighbours",
+                        metavar='NEIGHBOUR_NUMBER',
+                        type=int,
+                        default=10,
+                        help="Number of nearest neighbours of each token for neighbour recall (default: 10).")
+
+    # UFSACO arguments definition
+    parser.add_argument("--ants",
+                        metavar='NUMBER_ANTS',
+                        type=int,
+                        default=50,
+                        help="Number of ants of UFSACO searches on the sample (default: 50).")
+
+    parser.add_argument("--features",
+                        metavar='NUMBER_FEATURES',
+                        type=int,
+                        default=20,
+                        help="Number of features of UFSACO searches on the sample (default: 20).")
+
+    parser.add_argument("--cycles",
+                        metavar='NUMBER_CYCLES',
+                        type=int,
+                        default=20,
+                        help="Number of cycles of UFSACO searches on the sample (default: 20).")
+
+    # Report file argument definition
+    parser.add_argument("-o",
+                        metavar='REPORT_FILE_PATH',
+                        type=str,
+                        default=None,
+                        help="File to store the accuracy report in JSON format.")
+
+    # Report only argument definition
+    parser.add_argument("--reportonly",
+                        action='store_true',
+                        help="Only report accuracy, similarity files of the dictionary are not modified.")
+
+    args = parser.parse_args()
+
+    sys.exit(main(dictionaryName=args.d, numberHashes=args.hashes, bandSize=args.band, maxBucketSize=args.bucket,
+                  seed=args.seed, sampleSize=args.sample, neighbourNumber=args.neighbours, numberAnts=args.ants,
+                  numberFeatures=args.features, numberCycles=args.cycles, reportFilePath=args.o,
+                  buildSimilarities=not args.reportonly))
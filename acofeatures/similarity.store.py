@@ -0,0 +1,52 @@
+import sys
+import argparse
+
+from classes.Dictionary import Dictionary
+
+
+def main(dictionaryName, quantise):
+    """
+    Convert similarity values of a dictionary (index.similarities.json or shard files) into binary
+    files: token list and CSR arrays of the similarity matrix. When binary files exist, they are
+    memory-mapped by Dictionary.loadSimilarities instead of reading JSON files, so similarities are
+    available almost immediately and processes using the same dictionary share them in the page cache.
+    Binary files are removed when similarities are calculated again.
+    :param dictionaryName: Dictionary name
+    :param quantise: Store similarity values quantised to 16 bits (existing binary files are converted)
+    :return:
+    """
+    dictionary = Dictionary(dictionaryName=dictionaryName, folderHierarchy='')
+    if dictionary.loadFromDisk() is False:
+        print 'Dictionary ' + dictionaryName + ' does not exist. Execution aborted.'
+        return 1
+
+    dictionary.loadSimilarities()
+    if dictionary.similarityStore is not None and (quantise is False or dictionary.similarityStore.isQuantised()):
+        print '[Binary similarity files already exist for dictionary: ' + dictionaryName + ']'
+        return 0
+
+    print '[Storing binary similarity files for dictionary: ' + dictionaryName + ']'
+    dictionary.saveSimilarityStore(quantise=quantise)
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Convert similarity values of a dictionary into memory-mapped binary files.")
+
+    # Dictionary argument definition
+    parser.add_argument("-d",
+                        metavar='DICTIONARY_NAME',
+                        type=str,
+                        default='training',
+                        help="Dictionary name (default: training).")
+
+    # Quantisation argument definition
+    parser.add_argument("--float16",
+                        action='store_true',
+                        help="Store similarity values quantised to 16 bits (relative error up to 0.049%%).")
+
+    args = parser.parse_args()
+
+    sys.exit(main(dictionaryName=args.d, quantise=args.float16))
@@ -6,13 +6,130 @@ import argparse
 import weka.core.jvm as jvm
 
 from classes.config import dirconfig
+from classes.config import fileconfig
 from classes.Dictionary import Dictionary
-from classes.UFSACO import UFSACO
+from classes.UFSACOIslands import UFSACOIslands
+from classes.UFSACOEngines import ufsacoEngines
+from classes.UFSACOEngines import ufsacoEngineOptions
+from classes.SearchMetrics import SearchMetrics
 from classes.ClassifierDecisionTreeJ48 import ClassifierDecisionTreeJ48
 from classes.ClassifierNaiveBayes import ClassifierNaiveBayes
 
+# Optional configuration for island model (several colonies exchanging pheromone values)
+ufsacoIslandOptions = ['migrationInterval', 'migrationSize', 'migrationRate']
 
-def main(configFileName, outputFilePath):
+
+def getEngineConfiguration(configuration):
+    """
+    Get UFSACO engine and its parameters from a configuration
+    :param configuration: Configuration values {option: value}
+    :return: List [engine name, engine parameters {parameter: value}] (None if configuration is not valid)
+    """
+    # List of mandatory configuration
+    configOptions = ['numberAnts', 'numberFeatures', 'topFeatures']
+
+    # List of optional configuration
+    configExtraOptions = ['numberCycles', 'decayRate', 'beta', 'initialPheromone', 'exploreExploitCoeff',
+                          'candidateListSize', 'probabilisticSelection', 'historyFilePath', 'stableCycles',
+                          'stableTopNumber', 'pheromoneEpsilon', 'maxSearchTime', 'checkpointInterval', 'seed',
+                          'greedyCacheSize', 'minDocumentFrequency', 'maxDocumentFrequency', 'stopwordsFilePath',
+                          'tokenPattern', 'vocabularySize', 'vocabularyMethod', 'similarityCacheSize']
+
+    # Verify required values from configuration are correct
+    for optionValue in configOptions:
+        if optionValue not in configuration:
+            print 'Value for ' + optionValue + ' is missing in configuration. Execution aborted.'
+            return None
+
+    engineParameters = {
+        'numberAnts': configuration['numberAnts'],
+        'numberFeatures': configuration['numberFeatures']
+    }
+
+    # Add extra configuration (missing values take the UFSACO default value)
+    for extraOption in configExtraOptions:
+        if extraOption in configuration:
+            engineParameters[extraOption] = configuration[extraOption]
+
+    # Get UFSACO engine to use
+    engineName = configuration['engine'] if 'engine' in configuration else 'default'
+    if engineName not in ufsacoEngines:
+        print 'Engine ' + engineName + ' is not available. Execution aborted.'
+        return None
+
+    # Add configuration for the selected engine
+    for engineOption in ufsacoEngineOptions[engineName]:
+        if engineOption in configuration:
+            engineParameters[engineOption] = configuration[engineOption]
+
+    # Ranking stability is verified on the features used in classification, unless defined otherwise
+    if 'stableTopNumber' not in engineParameters:
+        engineParameters['stableTopNumber'] = configuration['topFeatures']
+
+    return engineName, engineParameters
+
+
+def classifyFeatures(arffPrefix, trainingDict, testDictionary, featureList):
+    """
+    Evaluate feature selections using Decision tree (J48) and Naive Bayes classifiers.
+    JVM must be started before calling this function
+    :param arffPrefix: Prefix for ARFF file names
+    :param trainingDict: Training dictionary
+    :param testDictionary: Test dictionary
+    :param featureList: Selected features for each feature type {feature type: [tokens]}
+    :return: Classification results for each feature type {feature type: {classifier: results}}
+    """
+    # Store classification results
+    classificationResult = {}
+
+    for featureType in featureList:
+        # Store classification results for each feature type on each classification model
+        classificationResult[featureType] = {}
+
+        # Create ARFF file for training
+        trainingArffFileName = arffPrefix + '-' + trainingDict.dictionaryName + '-' + featureType
+        trainingDict.createArffFile(arffFileName=trainingArffFileName, tokenList=featureList[featureType])
+
+        # Create ARFF file for testing
+        testArffFileName = arffPrefix + '-' + testDictionary.dictionaryName + '-' + featureType
+        testDictionary.createArffFile(arffFileName=testArffFileName, tokenList=featureList[featureType])
+
+        # After creating ARFF files, test using classification
+        # Create Decision Tree classifier instance
+        j48classifier = ClassifierDecisionTreeJ48(arffFileName=trainingArffFileName)
+
+        # Generate unpruned tree
+        j48classifier.setUnprunedTree(True)
+
+        # Create Naive Bayes classifier instance
+        nbClassifier = ClassifierNaiveBayes(arffFileName=trainingArffFileName)
+
+        # Build J48 classifier
+        j48ClassifierBuilt = j48classifier.build()
+
+        # Evaluate J48 classifier using test data
+        if j48ClassifierBuilt is True:
+            j48EvaluationSuccess = j48classifier.testDataEvaluate(testDataArffFileName=testArffFileName)
+
+            # Show evaluation results
+            if j48EvaluationSuccess is True:
+                classificationResult[featureType]['j48'] = j48classifier.evaluationResults
+
+                # Build Naive Bayes classifier
+        nbClassifierBuilt = nbClassifier.build()
+
+        # Evaluate Naive Bayes classifier using test data
+        if nbClassifierBuilt is True:
+            nbEvaluationSuccess = nbClassifier.testDataEvaluate(testDataArffFileName=testArffFileName)
+
+            # Show evaluation results
+            if nbEvaluationSuccess is True:
+                classificationResult[featureType]['naive_bayes'] = nbClassifier.evaluationResults
+
+    return classificationResult
+
+
+def main(configFileName, outputFilePath, resume=False):
     """
     UFSACO algorithm execution.
     In order to perform the feature selection, a configuration file must be provided:
@@ -20,6 +137,8 @@ def main(configFileName, outputFilePath):
                     must be configured inside /acofeatures/classes/config/dirconfig.py file
 
     -o <file_path>: file to store results for evaluation. If not defined, show results on screen.
+
+    --resume: continue UFSACO search from the last checkpoint of the configuration file (if any).
     :return:
     """
     """
@@ -32,25 +151,12 @@ def main(configFileName, outputFilePath):
             configuration = json.loads(configFile.read())
             configFile.close()
 
-        # List of mandatory configuration
-        configOptions = ['numberAnts', 'numberFeatures', 'topFeatures']
+        # Get UFSACO engine and its parameters, terminate process if configuration is not valid
+        engineConfiguration = getEngineConfiguration(configuration=configuration)
+        if engineConfiguration is None:
+            exit()
 
-        # List of optional configuration
-        configExtraOptions = ['numberCycles', 'decayRate', 'beta', 'initialPheromone', 'exploreExploitCoeff']
-
-        # Verify required values from configuration are correct, otherwise terminate process.
-        for optionValue in configOptions:
-            if optionValue not in configuration:
-                print 'Value for ' + optionValue + ' is missing in configuration. Execution aborted.'
-                exit()
-
-        # Add extra configuration
-        optionalConfig = {}
-        for extraOption in configExtraOptions:
-            if extraOption in configuration:
-                optionalConfig[extraOption] = configuration[extraOption]
-            else:
-                optionalConfig[extraOption] = None
+        engineName, engineParameters = engineConfiguration
 
         # Get top feature number to use in classification process for UFSACO, Information Gain and Gain Ratio
         topFeatures = configuration['topFeatures']
@@ -59,28 +165,45 @@ def main(configFileName, outputFilePath):
         TASK 2: Perform UFSACO algorithm and evaluate results using two different
         classification models using Weka
         """
-        # Initialize UFSACO algorithm
-        aco = UFSACO(
-            numberAnts=configuration['numberAnts'],
-            numberFeatures=configuration['numberFeatures'],
+        # Record counters and timers of the search, if a file to store them is defined
+        metrics = None
+        if 'metricsFilePath' in configuration:
+            metrics = SearchMetrics()
+            engineParameters['metrics'] = metrics
+
+        # Initialize UFSACO algorithm. With island model, each colony uses the selected engine
+        ufsacoClass = ufsacoEngines[engineName]
+        if 'islands' in configuration:
+            engineParameters['engine'] = ufsacoClass
+            engineParameters['islandParameters'] = configuration['islands']
+
+            for islandOption in ufsacoIslandOptions:
+                if islandOption in configuration:
+                    engineParameters[islandOption] = configuration[islandOption]
+
+            ufsacoClass = UFSACOIslands
+
+        aco = ufsacoClass(
             dictionaryName='training',
             dictionaryFolderHier='',
-            numberCycles=optionalConfig['numberCycles'],
-            decayRate=optionalConfig['decayRate'],
-            beta=optionalConfig['beta'],
-            initialPheromone=optionalConfig['initialPheromone'],
-            exploreExploitCoeff=optionalConfig['exploreExploitCoeff']
+            checkpointFileName=configFileName + '.' + fileconfig.checkpointFileName,
+            **engineParameters
         )
 
         # Start time previous to search
         searchStartTime = time.time()
 
         # Perform feature selection using UFSACO
-        aco.searchSubset()
+        aco.searchSubset(resume=resume)
 
         # Ending time of searching
         executionTime = round(time.time() - searchStartTime, 4)
 
+        # Store search metrics
+        if metrics is not None:
+            metrics.saveToFile(metricsFilePath=configuration['metricsFilePath'],
+                               metricsFormat=configuration.get('metricsFormat', 'json'))
+
         """
         Evaluation: performance of the following classifiers:
         * Decision trees using J48 algorithm
@@ -115,55 +238,12 @@ def main(configFileName, outputFilePath):
         testDictionary.loadFromDisk()
 
         try:
-            # Store classification results
-            classificationResult = {}
-
             # Start JVM. Configure JAVA maximum memory heap as desired
             jvm.start(max_heap_size='2g')
 
-            for featureType in featureList:
-                # Store classification results for each feature type on each classification model
-                classificationResult[featureType] = {}
-
-                # Create ARFF file for training
-                trainingArffFileName = configFileName + '-' + trainingDict.dictionaryName + '-' + featureType
-                trainingDict.createArffFile(arffFileName=trainingArffFileName, tokenList=featureList[featureType])
-
-                # Create ARFF file for testing
-                testArffFileName = configFileName + '-' + testDictionary.dictionaryName + '-' + featureType
-                testDictionary.createArffFile(arffFileName=testArffFileName, tokenList=featureList[featureType])
-
-                # After creating ARFF files, test using classification
-                # Create Decision Tree classifier instance
-                j48classifier = ClassifierDecisionTreeJ48(arffFileName=trainingArffFileName)
-
-                # Generate unpruned tree
-                j48classifier.setUnprunedTree(True)
-
-                # Create Naive Bayes classifier instance
-                nbClassifier = ClassifierNaiveBayes(arffFileName=trainingArffFileName)
-
-                # Build J48 classifier
-                j48ClassifierBuilt = j48classifier.build()
-
-                # Evaluate J48 classifier using test data
-                if j48ClassifierBuilt is True:
-                    j48EvaluationSuccess = j48classifier.testDataEvaluate(testDataArffFileName=testArffFileName)
-
-                    # Show evaluation results
-                    if j48EvaluationSuccess is True:
-                        classificationResult[featureType]['j48'] = j48classifier.evaluationResults
-
-                        # Build Naive Bayes classifier
-                nbClassifierBuilt = nbClassifier.build()
-
-                # Evaluate Naive Bayes classifier using test data
-                if nbClassifierBuilt is True:
-                    nbEvaluationSuccess = nbClassifier.testDataEvaluate(testDataArffFileName=testArffFileName)
-
-                    # Show evaluation results
-                    if nbEvaluationSuccess is True:
-                        classificationResult[featureType]['naive_bayes'] = nbClassifier.evaluationResults
+            # Evaluate each feature selection
+            classificationResult = classifyFeatures(arffPrefix=configFileName, trainingDict=trainingDict,
+                                                    testDictionary=testDictionary, featureList=featureList)
         finally:
             if jvm.started is True:
                 jvm.stop()  # Stop JVM
@@ -184,11 +264,18 @@ def main(configFileName, outputFilePath):
             'naive_bayes': 'Naive Bayes'
         }
 
-        outputInFile = False
-        if outputFilePath is not None:
-            outputInFile = True
+        outputStr = '[UFSACO execution time: ' + str(executionTime) + ' seconds]\n'
+
+        # Display stop criterion of the search and number of cycles
+        outputStr += '[UFSACO stop criterion: ' + aco.stopCriterion + ' after ' + str(aco.completedCycles) + \
+                     ' cycles]\n'
 
-        outputStr = '[UFSACO execution time: ' + str(executionTime) + ' seconds]\n\n'
+        # Display how many ant steps could not use the candidate lists
+        if aco.candidateListSize > 0:
+            outputStr += '[UFSACO candidate lists: ' + str(aco.candidateFallbackCounter) + ' fallbacks in ' + \
+                         str(aco.candidateStepCounter) + ' steps]\n'
+
+        outputStr += '\n'
         for featureType in classificationResult:
             outputStr += '-------------------' + ('-' * len(typeText[featureType])) + '\n'
             outputStr += 'Feature selection: ' + typeText[featureType] + '\n'
@@ -213,14 +300,22 @@ def main(configFileName, outputFilePath):
                 outputStr += '* Mean absolute error: ' + str(
                     round(featureTypeResults[resultItem]['mean_absolute_error'], 4)) + '\n\n'
 
-        # Display visited features on each iteration of UFSACO
-        outputStr += '--------------------------------------\n'
-        outputStr += 'UFSACO: visited features on iterations\n'
-        outputStr += '--------------------------------------\n'
+        # Verify if output is in screen or file. Try to open output file, otherwise show in screen
+        outputFile = sys.stdout
+        if outputFilePath is not None:
+            try:
+                outputFile = open(outputFilePath, 'w')
+            except IOError:
+                outputFile = sys.stdout
+
+        outputFile.write(outputStr)
 
-        for iteration in aco.featureCounterIteration:
-            featureCounter = aco.featureCounterIteration[iteration]
+        # Display visited features on each iteration of UFSACO, writing one iteration at a time
+        outputFile.write('--------------------------------------\n')
+        outputFile.write('UFSACO: visited features on iterations\n')
+        outputFile.write('--------------------------------------\n')
 
+        for iteration, featureCounter in aco.featureHistory.iterCycles():
             # Sort feature counter (descendant order by counter value)
             sortedFeatureCounter = sorted(featureCounter, key=featureCounter.__getitem__, reverse=True)
 
@@ -230,19 +325,10 @@ def main(configFileName, outputFilePath):
                 enumeratedFeatures.append(
                     '[#' + str(num) + '] ' + feature + ' (' + str(featureCounter[feature]) + ')'
                 )
-            outputStr += 'Iteration ' + str(iteration + 1) + ': ' + ' '.join(enumeratedFeatures) + '\n\n'
+            outputFile.write('Iteration ' + str(iteration + 1) + ': ' + ' '.join(enumeratedFeatures) + '\n\n')
 
-        # Verify if output is in screen or file
-        if outputInFile is False:
-            print outputStr
-        else:
-            # Try to open output file, otherwise show in screen
-            try:
-                with open(outputFilePath, 'w') as outputFile:
-                    outputFile.write(outputStr)
-                    outputFile.close()
-            except:
-                print outputStr
+        if outputFile is not sys.stdout:
+            outputFile.close()
 
 
 if __name__ == '__main__':
@@ -262,5 +348,10 @@ if __name__ == '__main__':
                         default=None,
                         help="File name to save results.")
 
+    # Resume search argument definition
+    parser.add_argument("--resume",
+                        action='store_true',
+                        help="Continue UFSACO search from the last checkpoint stored for the configuration file.")
+
     args = parser.parse_args()
-    sys.exit(main(configFileName=args.f, outputFilePath=args.o))
+    sys.exit(main(configFileName=args.f, outputFilePath=args.o, resume=args.resume))
@@ -0,0 +1,442 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import multiprocessing
+import weka.core.jvm as jvm
+
+from classes.config import dirconfig
+from classes.config import fileconfig
+from classes.Dictionary import Dictionary
+from classes.UFSACOVectorized import UFSACOVectorized
+from classes.UFSACOCluster import UFSACOCoordinator
+from classes.UFSACOCluster import isLoopbackHost
+from classes.UFSACOCluster import createAuthKey
+from classes.UFSACOEngines import ufsacoEngines
+from ufsaco import getEngineConfiguration
+from ufsaco import classifyFeatures
+
+# Data shared by all the sweep points. It is loaded once before the worker pool is created,
+# so worker processes inherit it without reading dictionary files again
+sweepDictionary = None
+sweepSimilarity = None
+sweepPoints = []
+
+# Classification results displayed in results table [classifier, metric]
+classificationColumns = [['j48', 'percent_correct'], ['j48', 'mean_absolute_error'],
+                         ['naive_bayes', 'percent_correct'], ['naive_bayes', 'mean_absolute_error']]
+
+
+def initWorker():
+    """
+    Initialize worker process: random generator must not share the state of the parent process
+    :return:
+    """
+    random.seed()
+
+
+def getSweepPoints(configuration):
+    """
+    Get configuration of each sweep point. Values in "sweepConfigs" list are applied over the
+    base configuration, then every combination of values in "sweep" grid is applied over each of them
+    :param configuration: Sweep configuration values {option: value}
+    :return: List [configuration values of each point, list of swept options]
+    """
+    baseConfiguration = {}
+    for option in configuration:
+        if option not in ['sweep', 'sweepConfigs']:
+            baseConfiguration[option] = configuration[option]
+
+    sweepConfigs = configuration['sweepConfigs'] if 'sweepConfigs' in configuration else [{}]
+    sweepGrid = configuration['sweep'] if 'sweep' in configuration else {}
+
+    # Swept options, displayed in results table
+    sweptOptions = sorted(sweepGrid)
+    for sweepConfig in sweepConfigs:
+        for option in sorted(sweepConfig):
+            if option not in sweptOptions:
+                sweptOptions.append(option)
+
+    pointConfigurations = []
+    for sweepConfig in sweepConfigs:
+        for gridValues in itertools.product(*[sweepGrid[option] for option in sorted(sweepGrid)]):
+            pointConfiguration = dict(baseConfiguration)
+            pointConfiguration.update(sweepConfig)
+            pointConfiguration.update(dict(zip(sorted(sweepGrid), gridValues)))
+            pointConfigurations.append(pointConfiguration)
+
+    return pointConfigurations, sweptOptions
+
+
+def runSweepPoint(pointNumber):
+    """
+    Perform UFSACO search for a sweep point, using shared dictionary and similarity matrix
+    :param pointNumber: Sweep point number
+    :return: Search results {point, features, search_time, stop_criterion, cycles}
+    """
+    sweepPoint = sweepPoints[pointNumber]
+    engineParameters = dict(sweepPoint['parameters'])
+
+    # Vectorized engines use the similarity matrix created once for all the points
+    if issubclass(ufsacoEngines[sweepPoint['engine']], UFSACOVectorized):
+        engineParameters['similarity'] = sweepSimilarity
+
+    print '[Sweep point #' + str(pointNumber + 1) + ' of ' + str(len(sweepPoints)) + ']'
+
+    aco = ufsacoEngines[sweepPoint['engine']](
+        dictionaryName='training',
+        dictionaryFolderHier='',
+        dictionary=sweepDictionary,
+        checkpointFileName=sweepPoint['name'] + '.' + fileconfig.checkpointFileName,
+        **engineParameters
+    )
+
+    searchStartTime = time.time()
+    aco.searchSubset()
+    searchTime = round(time.time() - searchStartTime, 4)
+
+    return {
+        'point': pointNumber,
+        'features': aco.getFeatureResults(topNumber=sweepPoint['top_features']),
+        'search_time': searchTime,
+        'stop_criterion': aco.stopCriterion,
+        'cycles': aco.completedCycles
+    }
+
+
+def getClassificationValues(classificationResult):
+    """
+    Get classification results of a feature selection as table values
+    :param classificationResult: Classification results {classifier: results}
+    :return: List of values for each classification column ('-' if classifier was not evaluated)
+    """
+    classificationValues = []
+    for classifierName, metricName in classificationColumns:
+        if classifierName in classificationResult:
+            classificationValues.append(str(round(classificationResult[classifierName][metricName], 4)))
+        else:
+            classificationValues.append('-')
+
+    return classificationValues
+
+
+def runLocalSweepPoints(numberProcesses):
+    """
+    Perform UFSACO search for all the sweep points using local worker processes. Similarities are
+    loaded once and inherited by the worker processes
+    :param numberProcesses: Number of worker processes
+    :return: List of search results {point, features, search_time, stop_criterion, cycles}
+    """
+    global sweepSimilarity
+
+    sweepDictionary.loadSimilarities()
+
+    sweepEngines = set([ufsacoEngines[sweepPoint['engine']] for sweepPoint in sweepPoints])
+    if any([issubclass(sweepEngine, UFSACOVectorized) for sweepEngine in sweepEngines]):
+        sweepSimilarity = sweepDictionary.getSimilarityMatrix()
+
+        # Dictionary similarities are only needed by engines not using the similarity matrix
+        if all([issubclass(sweepEngine, UFSACOVectorized) for sweepEngine in sweepEngines]):
+            sweepDictionary.freeSimilarities()
+
+    if numberProcesses > 1:
+        # Worker processes inherit loaded data when the pool is created
+        workerPool = multiprocessing.Pool(processes=numberProcesses, initializer=initWorker)
+        try:
+            sweepResults = workerPool.map(runSweepPoint, range(0, len(sweepPoints)), chunksize=1)
+        finally:
+            workerPool.close()
+            workerPool.join()
+    else:
+        sweepResults = [runSweepPoint(pointNumber) for pointNumber in range(0, len(sweepPoints))]
+
+    sweepSimilarity = None
+    sweepDictionary.freeSimilarities()
+
+    return sweepResults
+
+
+def runRemoteSweepPoints(coordinatorAddress, authKey, jobTimeout):
+    """
+    Perform UFSACO search for all the sweep points using workers connected through TCP
+    :param coordinatorAddress: Address to listen for workers [host, port]
+    :param authKey: Authentication key shared with workers
+    :param jobTimeout: Maximum number of seconds to wait for the results of a point (0 to wait without limit)
+    :return: List of search results {point, features, search_time, stop_criterion, cycles}
+    """
+    sweepJobs = []
+    for sweepPoint in sweepPoints:
+        sweepJobs.append({
+            'name': sweepPoint['name'],
+            'engine': sweepPoint['engine'],
+            'parameters': sweepPoint['parameters'],
+            'top_features': sweepPoint['top_features']
+        })
+
+    coordinator = UFSACOCoordinator(jobs=sweepJobs, host=coordinatorAddress[0], port=coordinatorAddress[1],
+                                    authKey=authKey, jobTimeout=jobTimeout)
+
+    sweepResults = []
+    for pointNumber, jobResult in enumerate(coordinator.run()):
+        if jobResult['type'] == 'error':
+            print '[Sweep point #' + str(pointNumber + 1) + ' failed: ' + jobResult['message'] + ']'
+            jobResult = {'features': [], 'search_time': '-', 'stop_criterion': 'error', 'cycles': '-'}
+
+        sweepResults.append({
+            'point': pointNumber,
+            'features': jobResult['features'],
+            'search_time': jobResult['search_time'],
+            'stop_criterion': jobResult['stop_criterion'],
+            'cycles': jobResult['cycles']
+        })
+
+    return sweepResults
+
+
+def main(configFileName, outputFilePath, numberProcesses, coordinatorAddress=None, authKey=None, jobTimeout=0):
+    """
+    UFSACO hyperparameter sweep. Training dictionary and similarities are loaded once and shared
+    by the searches of all the sweep points, which run concurrently on a pool of worker processes.
+    Selected features of each point are evaluated with a single JVM, and results of all the points
+    are written in one table.
+
+    Sweep configuration is a UFSACO configuration file with additional values:
+    * sweep: grid of values for each option {option: [values]}. Every combination is a sweep point
+    * sweepConfigs: list of configurations {option: value} applied over the base configuration
+
+    -f <file_name>: file name with JSON extension inside the "ufsacoconf" folder.
+
+    -o <file_path>: file to store results table. If not defined, show results on screen.
+
+    -p <number>: number of worker processes (default: number of CPUs)
+
+    --listen <host:port>: distribute sweep points to workers connected through TCP (ufsaco.worker.py)
+                          instead of using local worker processes
+
+    --authkey <key>: authentication key shared with workers. Required to listen on an address other than
+                     a loopback address, otherwise a random key is created and shown
+    :return:
+    """
+    global sweepDictionary, sweepPoints
+
+    # Workers exchange pickled objects with the coordinator, so they must authenticate with a secret key
+    if coordinatorAddress is not None and authKey is None:
+        if not isLoopbackHost(coordinatorAddress[0]):
+            print 'Authentication key (--authkey) is required to listen on ' + coordinatorAddress[0] + \
+                  '. Execution aborted.'
+            return
+
+        authKey = createAuthKey()
+        print '[Authentication key for workers: ' + authKey + ']'
+
+    """
+    TASK 1: Load sweep configuration and get configuration of each point
+    """
+    configFile = dirconfig.ufsacoConfigPath + configFileName + '.json'
+
+    if not os.path.exists(configFile):
+        print 'Configuration file ' + configFile + ' does not exist. Execution aborted.'
+        return
+
+    with open(configFile, 'r') as configFile:
+        configuration = json.loads(configFile.read())
+        configFile.close()
+
+    pointConfigurations, sweptOptions = getSweepPoints(configuration=configuration)
+
+    sweepPoints = []
+    for pointNumber, pointConfiguration in enumerate(pointConfigurations):
+        # Get UFSACO engine and its parameters, terminate process if configuration is not valid
+        engineConfiguration = getEngineConfiguration(configuration=pointConfiguration)
+        if engineConfiguration is None:
+            return
+
+        engineName, engineParameters = engineConfiguration
+
+        # Worker processes can not start processes of their own
+        if numberProcesses > 1 and coordinatorAddress is None and 'numberProcesses' in engineParameters:
+            engineParameters['numberProcesses'] = 1
+
+        # Each point stores visited features in its own file (local or remote)
+        if 'historyFilePath' in engineParameters:
+            engineParameters['historyFilePath'] += '.' + str(pointNumber)
+
+        sweepPoints.append({
+            'name': configFileName + '.' + str(pointNumber),
+            'configuration': pointConfiguration,
+            'engine': engineName,
+            'parameters': engineParameters,
+            'top_features': pointConfiguration['topFeatures']
+        })
+
+    """
+    TASK 2: Load training dictionary once for all the sweep points
+    """
+    print '[Loading training dictionary]'
+    sweepDictionary = Dictionary(dictionaryName='training', folderHierarchy='')
+    if sweepDictionary.loadFromDisk() is False:
+        print 'Training dictionary does not exist. Execution aborted.'
+        return
+
+    """
+    TASK 3: Perform UFSACO search for all the sweep points
+    """
+    sweepStartTime = time.time()
+
+    if coordinatorAddress is not None:
+        # Remote workers load the dictionary from their own dictionary folder
+        sweepResults = runRemoteSweepPoints(coordinatorAddress=coordinatorAddress, authKey=authKey,
+                                            jobTimeout=jobTimeout)
+    else:
+        sweepResults = runLocalSweepPoints(numberProcesses=numberProcesses)
+
+    sweepTime = round(time.time() - sweepStartTime, 4)
+
+    """
+    TASK 4: Evaluate selected features of each point using a single JVM
+    """
+    # Information Gain and Gain Ratio are evaluated once for each number of top features
+    baselineTopFeatures = sorted(set([sweepPoint['top_features'] for sweepPoint in sweepPoints]))
+
+    testDictionary = Dictionary(dictionaryName='test', folderHierarchy='')
+    testDictionary.loadFromDisk()
+
+    baselineResults = {}
+    try:
+        # Start JVM. Configure JAVA maximum memory heap as desired
+        jvm.start(max_heap_size='2g')
+
+        for sweepResult in sweepResults:
+            # Points without selected features (failed search) are not evaluated
+            if len(sweepResult['features']) == 0:
+                sweepResult['classification'] = {}
+                continue
+
+            sweepResult['classification'] = classifyFeatures(
+                arffPrefix=sweepPoints[sweepResult['point']]['name'],
+                trainingDict=sweepDictionary,
+                testDictionary=testDictionary,
+                featureList={'ufsaco': sweepResult['features']}
+            )['ufsaco']
+
+        for topFeatures in baselineTopFeatures:
+            baselineResults[topFeatures] = classifyFeatures(
+                arffPrefix=configFileName + '.top' + str(topFeatures),
+                trainingDict=sweepDictionary,
+                testDictionary=testDictionary,
+                featureList={
+                    'info_gain': sweepDictionary.getInformationGainTopFeatures(topNumber=topFeatures,
+                                                                               onlyTokens=True),
+                    'gain_ratio': sweepDictionary.getGainRatioTopFeatures(topNumber=topFeatures, onlyTokens=True)
+                }
+            )
+    finally:
+        if jvm.started is True:
+            jvm.stop()  # Stop JVM
+
+    """
+    TASK 5: Output results table (tab separated) in file or screen
+    """
+    tableRows = [
+        ['point', 'selection'] + sweptOptions + ['topFeatures', 'stop_criterion', 'cycles', 'search_time'] +
+        [classifierName + '_' + metricName for classifierName, metricName in classificationColumns] + ['features']
+    ]
+
+    for sweepResult in sweepResults:
+        sweepPoint = sweepPoints[sweepResult['point']]
+        tableRows.append(
+            [str(sweepResult['point'] + 1), 'ufsaco'] +
+            [json.dumps(sweepPoint['configuration'][option]) if option in sweepPoint['configuration'] else '-'
+             for option in sweptOptions] +
+            [str(sweepPoint['top_features']), sweepResult['stop_criterion'], str(sweepResult['cycles']),
+             str(sweepResult['search_time'])] +
+            getClassificationValues(sweepResult['classification']) + [' '.join(sweepResult['features'])]
+        )
+
+    for topFeatures in baselineTopFeatures:
+        for featureType in ['info_gain', 'gain_ratio']:
+            tableRows.append(
+                ['-', featureType] + ['-' for _ in sweptOptions] + [str(topFeatures), '-', '-', '-'] +
+                getClassificationValues(baselineResults[topFeatures][featureType]) + ['-']
+            )
+
+    # Verify if output is in screen or file. Try to open output file, otherwise show in screen
+    outputFile = sys.stdout
+    if outputFilePath is not None:
+        try:
+            outputFile = open(outputFilePath, 'w')
+        except IOError:
+            outputFile = sys.stdout
+
+    if coordinatorAddress is not None:
+        sweepWorkers = 'remote workers'
+    else:
+        sweepWorkers = str(numberProcesses) + ' processes'
+
+    outputFile.write('[UFSACO sweep: ' + str(len(sweepPoints)) + ' points searched in ' + str(sweepTime) +
+                     ' seconds using ' + sweepWorkers + ']\n')
+
+    for tableRow in tableRows:
+        outputFile.write('\t'.join(tableRow) + '\n')
+
+    if outputFile is not sys.stdout:
+        outputFile.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Execute UFSACO algorithm for a grid or a list of configurations, loading the training dictionary only once. Results of all the configurations are written in one table.")
+
+    # File configuration argument definition
+    parser.add_argument("-f",
+                        metavar='FILE_NAME_CONFIGURATION',
+                        type=str,
+                        help="File name to extract sweep configuration. Files are obtained from the \"ufsacoconf\" folder, configured in dirconfig.py. Do not include JSON extension, it is added automatically.")
+
+    # Results output file argument definition
+    parser.add_argument("-o",
+                        metavar='RESULTS_OUTPUT_FILE_NAME',
+                        type=str,
+                        default=None,
+                        help="File name to save results table.")
+
+    # Number of processes argument definition
+    parser.add_argument("-p",
+                        metavar='NUMBER_PROCESSES',
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of worker processes running sweep points (default: number of CPUs).")
+
+    # Coordinator address argument definition
+    parser.add_argument("--listen",
+                        metavar='HOST:PORT',
+                        type=str,
+                        default=None,
+                        help="Distribute sweep points to workers connected through TCP (see ufsaco.worker.py) instead of using local processes.")
+
+    # Authentication key argument definition
+    parser.add_argument("--authkey",
+                        metavar='AUTHENTICATION_KEY',
+                        type=str,
+                        default=None,
+                        help="Authentication key shared with workers. Required to listen on an address other than a loopback address (default: random key, shown when the sweep starts).")
+
+    # Job timeout argument definition
+    parser.add_argument("--timeout",
+                        metavar='SECONDS',
+                        type=int,
+                        default=0,
+                        help="Maximum number of seconds a worker may spend on a sweep point. Points of lost workers are sent to other workers (default: 0, no limit).")
+
+    args = parser.parse_args()
+
+    listenAddress = None
+    if args.listen is not None:
+        listenHost, listenPort = args.listen.rsplit(':', 1)
+        listenAddress = (listenHost, int(listenPort))
+
+    sys.exit(main(configFileName=args.f, outputFilePath=args.o, numberProcesses=max(args.p, 1),
+                  coordinatorAddress=listenAddress, authKey=args.authkey, jobTimeout=args.timeout))
@@ -0,0 +1,52 @@
+import sys
+import argparse
+
+from classes.UFSACOCluster import UFSACOWorker
+from classes.UFSACOEngines import ufsacoEngines
+
+
+def main(coordinatorAddress, authKey, workerName):
+    """
+    UFSACO worker. Connects to a sweep coordinator (ufsaco.sweep.py --listen) and performs the
+    searches sent by it. Dictionaries are loaded from the folder configured in
+    /acofeatures/classes/config/dirconfig.py, which must contain the same dictionaries as the
+    coordinator host.
+
+    --connect <host:port>: address of the coordinator
+
+    --authkey <key>: authentication key of the coordinator
+    :return:
+    """
+    worker = UFSACOWorker(engines=ufsacoEngines, host=coordinatorAddress[0], port=coordinatorAddress[1],
+                          authKey=authKey, workerName=workerName)
+    worker.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Execute UFSACO searches sent by a sweep coordinator through TCP.")
+
+    # Coordinator address argument definition
+    parser.add_argument("--connect",
+                        metavar='HOST:PORT',
+                        type=str,
+                        help="Address of the sweep coordinator (ufsaco.sweep.py --listen).")
+
+    # Authentication key argument definition
+    parser.add_argument("--authkey",
+                        metavar='AUTHENTICATION_KEY',
+                        type=str,
+                        required=True,
+                        help="Authentication key shared with the coordinator (shown by the coordinator when it creates a random key).")
+
+    # Worker name argument definition
+    parser.add_argument("--name",
+                        metavar='WORKER_NAME',
+                        type=str,
+                        default=None,
+                        help="Name to identify the worker in coordinator messages (default: host name and process ID).")
+
+    args = parser.parse_args()
+
+    connectHost, connectPort = args.connect.rsplit(':', 1)
+    sys.exit(main(coordinatorAddress=(connectHost, int(connectPort)), authKey=args.authkey, workerName=args.name))